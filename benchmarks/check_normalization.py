@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 01:40:05 2026
+
+@author: kindi
+
+Comprobación de la normalización en el propio proceso (pysam) frente a bcftools.
+
+Normaliza el mismo VCF con los dos motores de normalize_vcf y compara sus registros (la cabecera no se
+compara: bcftools añade sus propias líneas). Sin --vcf, genera en el espacio de trabajo una referencia
+sintética con repeticiones y homopolímeros y un VCF con SNV, MNP, indels desplazables a la izquierda,
+sitios multialélicos con campos por alelo (A, R y G), genotipos con fase, duplicados y registros con un
+REF que no coincide con la referencia; cada caso se comprueba sin comprimir (-T) y comprimido e indexado
+con una región (-R). Necesita bcftools (no el sustituto de las pruebas de rendimiento) y pysam.
+
+Antes se comprueban unos casos fijos con la salida conocida de bcftools (separación de campos R y G,
+genotipos haploides y con fase, alineamiento a la izquierda hasta la posición 1, REF que no coincide y
+duplicados), que no necesitan bcftools ni pysam: con --cases_only solo se comprueban esos casos, y
+run_benchmarks.py los comprueba antes de medir.
+
+@Usage python3 benchmarks/check_normalization.py
+       python3 benchmarks/check_normalization.py --cases_only
+       python3 benchmarks/check_normalization.py --vcf panel.vcf.gz --assembly 37
+"""
+import os
+import sys
+import gzip
+import random
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+REPO_PATH = os.path.dirname(BENCHMARKS_PATH)
+sys.path.insert(0, REPO_PATH)
+
+from modules.normalize_vcf import normalize_vcf, get_reference
+from modules.normalize_native import normalize_records
+from modules.workspace import Workspace
+
+CHROMS = ["1", "2"]
+CHROM_LENGTH = 20000
+
+VCF_HEADER = """##fileformat=VCFv4.2
+##contig=<ID=1,length={length}>
+##contig=<ID=2,length={length}>
+##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency">
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">
+##FORMAT=<ID=PL,Number=G,Type=Integer,Description="Phred-scaled genotype likelihoods">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2
+"""
+
+def check_arguments():
+    parser = argparse.ArgumentParser(description="Compara la normalización con pysam y con bcftools.")
+    parser.add_argument("--vcf", default=None, help="VCF a comprobar (por defecto, uno sintético con su referencia)")
+    parser.add_argument("--assembly", choices=["37", "38"], default="37", help="Ensamblaje del VCF indicado con --vcf")
+    parser.add_argument("--regions_bed", default=None, help="BED de las regiones que se normalizan (con --vcf)")
+    parser.add_argument("--records", type=int, default=2000, help="Registros del VCF sintético")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla de los datos sintéticos")
+    parser.add_argument("--workdir", default=os.path.join(BENCHMARKS_PATH, "work_normalization"), help="Espacio de trabajo")
+    parser.add_argument("--cases_only", action="store_true", help="Comprobar solo los casos fijos (sin bcftools ni pysam)")
+    return parser.parse_args()
+
+# Casos fijos: referencia, registros de entrada y registros que produce bcftools norm -m -any --check-ref w
+# seguido de bcftools norm --rm-dup none (POS, REF, ALT, INFO y muestras)
+CASES_REFERENCE = {"1": "AAACGTTGCACACATGGC", "2": "TTTGCACACATCC"}
+
+# Entrada ordenada, como la espera bcftools
+CASES_VCF = [
+    # Deleción en el homopolímero del principio del cromosoma, ya alineada y sin alinear: duplicado tras alinear
+    ["1", "1", ".", "AA", "A", "50", "PASS", ".", "GT", "0/1", "1"],
+    ["1", "2", ".", "AA", "A", "50", "PASS", ".", "GT", "0/1", "1"],
+    # Multialélico con AF (A), AD (R) y PL (G) en una muestra diploide con fase y una haploide
+    ["1", "5", ".", "G", "C,T", "50", "PASS", "AF=0.1,0.2;DP=30", "GT:AD:PL", "1|2:10,5,3:0,1,2,3,4,5", "2:7,1,2:0,10,20"],
+    # Genotipo con un alelo desconocido
+    ["1", "11", ".", "C", "A,G", "50", "PASS", "AF=0.3,0.4", "GT:AD", "./2:4,0,6", "1:2,3,0"],
+    # Inserción en el homopolímero del principio del cromosoma: se alinea hasta la posición 1
+    ["2", "3", ".", "T", "TT", "50", "PASS", ".", "GT", "1/1", "0"],
+    # Deleción de una repetición CA que se desplaza a la izquierda
+    ["2", "8", ".", "ACA", "A", "50", "PASS", ".", "GT", "0/1", "0"],
+    # REF que no coincide con la referencia: se deja igual
+    ["2", "12", ".", "G", "T", "50", "PASS", ".", "GT", "0/1", "1"],
+]
+
+CASES_EXPECTED = [
+    ["1", "1", ".", "AA", "A", "50", "PASS", ".", "GT", "0/1", "1"],
+    ["1", "5", ".", "G", "C", "50", "PASS", "AF=0.1;DP=30", "GT:AD:PL", "1|0:10,5:0,1,2", "0:7,1:0,10"],
+    ["1", "5", ".", "G", "T", "50", "PASS", "AF=0.2;DP=30", "GT:AD:PL", "0|1:10,3:0,3,5", "1:7,2:0,20"],
+    ["1", "11", ".", "C", "A", "50", "PASS", "AF=0.3", "GT:AD", "./0:4,0", "1:2,3"],
+    ["1", "11", ".", "C", "G", "50", "PASS", "AF=0.4", "GT:AD", "./1:4,6", "0:2,0"],
+    ["2", "1", ".", "T", "TT", "50", "PASS", ".", "GT", "1/1", "0"],
+    ["2", "4", ".", "GCA", "G", "50", "PASS", ".", "GT", "0/1", "0"],
+    ["2", "12", ".", "G", "T", "50", "PASS", ".", "GT", "0/1", "1"],
+]
+
+class SequenceFasta:
+    """
+    Genoma de referencia en memoria con la interfaz de pysam.FastaFile que usa normalize_native.
+    """
+    def __init__(self, sequences):
+        self.sequences = sequences
+        self.references = list(sequences)
+
+    def fetch(self, chrom, start, end):
+        return self.sequences[chrom][start:end]
+
+def check_known_cases():
+    """
+    Normaliza los casos fijos con el motor de pysam (sin pysam: la referencia está en memoria) y los compara
+    con la salida conocida de bcftools.
+
+    Returns:
+        bool: True si todos los registros coinciden.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vcf_path = os.path.join(tmp_dir, "cases.vcf")
+        with open(vcf_path, "w") as vcf:
+            vcf.write(VCF_HEADER.format(length=max(len(sequence) for sequence in CASES_REFERENCE.values())))
+            for record in CASES_VCF:
+                vcf.write("\t".join(record) + "\n")
+        _, records, ref_mismatches = normalize_records(vcf_path, SequenceFasta(CASES_REFERENCE))
+    differences = [(expected, record) for expected, record in zip(CASES_EXPECTED, records) if expected != record]
+    if not differences and len(records) == len(CASES_EXPECTED) and ref_mismatches == 1:
+        print(f"Casos fijos: {len(records)} registros idénticos a los de bcftools.")
+        return True
+    print(f"Casos fijos: {len(records)} registros (se esperaban {len(CASES_EXPECTED)}), {ref_mismatches} avisos de referencia "
+          f"(se esperaba 1), {len(differences)} diferentes.")
+    for expected, record in differences:
+        print(f"  bcftools: {' '.join(expected)}\n  pysam:    {' '.join(record)}")
+    return False
+
+def generate_reference(reference_path, seed):
+    """
+    Escribe una referencia sintética con homopolímeros y repeticiones en tándem intercalados, y un homopolímero
+    al principio de cada cromosoma.
+
+    Returns:
+        dict: Secuencia de cada cromosoma.
+    """
+    rng = random.Random(seed)
+    sequences = {}
+    for chrom in CHROMS:
+        sequence = list(rng.choice("ACGT") * 6)
+        while len(sequence) < CHROM_LENGTH:
+            kind = rng.random()
+            if kind < 0.1:
+                sequence += rng.choice("ACGT") * rng.randint(3, 12)
+            elif kind < 0.2:
+                sequence += list("".join(rng.choice("ACGT") for _ in range(rng.randint(2, 4))) * rng.randint(2, 6))
+            else:
+                sequence += [rng.choice("ACGT") for _ in range(rng.randint(5, 30))]
+        sequences[chrom] = "".join(sequence[:CHROM_LENGTH])
+    with open(reference_path, "w") as fasta:
+        for chrom, sequence in sequences.items():
+            fasta.write(f">{chrom}\n")
+            for i in range(0, len(sequence), 60):
+                fasta.write(sequence[i:i + 60] + "\n")
+    return(sequences)
+
+def random_alt(rng, sequence, pos, ref):
+    """
+    Alelo alternativo aleatorio para un REF en pos (base 1): SNV, MNP con bases comunes, inserción o
+    deleción (representada a la derecha, como en muchos llamadores) o una variante compleja.
+    """
+    kind = rng.random()
+    if kind < 0.35:
+        return rng.choice([base for base in "ACGT" if base != ref[0]]) + ref[1:]
+    if kind < 0.45 and len(ref) > 2:
+        return ref[0] + rng.choice([base for base in "ACGT" if base != ref[1]]) + ref[2:]
+    if kind < 0.7:
+        # Inserción: repetir un fragmento de la secuencia siguiente (desplazable a la izquierda)
+        return ref + sequence[pos:pos + rng.randint(1, 4)]
+    if kind < 0.9 and len(ref) > 1:
+        return ref[:rng.randint(1, len(ref) - 1)]
+    return ref[0] + "".join(rng.choice("ACGT") for _ in range(rng.randint(1, 3)))
+
+def random_sample(rng, n_alleles, ploidy=2):
+    """
+    Columna de una muestra: GT (con o sin fase, con alelos desconocidos; haploide con ploidy=1), AD (R) y PL (G).
+    """
+    separator = rng.choice("/|")
+    alleles = [str(rng.randrange(n_alleles)) if rng.random() > 0.05 else "." for _ in range(ploidy)]
+    ad = ",".join(str(rng.randint(0, 40)) for _ in range(n_alleles))
+    n_genotypes = n_alleles if ploidy == 1 else n_alleles * (n_alleles + 1) // 2
+    pl = ",".join(str(rng.randint(0, 200)) for _ in range(n_genotypes))
+    return f"{separator.join(alleles)}:{ad}:{pl}"
+
+def generate_vcf(vcf_path, sequences, n_records, seed):
+    """
+    Escribe un VCF sintético ordenado, con sitios multialélicos, duplicados, REF que no coinciden con la
+    referencia, genotipos haploides en la segunda muestra y variantes al principio del cromosoma (que se
+    alinean hasta la posición 1).
+    """
+    rng = random.Random(f"{seed}:vcf")
+    records = []
+    for _ in range(n_records):
+        chrom = rng.choice(CHROMS)
+        sequence = sequences[chrom]
+        pos = rng.randint(1, 4) if rng.random() < 0.02 else rng.randint(1, CHROM_LENGTH - 20)
+        ref = sequence[pos - 1:pos - 1 + rng.choice([1, 1, 1, 2, 3, 5])]
+        if rng.random() < 0.02:
+            ref = "".join(rng.choice("ACGT") for _ in ref)
+        alts = []
+        for _ in range(1 if rng.random() < 0.75 else rng.randint(2, 3)):
+            alt = random_alt(rng, sequence, pos, ref)
+            if alt != ref and alt not in alts:
+                alts.append(alt)
+        if not alts:
+            continue
+        info = f"AF={','.join(str(round(rng.random(), 3)) for _ in alts)};DP={rng.randint(10, 100)}"
+        samples = [random_sample(rng, len(alts) + 1), random_sample(rng, len(alts) + 1, 1 if rng.random() < 0.2 else 2)]
+        record = [chrom, str(pos), ".", ref, ",".join(alts), "50", "PASS", info, "GT:AD:PL"] + samples
+        records.append(record)
+        if rng.random() < 0.03:
+            records.append(list(record))
+    records.sort(key=lambda record: (CHROMS.index(record[0]), int(record[1])))
+    with open(vcf_path, "w") as vcf:
+        vcf.write(VCF_HEADER.format(length=CHROM_LENGTH))
+        for record in records:
+            vcf.write("\t".join(record) + "\n")
+
+def read_records(vcf_path):
+    with gzip.open(vcf_path, "rt") as vcf:
+        return [line for line in vcf if not line.startswith("#")]
+
+def compare_engines(name, vcf_path, workdir, assembly, regions_bed=None):
+    """
+    Normaliza un VCF con bcftools y con pysam y compara los registros.
+
+    Returns:
+        bool: True si los registros son idénticos.
+    """
+    results = {}
+    for engine in ["bcftools", "pysam"]:
+        workspace = Workspace(os.path.join(workdir, "temp", name, engine), name)
+        output_vcf = normalize_vcf(vcf_path, workspace, assembly, force=True, regions_bed=regions_bed, engine=engine)
+        if output_vcf is None:
+            print(f"{name}: la normalización con {engine} ha fallado.")
+            return False
+        results[engine] = read_records(output_vcf)
+    differences = [(i, bcftools_line, pysam_line) for i, (bcftools_line, pysam_line) in enumerate(zip(results["bcftools"], results["pysam"]))
+                   if bcftools_line != pysam_line]
+    if not differences and len(results["bcftools"]) == len(results["pysam"]):
+        print(f"{name}: {len(results['pysam'])} registros idénticos.")
+        return True
+    print(f"{name}: {len(results['bcftools'])} registros con bcftools, {len(results['pysam'])} con pysam, {len(differences)} diferentes.")
+    for i, bcftools_line, pysam_line in differences[:10]:
+        print(f"  registro {i + 1}:\n    bcftools: {bcftools_line.rstrip()}\n    pysam:    {pysam_line.rstrip()}")
+    return False
+
+def main():
+    args = check_arguments()
+    if not check_known_cases():
+        sys.exit(1)
+    if args.cases_only:
+        sys.exit(0)
+    import pysam
+    version = subprocess.run(["bcftools", "--version"], capture_output=True, text=True).stdout
+    if "stub" in version:
+        print("bcftools es el sustituto de las pruebas de rendimiento, que no alinea a la izquierda: se necesita bcftools.")
+        sys.exit(1)
+
+    if args.vcf is not None:
+        # VCF indicado: referencia del ensamblaje, relativa al directorio actual, como en la herramienta
+        vcf_path = os.path.abspath(args.vcf)
+        regions_bed = os.path.abspath(args.regions_bed) if args.regions_bed else None
+        workdir = os.path.abspath(args.workdir)
+        ok = compare_engines(os.path.basename(vcf_path).split(".vcf")[0], vcf_path, workdir, args.assembly, regions_bed)
+        sys.exit(0 if ok else 1)
+
+    # VCF sintético, con la referencia en la ruta que espera la herramienta dentro del espacio de trabajo
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    reference = get_reference("37")
+    sequences = generate_reference(reference, args.seed)
+    pysam.faidx(reference)
+    vcf_path = os.path.join(workdir, "synthetic.vcf")
+    generate_vcf(vcf_path, sequences, args.records, args.seed)
+    pysam.tabix_compress(vcf_path, f"{vcf_path}.gz", force=True)
+    pysam.tabix_index(f"{vcf_path}.gz", preset="vcf", force=True)
+    regions_bed = os.path.join(workdir, "regions.bed")
+    with open(regions_bed, "w") as bed:
+        bed.write(f"1\t1000\t8000\n2\t5000\t{CHROM_LENGTH}\n")
+
+    ok = all([compare_engines("plain", vcf_path, workdir, "37"),
+              compare_engines("plain_regions", vcf_path, workdir, "37", regions_bed),
+              compare_engines("indexed_regions", f"{vcf_path}.gz", workdir, "37", regions_bed)])
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
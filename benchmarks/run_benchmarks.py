@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:10:37 2026
+
+@author: kindi
+
+Pruebas de rendimiento de extremo a extremo con datos sintéticos.
+
+Prepara un espacio de trabajo aislado (catálogos con coordenadas sintéticas en lugar de BioMart, ClinVar
+sintético y sustitutos de bcftools e InterVar en el PATH), genera VCF de distintos tamaños y ejecuta la
+herramienta en modo básico y avanzado. De cada ejecución se guardan el tiempo, la memoria máxima y el
+rendimiento (registros/s) de cada etapa, a partir de la traza de la ejecución, y de la ejecución completa.
+
+@Usage python3 benchmarks/run_benchmarks.py --sizes 1000,100000,5000000 --modes basic,advanced
+       python3 benchmarks/run_benchmarks.py --sizes 1000,100000 --baseline benchmarks/results/benchmark_20261018_161037.tsv
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from datetime import datetime
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+REPO_PATH = os.path.dirname(BENCHMARKS_PATH)
+sys.path.insert(0, REPO_PATH)
+
+from modules.get_json_bed import read_csv
+from modules.get_clinvar import split_clinvar_data
+from modules.trace import RunTrace, trace_stage, count_lines
+from modules.workspace import Workspace
+from check_normalization import check_known_cases
+from synthetic_data import (read_catalog_genes, read_fg_variants, get_gene_coordinates, write_catalogs,
+                            generate_gene_variants, generate_vcf, generate_clinvar_summary, data_is_current,
+                            write_data_params)
+
+RESULT_COLUMNS = ["size", "mode", "stage", "category", "wall_seconds", "cpu_seconds", "children_cpu_seconds",
+                  "peak_rss_mb", "records_in", "records_out", "records_per_second"]
+
+def benchmark_arguments():
+    parser = argparse.ArgumentParser(description="Pruebas de rendimiento con datos sintéticos y sustitutos de bcftools, InterVar y BioMart.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Número de variantes de cada VCF sintético, separados por comas (hasta 5000000)")
+    parser.add_argument("--modes", default="basic,advanced", help="Modos a medir, separados por comas")
+    parser.add_argument("--categories", default="pr,rr,fg", help="Categorías a analizar")
+    parser.add_argument("--assembly", choices=["37", "38"], default="37", help="Ensamblaje genómico")
+    parser.add_argument("--evidence", type=int, default=1, help="Nivel de evidencia de ClinVar en modo avanzado")
+    parser.add_argument("--clinvar_records", type=int, default=200000, help="Variantes del archivo ClinVar sintético (por ensamblaje)")
+    parser.add_argument("--jobs", type=int, default=1, help="Valor de --jobs de la herramienta")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla de los datos sintéticos")
+    parser.add_argument("--warm", action="store_true", help="No forzar las etapas con checkpoint (mide la ejecución con la caché de etapas)")
+    parser.add_argument("--workdir", default=os.path.join(BENCHMARKS_PATH, "work"), help="Espacio de trabajo de las pruebas")
+    parser.add_argument("--out", default=None, help="Archivo TSV de resultados (por defecto, benchmarks/results/benchmark_<fecha>.tsv)")
+    parser.add_argument("--baseline", default=None, help="Resultados anteriores con los que comparar para detectar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Aumento relativo del tiempo de una etapa que se considera una regresión")
+    return parser.parse_args()
+
+def setup_workspace(workdir, assembly, clinvar_records, seed):
+    """
+    Prepara el espacio de trabajo: configuración, catálogos, ClinVar sintético y sustitutos de las herramientas.
+
+    Los JSON y BED de PR y RR se escriben con coordenadas sintéticas, de modo que la herramienta no
+    consulta BioMart. Los catálogos FG se generan desde sus CSV durante la primera ejecución, como siempre.
+
+    Args:
+        workdir (str): Ruta al espacio de trabajo.
+        assembly (str): Ensamblaje genómico ("37" o "38").
+        clinvar_records (int): Variantes del archivo ClinVar sintético.
+        seed (int): Semilla de los datos sintéticos.
+
+    Returns:
+        dict: Genes con coordenadas, variantes de ClinVar y variantes FG para generar los VCF, y las
+              filas de resultados de la preparación (procesado de ClinVar).
+    """
+    categories_path = os.path.join(workdir, "categories/")
+    for folder in ["categories/PR", "categories/RR", "categories/FG", "InterVar", "bin", "clinvar", "temp",
+                   "final_output", "vcfs", "logs"]:
+        os.makedirs(os.path.join(workdir, folder), exist_ok=True)
+
+    # Configuración con las mismas rutas relativas que la herramienta
+    with open(os.path.join(REPO_PATH, "config.json"), "r") as config_file:
+        config_data = json.load(config_file)
+    config_data["categories"] = ""
+    config_data["clinvar_update"] = "no"
+    with open(os.path.join(workdir, "config.json"), "w") as config_file:
+        json.dump(config_data, config_file)
+
+    # Catálogos: CSV originales y JSON/BED con coordenadas sintéticas (en lugar de BioMart)
+    for category in ["PR", "RR", "FG"]:
+        for file in os.listdir(os.path.join(REPO_PATH, "categories", category)):
+            if file.endswith(".csv"):
+                shutil.copy(os.path.join(REPO_PATH, "categories", category, file), os.path.join(categories_path, category, file))
+    catalog_genes = read_catalog_genes(categories_path)
+    gene_coordinates = get_gene_coordinates(catalog_genes["pr"] + catalog_genes["rr"], seed)
+    write_catalogs(categories_path, assembly, catalog_genes, gene_coordinates, read_csv)
+
+    # Sustitutos de bcftools e InterVar
+    for stub, destination in [("bcftools", "bin/bcftools"), ("Intervar.py", "InterVar/Intervar.py")]:
+        shutil.copy(os.path.join(BENCHMARKS_PATH, "stubs", stub), os.path.join(workdir, destination))
+        os.chmod(os.path.join(workdir, destination), 0o755)
+    with open(os.path.join(workdir, "InterVar", "config.ini"), "w") as config_ini:
+        config_ini.write("# InterVar (stub) para las pruebas de rendimiento\n")
+
+    # ClinVar sintético con el formato de variant_summary.txt.gz, procesado como lo hace la herramienta
+    clinvar_path = os.path.join(workdir, "clinvar/")
+    known_variants = generate_gene_variants(gene_coordinates, max(clinvar_records // 10, 1), f"{seed}:clinvar")
+    setup_rows = []
+    summary_gz = f"{clinvar_path}variant_summary.txt.gz"
+    release_date = datetime(2026, 1, 1)
+    clinvar_db = f"{clinvar_path}clinvar_database_GRCh37_{release_date.strftime('%Y%m%d')}.txt"
+    # Los parámetros se guardan fuera del directorio clinvar, donde la herramienta busca la versión más reciente
+    params = {"clinvar_records": clinvar_records, "seed": seed}
+    params_file = os.path.join(workdir, "clinvar_synthetic.params.json")
+    if not data_is_current(clinvar_db, params, params_file):
+        for file in os.listdir(clinvar_path):
+            os.remove(os.path.join(clinvar_path, file))
+        print(f"Generando ClinVar sintético ({clinvar_records} variantes por ensamblaje)...")
+        n_rows = generate_clinvar_summary(summary_gz, known_variants, clinvar_records, gene_coordinates, seed)
+        trace = RunTrace(summary_gz)
+        with trace_stage(trace, "split_clinvar_data", inputs=[summary_gz]) as stage:
+            output_files = split_clinvar_data(release_date, clinvar_path)
+            stage["records_in"] = n_rows
+            stage["records_out"] = sum(count_lines(output_file) - 1 for output_file in output_files.values())
+            stage["outputs"] = list(output_files.values())
+        setup_rows = [get_result_row("setup", "-", stage) for stage in trace.stages]
+        os.remove(summary_gz)
+        write_data_params(clinvar_db, params, params_file)
+
+    return {"gene_coordinates": gene_coordinates, "known_variants": known_variants,
+            "fg_variants": read_fg_variants(categories_path, assembly), "setup_rows": setup_rows}
+
+def get_records_per_second(records, seconds):
+    if records is None or not seconds:
+        return None
+    return round(records / seconds, 1)
+
+def get_result_row(size, mode, stage):
+    """
+    Convierte una etapa de la traza en una fila de resultados.
+    """
+    row = {"size": size, "mode": mode, "stage": stage["stage"], "category": stage.get("category", "-")}
+    for column in ["wall_seconds", "cpu_seconds", "children_cpu_seconds", "peak_rss_mb", "records_in", "records_out"]:
+        row[column] = stage.get(column)
+    records = stage.get("records_in") if stage.get("records_in") is not None else stage.get("records_out")
+    row["records_per_second"] = get_records_per_second(records, stage.get("wall_seconds"))
+    return(row)
+
+def run_pipeline(workdir, vcf_file, mode, args, log_file):
+    """
+    Ejecuta la herramienta sobre un VCF en el espacio de trabajo, con los sustitutos en el PATH.
+
+    Returns:
+        tuple: Código de salida, tiempo real (s) y memoria máxima del proceso (MB).
+    """
+    cmd = [sys.executable, os.path.join(REPO_PATH, "secondary_findings.py"), vcf_file,
+           "--mode", mode, "--evidence", str(args.evidence), "--assembly", args.assembly,
+           "--categories", args.categories, "--clinvar_update", "no", "--jobs", str(args.jobs)]
+    if not args.warm:
+        cmd += ["--force_stage", "all"]
+    env = dict(os.environ, PATH=f"{os.path.join(workdir, 'bin')}{os.pathsep}{os.environ.get('PATH', '')}")
+
+    start = time.perf_counter()
+    with open(log_file, "w") as log:
+        process = subprocess.Popen(cmd, cwd=workdir, env=env, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 devuelve el uso de recursos de este proceso, no el acumulado de todos los hijos
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+    return(process.returncode, wall, round(usage.ru_maxrss / 1024, 1))
+
+def benchmark_size(workdir, size, workspace, args):
+    """
+    Genera el VCF sintético de un tamaño y mide la herramienta en cada modo.
+
+    Returns:
+        list: Filas de resultados por etapa y de la ejecución completa.
+    """
+    vcf_name = f"synthetic_{size}_s{args.seed}"
+    vcf_file = f"vcfs/{vcf_name}.vcf"
+    params = {"size": size, "seed": args.seed, "assembly": args.assembly, "clinvar_records": args.clinvar_records}
+    if not data_is_current(os.path.join(workdir, vcf_file), params):
+        print(f"Generando VCF sintético de {size} variantes...")
+        generate_vcf(os.path.join(workdir, vcf_file), size, workspace["gene_coordinates"], workspace["known_variants"],
+                     workspace["fg_variants"], args.seed)
+        write_data_params(os.path.join(workdir, vcf_file), params)
+    n_records = count_lines(os.path.join(workdir, vcf_file))
+
+    rows = []
+    for mode in args.modes.split(","):
+        print(f"Midiendo {vcf_name} en modo {mode}...")
+        log_file = os.path.join(workdir, "logs", f"{vcf_name}_{mode}.log")
+        returncode, wall, peak_rss = run_pipeline(workdir, vcf_file, mode, args, log_file)
+        if returncode != 0:
+            print(f"La ejecución ha fallado (código {returncode}); ver {log_file}.")
+            continue
+
+        # Etapas de la traza de la ejecución, nombrada como el directorio de trabajo del VCF (la herramienta se
+        # ejecuta desde workdir, con la ruta ya resuelta por getcwd)
+        trace_name = Workspace.input_key(os.path.join(os.path.realpath(workdir), vcf_file))
+        with open(os.path.join(workdir, "final_output", f"{trace_name}_run_trace.json"), "r") as trace_file:
+            trace = json.load(trace_file)
+        rows += [get_result_row(size, mode, stage) for stage in trace["stages"]]
+
+        # Ejecución completa, incluidos el arranque y la carga de los catálogos
+        rows.append({"size": size, "mode": mode, "stage": "total", "category": "-", "wall_seconds": round(wall, 3),
+                     "cpu_seconds": trace["cpu_seconds"], "children_cpu_seconds": trace["children_cpu_seconds"],
+                     "peak_rss_mb": peak_rss, "records_in": n_records, "records_out": None,
+                     "records_per_second": get_records_per_second(n_records, wall)})
+    return(rows)
+
+def write_results(rows, out_file):
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    with open(out_file, "w", newline="") as tsv_file:
+        writer = csv.DictWriter(tsv_file, fieldnames=RESULT_COLUMNS, delimiter="\t")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({column: "NA" if row[column] is None else row[column] for column in RESULT_COLUMNS})
+
+def print_results(rows):
+    print(f"\n{'size':>9} {'mode':<9} {'stage':<26} {'cat':<7} {'wall_s':>9} {'cpu_s':>8} {'child_s':>8} {'rss_mb':>8} {'rec/s':>12}")
+    for row in rows:
+        rate = "NA" if row["records_per_second"] is None else f"{row['records_per_second']:.0f}"
+        print(f"{row['size']:>9} {row['mode']:<9} {row['stage']:<26} {row['category']:<7} {row['wall_seconds']:>9} "
+              f"{row['cpu_seconds']:>8} {row['children_cpu_seconds']:>8} {row['peak_rss_mb']:>8} {rate:>12}")
+
+def compare_with_baseline(rows, baseline_file, tolerance):
+    """
+    Compara los tiempos con unos resultados anteriores y muestra las etapas que han empeorado.
+
+    Se ignoran las diferencias de menos de 50 ms, que en las etapas cortas son ruido.
+
+    Returns:
+        list: Filas con regresión.
+    """
+    with open(baseline_file, "r") as tsv_file:
+        baseline = {(row["size"], row["mode"], row["stage"], row["category"]): row
+                    for row in csv.DictReader(tsv_file, delimiter="\t")}
+    regressions = []
+    print(f"\n---Comparación con {baseline_file}---")
+    for row in rows:
+        previous = baseline.get((str(row["size"]), row["mode"], row["stage"], row["category"]))
+        if previous is None or previous["wall_seconds"] == "NA" or row["wall_seconds"] is None:
+            continue
+        before, after = float(previous["wall_seconds"]), float(row["wall_seconds"])
+        if after > before * (1 + tolerance) and after - before > 0.05:
+            regressions.append(row)
+            print(f"REGRESIÓN {row['size']} {row['mode']} {row['stage']} {row['category']}: {before:.3f} s -> {after:.3f} s")
+    if not regressions:
+        print("Sin regresiones.")
+    return(regressions)
+
+def main():
+    args = benchmark_arguments()
+    workdir = os.path.abspath(args.workdir)
+    out_file = args.out or os.path.join(BENCHMARKS_PATH, "results", f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.tsv")
+
+    # Antes de medir, el motor de normalización con pysam debe reproducir los casos fijos de bcftools
+    if not check_known_cases():
+        sys.exit(1)
+
+    workspace = setup_workspace(workdir, args.assembly, args.clinvar_records, args.seed)
+    rows = list(workspace["setup_rows"])
+    for size in [int(size) for size in args.sizes.split(",")]:
+        rows += benchmark_size(workdir, size, workspace, args)
+
+    write_results(rows, out_file)
+    print_results(rows)
+    print(f"\nResultados guardados en '{out_file}'.")
+
+    if args.baseline:
+        regressions = compare_with_baseline(rows, args.baseline, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:48:21 2026
+
+@author: kindi
+
+Mide el tiempo de arranque de la herramienta ('--help' y la importación de secondary_findings) y
+comprueba que las dependencias pesadas (pandas, pysam, pybedtools, biomart, natsort) no se cargan al
+arrancar, sino solo en las etapas que las usan. Cada medición se añade al histórico
+benchmarks/startup_history.tsv para poder seguir su evolución entre versiones.
+
+@Usage python3 benchmarks/startup_time.py --runs 10
+       python3 benchmarks/startup_time.py --max_seconds 1 --no_history
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+REPO_PATH = os.path.dirname(BENCHMARKS_PATH)
+
+HEAVY_MODULES = ["pandas", "pysam", "pybedtools", "biomart", "natsort"]
+
+HISTORY_COLUMNS = ["date", "commit", "python", "runs", "help_median_s", "help_min_s", "import_median_s",
+                   "import_min_s", "heavy_modules_loaded"]
+
+# Órdenes medidas: la ayuda de la línea de comandos y la importación del programa principal
+COMMANDS = {
+    "help": [sys.executable, "secondary_findings.py", "--help"],
+    "import": [sys.executable, "-c", "import secondary_findings"],
+}
+
+def startup_arguments():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque de la herramienta y dependencias cargadas al arrancar.")
+    parser.add_argument("--runs", type=int, default=10, help="Número de repeticiones de cada medición")
+    parser.add_argument("--max_seconds", type=float, default=None, help="Tiempo de arranque máximo (mediana de '--help'); si se supera, termina con error")
+    parser.add_argument("--history", default=os.path.join(BENCHMARKS_PATH, "startup_history.tsv"), help="Archivo TSV del histórico de mediciones")
+    parser.add_argument("--no_history", action="store_true", help="No añadir la medición al histórico")
+    return parser.parse_args()
+
+def time_command(command, runs):
+    """
+    Ejecuta una orden varias veces desde el directorio del repositorio y devuelve sus tiempos en segundos.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=REPO_PATH, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return(timings)
+
+def get_loaded_heavy_modules():
+    """
+    Importa secondary_findings en un proceso nuevo y devuelve las dependencias pesadas que quedan cargadas.
+    """
+    code = ("import sys, json, secondary_findings; "
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_PATH, capture_output=True, text=True, check=True)
+    return(json.loads(result.stdout.strip().splitlines()[-1]))
+
+def get_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_PATH, capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def append_history(history_file, row):
+    new_file = not os.path.exists(history_file)
+    with open(history_file, "a", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=HISTORY_COLUMNS, delimiter="\t")
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+
+def main():
+    args = startup_arguments()
+    timings = {name: time_command(command, args.runs) for name, command in COMMANDS.items()}
+    heavy_loaded = get_loaded_heavy_modules()
+
+    row = {
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "runs": args.runs,
+        "help_median_s": round(statistics.median(timings["help"]), 4),
+        "help_min_s": round(min(timings["help"]), 4),
+        "import_median_s": round(statistics.median(timings["import"]), 4),
+        "import_min_s": round(min(timings["import"]), 4),
+        "heavy_modules_loaded": ",".join(heavy_loaded) or "-",
+    }
+    print(f"--help:     mediana {row['help_median_s']} s, mínimo {row['help_min_s']} s ({args.runs} ejecuciones)")
+    print(f"importación: mediana {row['import_median_s']} s, mínimo {row['import_min_s']} s")
+    print(f"Dependencias pesadas cargadas al arrancar: {row['heavy_modules_loaded']}")
+    if not args.no_history:
+        append_history(args.history, row)
+        print(f"Medición añadida a {args.history}")
+
+    failed = False
+    if heavy_loaded:
+        print(f"Error: {', '.join(heavy_loaded)} se importan al arrancar; deben importarse en las etapas que los usan.")
+        failed = True
+    if args.max_seconds is not None and row["help_median_s"] > args.max_seconds:
+        print(f"Error: el arranque ({row['help_median_s']} s) supera el máximo de {args.max_seconds} s.")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
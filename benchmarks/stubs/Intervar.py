@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:52:03 2026
+
+@author: kindi
+
+Sustituto de InterVar para las pruebas de rendimiento sin dependencias externas.
+
+Lee el VCF de entrada (-i) y escribe <salida>.<ensamblaje>_multianno.txt.intervar con las columnas que
+lee la herramienta. El gen se toma del campo INFO GENE de los VCF sintéticos y la clasificación se asigna
+de forma reproducible a partir de la propia variante.
+"""
+import sys
+import zlib
+import argparse
+
+HEADER = ["#Chr", "Start", "End", "Ref", "Alt", "Ref.Gene", "Func.refGene", "ExonicFunc.refGene", "Gene.ensGene",
+          "avsnp147", "AAChange.ensGene", "AAChange.refGene", "clinvar: Clinvar ", " InterVar: InterVar and Evidence ",
+          "Freq_gnomAD_genome_ALL", "Freq_esp6500siv2_all", "Freq_1000g2015aug_all", "CADD_raw", "CADD_phred",
+          "SIFT_score", "GERP++_RS", "phyloP46way_placental", "dbscSNV_ADA_SCORE", "dbscSNV_RF_SCORE",
+          "Interpro_domain", "AAChange.knownGene", "rmsk", "MetaSVM_score", "Freq_gnomAD_genome_POPs", "OMIM",
+          "Phenotype_MIM", "OrphaNumber", "Orpha", "Otherinfo"]
+
+# Clasificaciones de InterVar con su frecuencia aproximada
+CLASSIFICATIONS = [(0.03, "Pathogenic"), (0.06, "Likely pathogenic"), (0.5, "Uncertain significance"),
+                   (0.8, "Likely benign"), (1.0, "Benign")]
+
+def annovar_coordinates(pos, ref, alt):
+    """
+    Convierte una variante del VCF a las coordenadas de ANNOVAR, sin el nucleótido de referencia en las indels.
+    """
+    pos = int(pos)
+    if len(ref) > len(alt):
+        ref, alt, pos = ref[1:], (alt[1:] or "-"), pos + 1
+    elif len(ref) < len(alt):
+        ref, alt = (ref[1:] or "-"), alt[1:]
+    return(pos, pos + max(len(ref), 1) - 1, ref, alt)
+
+def classify(key):
+    score = (zlib.crc32(key.encode()) % 10000) / 10000
+    for threshold, classification in CLASSIFICATIONS:
+        if score < threshold:
+            return classification
+    return "Benign"
+
+def main():
+    parser = argparse.ArgumentParser(description="InterVar (stub)")
+    parser.add_argument("-b", "--buildver", default="hg19")
+    parser.add_argument("-i", "--input", required=True)
+    parser.add_argument("--input_type", default="VCF")
+    parser.add_argument("-o", "--output", required=True)
+    args, _ = parser.parse_known_args()
+
+    out_file = f"{args.output}.{args.buildver}_multianno.txt.intervar"
+    with open(args.input, "r") as vcf_file, open(out_file, "w") as fout:
+        fout.write("\t".join(HEADER) + "\n")
+        for line in vcf_file:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            chrom, vcf_pos, rs, vcf_ref, vcf_alt, info = fields[0], fields[1], fields[2], fields[3], fields[4], fields[7]
+            gt = fields[9].split(":")[0] if len(fields) > 9 else "."
+            gene = "."
+            for entry in info.split(";"):
+                if entry.startswith("GENE="):
+                    gene = entry[5:]
+            start, end, ref, alt = annovar_coordinates(vcf_pos, vcf_ref, vcf_alt)
+            classification = classify(f"{chrom}:{start}:{ref}:{alt}")
+            row = [chrom, str(start), str(end), ref, alt, gene, "exonic", ".", gene, rs, ".", ".", "clinvar: UNK ",
+                   f" InterVar: {classification} PVS1=0 PS=[0, 0, 0, 0, 0] PM=[0, 0, 0, 0, 0, 0, 0] PP=[0, 0, 0, 0, 0, 0] BA1=0 BS=[0, 0, 0, 0, 0] BP=[0, 0, 0, 0, 0, 0, 0, 0] "]
+            row += ["."] * (len(HEADER) - len(row) - 1) + [gt]
+            fout.write("\t".join(row) + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:02:36 2026
+
+@author: kindi
+
+Sustituto local del servidor de ClinVar para probar las descargas sin conexión a internet.
+
+Sirve un archivo (normalmente un variant_summary.txt.gz sintético) con las cabeceras Last-Modified y ETag,
+responde 304 a las peticiones condicionales (If-Modified-Since, If-None-Match) si el archivo no ha cambiado
+y 206 a las peticiones Range (condicionadas con If-Range). Con --drop_every, corta la conexión tras enviar
+ese número de bytes de cada respuesta (o de las --max_drops primeras), para probar la reanudación de las descargas.
+
+@Usage python3 benchmarks/stubs/clinvar_http.py --file variant_summary.txt.gz --port 8766 --drop_every 1000000
+       config.json: "clinvar_url": "http://localhost:8766/variant_summary.txt.gz"
+"""
+import os
+import sys
+import hashlib
+import argparse
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def server_arguments():
+    parser = argparse.ArgumentParser(description="Servidor HTTP local que sustituye al FTP de ClinVar.")
+    parser.add_argument("--file", required=True, help="Archivo que se sirve en cualquier ruta")
+    parser.add_argument("--host", default="127.0.0.1", help="Dirección de escucha")
+    parser.add_argument("--port", type=int, default=8766, help="Puerto de escucha")
+    parser.add_argument("--drop_every", type=int, default=0, help="Cortar cada respuesta tras enviar este número de bytes (0: no cortar)")
+    parser.add_argument("--max_drops", type=int, default=None, help="Número máximo de conexiones cortadas (por defecto, todas)")
+    parser.add_argument("--no_range", action="store_true", help="Ignorar las peticiones Range (responder siempre con el archivo completo)")
+    return parser.parse_args()
+
+class ClinvarHandler(BaseHTTPRequestHandler):
+    def file_headers(self):
+        """
+        Tamaño, Last-Modified y ETag del archivo servido (se leen en cada petición, así que reemplazar el
+        archivo simula una versión nueva de ClinVar).
+        """
+        stat = os.stat(self.server.file)
+        last_modified = formatdate(int(stat.st_mtime), usegmt=True)
+        etag = '"' + hashlib.sha1(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()[:16] + '"'
+        return stat.st_size, last_modified, etag
+
+    def not_modified(self, last_modified, etag):
+        if "If-None-Match" in self.headers:
+            return self.headers["If-None-Match"] == etag
+        if "If-Modified-Since" in self.headers:
+            try:
+                return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(self.headers["If-Modified-Since"])
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def get_range_start(self, last_modified, etag):
+        """
+        Primer byte pedido con Range, o None si se debe enviar el archivo completo.
+        """
+        range_header = self.headers.get("Range", "")
+        if self.server.no_range or not range_header.startswith("bytes=") or not range_header.endswith("-"):
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range is not None and if_range not in [etag, last_modified]:
+            return None
+        return int(range_header[len("bytes="):-1])
+
+    def send_file_headers(self, status, length, last_modified, etag, content_range=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-gzip")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "none" if self.server.no_range else "bytes")
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+
+    def do_HEAD(self):
+        size, last_modified, etag = self.file_headers()
+        self.send_file_headers(200, size, last_modified, etag)
+
+    def do_GET(self):
+        size, last_modified, etag = self.file_headers()
+        if self.not_modified(last_modified, etag):
+            self.send_response(304)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        start = self.get_range_start(last_modified, etag)
+        if start is None:
+            start = 0
+            self.send_file_headers(200, size, last_modified, etag)
+        else:
+            self.send_file_headers(206, size - start, last_modified, etag, f"bytes {start}-{size - 1}/{size}")
+
+        # Enviar el archivo, cortando la conexión tras --drop_every bytes
+        sent = 0
+        with open(self.server.file, "rb") as file:
+            file.seek(start)
+            while True:
+                chunk = file.read(64 * 1024)
+                if not chunk:
+                    break
+                if self.server.drop_every and sent + len(chunk) >= self.server.drop_every and self.server.drops != 0:
+                    self.server.drops -= 1
+                    self.wfile.write(chunk[:self.server.drop_every - sent])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(chunk)
+                sent += len(chunk)
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"[clinvar_http] {self.command} {self.headers.get('Range', '')} -> {format % args}\n")
+
+def main():
+    args = server_arguments()
+    server = ThreadingHTTPServer((args.host, args.port), ClinvarHandler)
+    server.file = os.path.abspath(args.file)
+    server.drop_every = args.drop_every
+    server.no_range = args.no_range
+    server.drops = -1 if args.max_drops is None else args.max_drops
+    print(f"Sirviendo {server.file} en http://{args.host}:{server.server_address[1]}/", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
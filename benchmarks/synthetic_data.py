@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:02:11 2026
+
+@author: kindi
+
+Generación de datos sintéticos para las pruebas de rendimiento: coordenadas de los genes de los
+catálogos, VCF de una muestra (desde un panel de 1k variantes hasta un genoma completo de 5M) y un
+archivo ClinVar con el formato de variant_summary.txt.gz.
+"""
+import os
+import csv
+import gzip
+import json
+import random
+
+# Longitud de los cromosomas (GRCh37), para repartir las variantes de fondo
+CHROM_LENGTHS = {
+    "1": 249250621, "2": 243199373, "3": 198022430, "4": 191154276, "5": 180915260, "6": 171115067,
+    "7": 159138663, "8": 146364022, "9": 141213431, "10": 135534747, "11": 135006516, "12": 133851895,
+    "13": 115169878, "14": 107349540, "15": 102531392, "16": 90354753, "17": 81195210, "18": 78077248,
+    "19": 59128983, "20": 63025520, "21": 48129895, "22": 51304566, "X": 155270560, "Y": 59373566,
+    "MT": 16569
+}
+CHROM_ORDER = {chrom: i for i, chrom in enumerate(CHROM_LENGTHS)}
+
+BASES = "ACGT"
+
+# Columnas de variant_summary.txt.gz
+CLINVAR_COLUMNS = ["#AlleleID", "Type", "Name", "GeneID", "GeneSymbol", "HGNC_ID", "ClinicalSignificance",
+                   "ClinSigSimple", "LastEvaluated", "RS# (dbSNP)", "nsv/esv (dbVar)", "RCVaccession",
+                   "PhenotypeIDS", "PhenotypeList", "Origin", "OriginSimple", "Assembly", "ChromosomeAccession",
+                   "Chromosome", "Start", "Stop", "ReferenceAllele", "AlternateAllele", "Cytogenetic",
+                   "ReviewStatus", "NumberSubmitters", "Guidelines", "TestedInGTR", "OtherIDs",
+                   "SubmitterCategories", "VariationID", "PositionVCF", "ReferenceAlleleVCF", "AlternateAlleleVCF"]
+
+# Significado clínico y estado de revisión, con su frecuencia aproximada en ClinVar
+CLINICAL_SIGNIFICANCE = [("Uncertain significance", "0", 0.45), ("Likely benign", "0", 0.2), ("Benign", "0", 0.1),
+                         ("Pathogenic", "1", 0.1), ("Likely pathogenic", "1", 0.06),
+                         ("Pathogenic/Likely pathogenic", "1", 0.03),
+                         ("Conflicting interpretations of pathogenicity", "1", 0.03),
+                         ("Conflicting interpretations of pathogenicity", "0", 0.03)]
+REVIEW_STATUS = [("criteria provided, single submitter", 0.55), ("criteria provided, multiple submitters, no conflicts", 0.2),
+                 ("no assertion criteria provided", 0.12), ("criteria provided, conflicting interpretations", 0.08),
+                 ("reviewed by expert panel", 0.04), ("practice guideline", 0.01)]
+
+def read_catalog_genes(categories_path):
+    """
+    Lee los símbolos de los genes de los catálogos de riesgo personal y reproductivo.
+
+    Args:
+        categories_path (str): Ruta al directorio categories.
+
+    Returns:
+        dict: Lista de genes por categoría ('pr' y 'rr').
+    """
+    genes = {}
+    for category in ["pr", "rr"]:
+        with open(f"{categories_path}{category.upper()}/{category}_risk_genes.csv", "r", encoding="latin1") as file:
+            genes[category] = [row["Gene"] for row in csv.DictReader(file)]
+    return(genes)
+
+def read_fg_variants(categories_path, assembly):
+    """
+    Lee las variantes del catálogo farmacogenético.
+
+    Args:
+        categories_path (str): Ruta al directorio categories.
+        assembly (str): Ensamblaje genómico ("37" o "38").
+
+    Returns:
+        list: Diccionarios con 'chrom', 'pos', 'ref', 'alt', 'gene' y 'rs'.
+    """
+    variants = []
+    with open(f"{categories_path}FG/fg_risk_genes_GRCh{assembly}.csv", "r") as file:
+        for row in csv.DictReader(file):
+            variants.append({"chrom": row["Chromosome"], "pos": int(row["Position"]), "ref": row["Reference"],
+                             "alt": row["Alternative"], "gene": row["Gene"], "rs": row["dbSNP"].strip()})
+    return(variants)
+
+def get_gene_coordinates(genes, seed):
+    """
+    Asigna a cada gen unas coordenadas sintéticas, reproducibles para una misma semilla.
+
+    Sustituye a la consulta a BioMart: los archivos BED de las pruebas se escriben con estas coordenadas.
+
+    Args:
+        genes (list): Símbolos de los genes.
+        seed (int): Semilla del generador aleatorio.
+
+    Returns:
+        list: Tuplas (cromosoma, inicio, fin, gen) ordenadas por posición.
+    """
+    rng = random.Random(f"genes:{seed}")
+    chroms = [chrom for chrom in CHROM_LENGTHS if chrom not in ["Y", "MT"]]
+    weights = [CHROM_LENGTHS[chrom] for chrom in chroms]
+    coordinates = []
+    for gene in sorted(set(genes)):
+        chrom = rng.choices(chroms, weights)[0]
+        length = rng.randint(5000, 150000)
+        start = rng.randint(1, CHROM_LENGTHS[chrom] - length - 1)
+        coordinates.append((chrom, start, start + length, gene))
+    coordinates.sort(key=lambda coord: (CHROM_ORDER[coord[0]], coord[1]))
+    return(coordinates)
+
+def write_catalogs(categories_path, assembly, catalog_genes, gene_coordinates, read_csv):
+    """
+    Escribe los JSON y BED de los catálogos PR y RR a partir de las coordenadas sintéticas.
+
+    Args:
+        categories_path (str): Ruta al directorio categories del espacio de trabajo.
+        assembly (str): Ensamblaje genómico ("37" o "38").
+        catalog_genes (dict): Lista de genes por categoría.
+        gene_coordinates (list): Coordenadas sintéticas de los genes.
+        read_csv (function): Lector de los CSV de la herramienta (modules.get_json_bed.read_csv).
+    """
+    for category, genes in catalog_genes.items():
+        genes_dct, _ = read_csv(f"{categories_path}{category.upper()}/{category}_risk_genes.csv", category)
+        with open(f"{categories_path}{category.upper()}/{category}_risk_genes.json", "w") as json_file:
+            json.dump(genes_dct, json_file, indent = 4)
+        genes = set(genes)
+        with open(f"{categories_path}{category.upper()}/{category}_genes_grch{assembly}.bed", "w") as bed_file:
+            for chrom, start, end, gene in gene_coordinates:
+                if gene in genes:
+                    bed_file.write(f"{chrom}\t{start}\t{end}\t{gene}\n")
+
+def random_alleles(rng):
+    """
+    Genera los alelos de una variante: SNV (85 %), deleción (8 %), inserción (5 %) o multialélica (2 %).
+    """
+    ref = rng.choice(BASES)
+    kind = rng.random()
+    if kind < 0.85:
+        alt = rng.choice([base for base in BASES if base != ref])
+    elif kind < 0.93:
+        ref = ref + "".join(rng.choice(BASES) for _ in range(rng.randint(1, 5)))
+        alt = ref[0]
+    elif kind < 0.98:
+        alt = ref + "".join(rng.choice(BASES) for _ in range(rng.randint(1, 5)))
+    else:
+        alt = ",".join(rng.sample([base for base in BASES if base != ref], 2))
+    return(ref, alt)
+
+def generate_gene_variants(gene_coordinates, n_variants, seed):
+    """
+    Genera variantes dentro de los genes de los catálogos, como las de ClinVar.
+
+    Args:
+        gene_coordinates (list): Coordenadas sintéticas de los genes.
+        n_variants (int): Número de variantes.
+        seed (int): Semilla del generador aleatorio.
+
+    Returns:
+        list: Diccionarios con 'chrom', 'pos', 'ref', 'alt', 'gene' y 'rs'.
+    """
+    rng = random.Random(f"gene_variants:{seed}")
+    variants = {}
+    while len(variants) < n_variants:
+        chrom, start, end, gene = rng.choice(gene_coordinates)
+        pos = rng.randint(start + 1, end)
+        ref, alt = random_alleles(rng)
+        # ClinVar solo contiene variantes bialélicas
+        alt = alt.split(",")[0]
+        rs = f"rs{rng.randint(1000000, 999999999)}" if rng.random() < 0.6 else "."
+        variants[(chrom, pos, ref, alt)] = {"chrom": chrom, "pos": pos, "ref": ref, "alt": alt, "gene": gene, "rs": rs}
+    return(list(variants.values()))
+
+def write_vcf_header(vcf_file, sample):
+    vcf_file.write("##fileformat=VCFv4.2\n")
+    vcf_file.write("##source=secondary_findings_benchmark\n")
+    for chrom, length in CHROM_LENGTHS.items():
+        vcf_file.write(f"##contig=<ID={chrom},length={length}>\n")
+    vcf_file.write('##INFO=<ID=GENE,Number=1,Type=String,Description="Gen del catálogo (datos sintéticos)">\n')
+    vcf_file.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+    vcf_file.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">\n')
+    vcf_file.write('##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype quality">\n')
+    vcf_file.write(f"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{sample}\n")
+
+def generate_vcf(out_vcf, n_variants, gene_coordinates, known_variants, fg_variants, seed,
+                 gene_fraction=0.05, known_fraction=0.5, duplicate_fraction=0.001, sample="SAMPLE"):
+    """
+    Genera el VCF sintético de una muestra, cromosoma a cromosoma para no cargarlo entero en memoria.
+
+    El VCF incluye todas las variantes del catálogo farmacogenético, una fracción de variantes dentro de
+    los genes de los catálogos (la mitad de ellas presentes en ClinVar) y variantes de fondo repartidas por
+    el genoma. Contiene también sitios multialélicos y registros duplicados para que la normalización
+    tenga trabajo.
+
+    Args:
+        out_vcf (str): Ruta al VCF de salida (sin comprimir).
+        n_variants (int): Número aproximado de variantes.
+        gene_coordinates (list): Coordenadas sintéticas de los genes.
+        known_variants (list): Variantes de ClinVar de las que se toman las variantes conocidas.
+        fg_variants (list): Variantes del catálogo farmacogenético.
+        seed (int): Semilla del generador aleatorio.
+        gene_fraction (float): Fracción de variantes dentro de los genes de los catálogos.
+        known_fraction (float): Fracción de las variantes en genes que están en ClinVar.
+        duplicate_fraction (float): Fracción de registros duplicados.
+        sample (str): Nombre de la muestra.
+
+    Returns:
+        int: Número de registros escritos.
+    """
+    rng = random.Random(f"vcf:{seed}:{n_variants}")
+
+    # Variantes en los genes de los catálogos, conocidas (ClinVar) o nuevas
+    n_gene = int(n_variants * gene_fraction)
+    n_known = min(int(n_gene * known_fraction), len(known_variants))
+    gene_variants = rng.sample(known_variants, n_known)
+    gene_variants += generate_gene_variants(gene_coordinates, n_gene - n_known, f"{seed}:{n_variants}:novel")
+
+    # Variantes por cromosoma: catálogo FG, variantes en genes y variantes de fondo
+    by_chrom = {chrom: {} for chrom in CHROM_LENGTHS}
+    for variant in fg_variants + gene_variants:
+        if variant["chrom"] in by_chrom:
+            by_chrom[variant["chrom"]].setdefault(variant["pos"], (variant["ref"], variant["alt"], variant["gene"], variant["rs"]))
+    n_background = max(n_variants - sum(len(variants) for variants in by_chrom.values()), 0)
+    genome_length = sum(CHROM_LENGTHS.values())
+
+    n_records = 0
+    with open(out_vcf, "w") as vcf_file:
+        write_vcf_header(vcf_file, sample)
+        for chrom, length in CHROM_LENGTHS.items():
+            variants = by_chrom[chrom]
+            n_chrom = round(n_background * length / genome_length)
+            for pos in rng.sample(range(1, length), min(n_chrom, length - 1)):
+                if pos not in variants:
+                    ref, alt = random_alleles(rng)
+                    rs = f"rs{rng.randint(1000000, 999999999)}" if rng.random() < 0.4 else "."
+                    # Tuplas en lugar de diccionarios para limitar la memoria en los genomas completos
+                    variants[pos] = (ref, alt, None, rs)
+            for pos in sorted(variants):
+                ref, alt, gene, rs = variants[pos]
+                if "," in alt:
+                    genotype = "1/2"
+                else:
+                    genotype = "0/1" if rng.random() < 0.65 else "1/1"
+                info = f"GENE={gene}" if gene else "."
+                line = (f"{chrom}\t{pos}\t{rs}\t{ref}\t{alt}\t{rng.randint(30, 900)}\tPASS\t"
+                        f"{info}\tGT:DP:GQ\t{genotype}:{rng.randint(8, 120)}:{rng.randint(20, 99)}\n")
+                vcf_file.write(line)
+                n_records += 1
+                if rng.random() < duplicate_fraction:
+                    vcf_file.write(line)
+                    n_records += 1
+            # Liberar el cromosoma ya escrito
+            by_chrom[chrom] = None
+    return(n_records)
+
+def get_variant_type(ref, alt):
+    if len(ref) == len(alt):
+        return "single nucleotide variant"
+    return "Deletion" if len(ref) > len(alt) else "Insertion"
+
+def generate_clinvar_summary(out_gz, known_variants, n_records, gene_coordinates, seed):
+    """
+    Genera un archivo ClinVar con el formato de variant_summary.txt.gz (filas GRCh37 y GRCh38).
+
+    Args:
+        out_gz (str): Ruta al archivo de salida (variant_summary.txt.gz).
+        known_variants (list): Variantes en los genes de los catálogos que aparecen en ClinVar.
+        n_records (int): Número total de variantes por ensamblaje (el resto se reparte por los genes).
+        gene_coordinates (list): Coordenadas sintéticas de los genes.
+        seed (int): Semilla del generador aleatorio.
+
+    Returns:
+        int: Número de filas escritas.
+    """
+    rng = random.Random(f"clinvar:{seed}")
+    significance_weights = [weight for _, _, weight in CLINICAL_SIGNIFICANCE]
+    review_weights = [weight for _, weight in REVIEW_STATUS]
+    gene_ids = {gene: 1000 + i for i, (_, _, _, gene) in enumerate(gene_coordinates)}
+
+    variants = list(known_variants)
+    if n_records > len(variants):
+        variants += generate_gene_variants(gene_coordinates, n_records - len(variants), f"{seed}:clinvar_extra")
+
+    n_rows = 0
+    with gzip.open(out_gz, "wt", compresslevel=6) as gz_file:
+        gz_file.write("\t".join(CLINVAR_COLUMNS) + "\n")
+        for allele_id, variant in enumerate(variants, start=15000):
+            significance, clinsigsimple, _ = rng.choices(CLINICAL_SIGNIFICANCE, significance_weights)[0]
+            review_status = rng.choices(REVIEW_STATUS, review_weights)[0][0]
+            rs = variant["rs"][2:] if variant["rs"].startswith("rs") else "-1"
+            for assembly in ["GRCh37", "GRCh38"]:
+                row = [str(allele_id), get_variant_type(variant["ref"], variant["alt"]),
+                       f"NM_{gene_ids[variant['gene']]:06d}.1({variant['gene']}):c.{variant['pos'] % 5000}{variant['ref']}>{variant['alt']}",
+                       str(gene_ids[variant["gene"]]), variant["gene"], f"HGNC:{gene_ids[variant['gene']]}",
+                       significance, clinsigsimple, "Jan 01, 2024", rs, "-", f"RCV{allele_id:09d}",
+                       f"MedGen:C{allele_id:07d}", "not provided", "germline", "germline", assembly,
+                       f"NC_0000{variant['chrom']}.10", variant["chrom"], str(variant["pos"]),
+                       str(variant["pos"] + len(variant["ref"]) - 1), "na", "na", "-", review_status,
+                       str(rng.randint(1, 12)), "-", "N", "-", "1", str(allele_id + 7000),
+                       str(variant["pos"]), variant["ref"], variant["alt"]]
+                gz_file.write("\t".join(row) + "\n")
+                n_rows += 1
+    return(n_rows)
+
+def data_is_current(path, params, params_file=None):
+    """
+    Comprueba si un archivo sintético ya existe y se generó con los mismos parámetros.
+    """
+    params_file = params_file or f"{path}.params.json"
+    if not (os.path.exists(path) and os.path.exists(params_file)):
+        return False
+    with open(params_file, "r") as file:
+        return json.load(file) == params
+
+def write_data_params(path, params, params_file=None):
+    with open(params_file or f"{path}.params.json", "w") as file:
+        json.dump(params, file, indent=4)
@@ -8,6 +8,9 @@ Created on Sun Sep  3 01:04:02 2023
 import argparse
 import sys
 
+from modules.trace import TRACE_STAGES
+from modules.workspace import RETENTION_POLICIES
+
 def arguments():
     """
     Get the arguments
@@ -18,7 +21,13 @@ def arguments():
                                      \nEXAMPLE: python3 secondary_findings.py example.vcf -o results --mode basic\n")
     
     # Argumento para el archivo VCF
-    parser.add_argument('vcf_file', metavar='VCF_FILE', type=str, help='Archivo VCF de entrada')
+    parser.add_argument('vcf_file', metavar='VCF_FILE', type=str, nargs='?', default=None, help='Archivo VCF de entrada')
+    
+    # Argumento para el modo por lotes: manifiesto con varios VCF
+    parser.add_argument('--manifest', default=None, help='Archivo TSV con un VCF por línea (y, opcionalmente, su archivo de HPOs) para el modo por lotes')
+    
+    # Argumento para el modo cohorte: el VCF de entrada contiene varias muestras
+    parser.add_argument('--cohort', action='store_true', help='Analizar un VCF multimuestra, con un informe por muestra y un resumen de la cohorte')
     
     # Argumento para el modo de análisis (básico o avanzado)
     parser.add_argument('--mode', choices=['basic', 'advanced'], default='basic', help='Modo de análisis (basic o advanced)')
@@ -26,20 +35,113 @@ def arguments():
     # Argumento para el nivel de evidencia (solo en modo avanzado)
     parser.add_argument('--evidence', type=int, choices=range(1, 5), default=1, help='Nivel de evidencia (1-4) en modo avanzado')
     
+    # Argumento para anotar cada hallazgo con los niveles de evidencia con los que se informaría
+    parser.add_argument('--evidence_tiers', action='store_true', help='Añadir a los resultados PR y RR la columna MaxEvidenceLevel: el nivel de evidencia más alto (1-4) con el que se seguiría informando cada hallazgo')
+    
     # Argumento para el genoma de referencia
     parser.add_argument('--assembly', type=int, choices=[37, 38], default=37, help='Genoma de referencia')
     
     # Argumento para el archivo de texto de HPOs
     parser.add_argument("--hpos_txt", default=None, help="Archivo de texto que contiene la lista de HPOs")
     
+    # Argumento para las categorías a analizar (si no se indica, se toman de config.json o se preguntan)
+    parser.add_argument("--categories", default=None, help="Categorías a analizar separadas por comas (PR, RR, FG)")
+    
+    # Argumento para la política de actualización de ClinVar
+    parser.add_argument("--clinvar_update", choices=['ask', 'yes', 'no'], default=None, help="Actualizar la base de datos ClinVar (ask, yes o no)")
+    
+    # Argumento para analizar con una versión anterior de ClinVar
+    parser.add_argument("--clinvar_release", default=None, help="Versión de ClinVar (AAAAMMDD) del almacén de versiones a utilizar en modo avanzado, en lugar de la más reciente")
+    
+    # Argumento para el número de módulos de categoría que se ejecutan en paralelo
+    parser.add_argument("--jobs", type=int, default=1, help="Número máximo de etapas ejecutadas en paralelo (catálogos, ClinVar, normalización, intersecciones y módulos PR, RR y FG), o de muestras en modo cohorte")
+    
+    # Argumento para el número de fragmentos de cromosomas de la normalización, la intersección e InterVar
+    parser.add_argument("--shards", type=int, default=None, help="Normalizar, intersectar y ejecutar InterVar por fragmentos de cromosomas en paralelo, en hasta este número de procesos. Por defecto, el valor 'shards' de config.json (0: sin fragmentar)")
+    
+    # Argumento para forzar etapas aunque sus entradas no hayan cambiado
+    parser.add_argument("--force_stage", action="append", choices=["normalize", "intersect", "intervar", "all"], default=[], help="Repetir una etapa aunque sus entradas no hayan cambiado (puede indicarse varias veces)")
+    
+    # Argumentos para perfilar una etapa
+    parser.add_argument("--profile", choices=TRACE_STAGES, default=None, help="Etapa que se perfila (el perfil se guarda junto al informe)")
+    parser.add_argument("--profile_mode", choices=["cprofile", "tracemalloc"], default="cprofile", help="Perfilador a utilizar con --profile: cprofile (tiempo) o tracemalloc (memoria)")
+    
+    # Argumento para la política de retención de los archivos intermedios
+    parser.add_argument("--retention", choices=RETENTION_POLICIES, default=None, help="Conservar los archivos intermedios de la muestra (keep), borrarlos (delete) o borrarlos solo si el análisis termina sin errores (on_success)")
+    
     try:
         args = parser.parse_args()      
-        return args
     
     except:
         print("\nPor favor, introduzca los argumentos requeridos.")
         sys.exit()
+    
+    # Comprobar que se ha indicado un VCF o un manifiesto, pero no ambos
+    if (args.vcf_file is None) == (args.manifest is None):
+        parser.print_usage()
+        print("\nIndique un archivo VCF o un manifiesto (--manifest), pero no ambos.")
+        sys.exit()
+    
+    # El modo cohorte requiere un único VCF multimuestra
+    if args.cohort and args.manifest is not None:
+        print("\nEl modo cohorte (--cohort) no puede combinarse con un manifiesto (--manifest).")
+        sys.exit()
+    
+    # 'all' fuerza todas las etapas con checkpoint
+    if "all" in args.force_stage:
+        args.force_stage = ["normalize", "intersect", "intervar"]
+    
+    # Comprobar el número de trabajos en paralelo
+    if args.jobs < 1:
+        print("\nEl número de trabajos (--jobs) debe ser al menos 1.")
+        sys.exit()
+    
+    # Comprobar el número de fragmentos
+    if args.shards is not None and args.shards < 0:
+        print("\nEl número de fragmentos (--shards) no puede ser negativo.")
+        sys.exit()
+    
+    return args
 
 
 # se podrían manejar por separado los diferentes errores (ver hcatgpo: flinotfounderror, argumenterror, valueerror)
 
+def serve_arguments():
+    """
+    Get the arguments of the server mode (secondary_findings.py serve)
+    """
+    
+    parser = argparse.ArgumentParser(prog="secondary_findings.py serve", description="Servidor residente de análisis de hallazgos secundarios. \n\
+                                     \nEXAMPLE: python3 secondary_findings.py serve --port 8765 --workers 4 --preload 37:advanced:1\n")
+    
+    # Argumentos para la dirección del servidor (solo localhost) o el socket Unix
+    parser.add_argument("--host", default="127.0.0.1", choices=["127.0.0.1", "localhost", "::1"], help="Dirección local en la que escuchar")
+    parser.add_argument("--port", type=int, default=8765, help="Puerto TCP del servidor")
+    parser.add_argument("--socket", default=None, help="Ruta a un socket Unix (en lugar de TCP)")
+    
+    # Argumentos para el tamaño del pool de trabajos y de la cola
+    parser.add_argument("--workers", type=int, default=2, help="Número máximo de análisis ejecutados a la vez")
+    parser.add_argument("--max_queue", type=int, default=100, help="Número máximo de trabajos pendientes")
+    
+    # Argumento para precargar recursos al arrancar
+    parser.add_argument("--preload", nargs="*", default=[], help="Recursos a precargar, como ASSEMBLY:MODE[:EVIDENCE] (por ejemplo, 37:advanced:1)")
+    
+    try:
+        args = parser.parse_args(sys.argv[2:])
+    
+    except:
+        print("\nPor favor, introduzca los argumentos requeridos.")
+        sys.exit()
+    
+    # Convertir las combinaciones a precargar en tuplas (assembly, mode, evidence)
+    preload = []
+    for item in args.preload:
+        fields = item.split(":")
+        if len(fields) < 2 or fields[0] not in ["37", "38"] or fields[1] not in ["basic", "advanced"]:
+            print(f"\nValor de --preload no válido: {item}")
+            sys.exit()
+        evidence = int(fields[2]) if len(fields) > 2 else 1
+        preload.append((fields[0], fields[1], evidence))
+    args.preload = preload
+    
+    return args
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 19:02:37 2026
+
+@author: kindi
+"""
+import csv
+from datetime import datetime
+
+def read_manifest(manifest_path):
+    """
+    Lee un manifiesto TSV con las muestras a analizar en modo por lotes.
+
+    Cada línea contiene la ruta a un VCF y, opcionalmente, la ruta a su archivo de HPOs.
+    Las líneas vacías, las que empiezan por '#' y una cabecera 'vcf_file' se ignoran.
+
+    Args:
+        manifest_path (str): Ruta al archivo de manifiesto.
+
+    Returns:
+        list: Una lista de diccionarios con las claves 'vcf_file' y 'hpos_txt'.
+
+    Raises:
+        FileNotFoundError: Si el manifiesto no existe.
+    """
+    samples = []
+    with open(manifest_path, "r") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            # Ignorar la cabecera si existe
+            if fields[0] == "vcf_file":
+                continue
+            hpos_txt = fields[1] if len(fields) > 1 and fields[1] not in ["", "NA"] else None
+            samples.append({"vcf_file": fields[0], "hpos_txt": hpos_txt})
+
+    return(samples)
+
+def write_batch_summary(batch_results, out_path, total_time):
+    """
+    Muestra y guarda el rendimiento del modo por lotes: tiempo por muestra y rendimiento agregado.
+
+    Args:
+        batch_results (list): Lista de diccionarios con 'vcf_file', 'status', 'seconds' y 'report' por muestra.
+        out_path (str): Ruta al directorio de resultados.
+        total_time (float): Tiempo total del lote en segundos, incluida la carga de recursos compartidos.
+
+    Returns:
+        str: Ruta al archivo TSV de resumen.
+    """
+    summary_file = f"{out_path}batch_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.tsv"
+    with open(summary_file, "w", newline="") as tsv_file:
+        fieldnames = ["vcf_file", "status", "seconds", "report"]
+        writer = csv.DictWriter(tsv_file, fieldnames=fieldnames, delimiter="\t")
+        writer.writeheader()
+        for result in batch_results:
+            writer.writerow({
+                "vcf_file": result["vcf_file"],
+                "status": result["status"],
+                "seconds": f"{result['seconds']:.2f}",
+                "report": result.get("report") or "NA"
+            })
+
+    # Rendimiento agregado
+    n_samples = len(batch_results)
+    n_ok = len([result for result in batch_results if result["status"] == "ok"])
+    samples_time = sum(result["seconds"] for result in batch_results)
+    print("\n---Resumen del lote---")
+    for result in batch_results:
+        print(f"{result['vcf_file']}\t{result['status']}\t{result['seconds']:.2f} s")
+    print(f"Muestras procesadas: {n_ok}/{n_samples}")
+    print(f"Tiempo total: {total_time:.2f} s (carga de recursos compartidos: {total_time - samples_time:.2f} s)")
+    if n_samples > 0 and total_time > 0:
+        print(f"Tiempo medio por muestra: {samples_time / n_samples:.2f} s")
+        print(f"Rendimiento: {n_samples / total_time * 3600:.1f} muestras/hora")
+    print(f"Resumen del lote guardado en '{summary_file}'.")
+
+    return(summary_file)
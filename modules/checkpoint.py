@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:20:44 2026
+
+@author: kindi
+"""
+import os
+import json
+import hashlib
+import threading
+import subprocess
+
+# Hashes ya calculados en este proceso, por (ruta, tamaño, fecha de modificación)
+_hash_cache = {}
+_hash_lock = threading.Lock()
+
+# Etapas que admiten checkpoint
+STAGES = ["normalize", "intersect", "intervar"]
+
+def file_hash(path):
+    """
+    Calcula el hash SHA-256 del contenido de un archivo.
+
+    Args:
+        path (str): Ruta al archivo.
+
+    Returns:
+        str: El hash en hexadecimal, o None si el archivo no existe.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if key in _hash_cache:
+            return _hash_cache[key]
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+
+    with _hash_lock:
+        _hash_cache[key] = digest
+    return digest
+
+def get_file_hashes(paths):
+    """
+    Calcula (o toma de la caché) los hashes de varios archivos para compartirlos con otros procesos.
+
+    Returns:
+        dict: Hashes por clave de la caché (ruta, tamaño, fecha de modificación), para preload_file_hashes.
+    """
+    hashes = {}
+    for path in paths:
+        digest = file_hash(path)
+        if digest is not None:
+            stat = os.stat(path)
+            hashes[(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)] = digest
+    return(hashes)
+
+def preload_file_hashes(hashes):
+    """
+    Añade a la caché del proceso hashes calculados en otro (get_file_hashes), para no volver a leer los
+    archivos. Un archivo que cambie después tiene otra clave y se vuelve a leer.
+    """
+    with _hash_lock:
+        _hash_cache.update(hashes)
+
+def get_tool_version(command):
+    """
+    Obtiene la versión de una herramienta externa (primera línea de su salida).
+
+    Args:
+        command (list): Comando que imprime la versión (por ejemplo, ["bcftools", "--version"]).
+
+    Returns:
+        str: La versión, o 'unknown' si no se puede obtener.
+    """
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        return output.splitlines()[0].strip()
+    except Exception:
+        return "unknown"
+
+def get_intervar_version(intervar_path):
+    """
+    Identifica la versión de InterVar por el hash de su script y de su configuración.
+
+    Args:
+        intervar_path (str): Ruta al directorio de InterVar.
+
+    Returns:
+        dict: Hash de Intervar.py y config.ini.
+    """
+    return {
+        "Intervar.py": file_hash(os.path.join(intervar_path, "Intervar.py")),
+        "config.ini": file_hash(os.path.join(intervar_path, "config.ini"))
+    }
+
+def get_intervar_manifest(input_vcf, assembly, intervar_path):
+    """
+    Manifiesto de la etapa InterVar: la intersección, la versión de InterVar y sus argumentos.
+    """
+    assembly_int = "hg19" if assembly == '37' else 'hg38'
+    return get_stage_manifest("intervar", {"vcf": input_vcf},
+                              {"intervar": get_intervar_version(intervar_path), "args": ["-b", assembly_int, "--input_type", "VCF"]})
+
+def get_stage_manifest(stage, input_files, params):
+    """
+    Construye el manifiesto de una etapa: los hashes de sus archivos de entrada y sus parámetros.
+
+    Args:
+        stage (str): Nombre de la etapa.
+        input_files (dict): Archivos de entrada, con su papel como clave (por ejemplo, {"vcf": ..., "bed": ...}).
+        params (dict): Parámetros de la etapa (versiones de las herramientas, argumentos...).
+
+    Returns:
+        dict: El manifiesto de la etapa.
+    """
+    return {
+        "stage": stage,
+        "inputs": {role: {"path": path, "sha256": file_hash(path)} for role, path in input_files.items()},
+        "params": params
+    }
+
+def get_manifest_path(output_file):
+    return f"{output_file}.manifest.json"
+
+def stage_is_current(manifest, output_file, force=False):
+    """
+    Comprueba si la salida de una etapa existe y se generó con las mismas entradas y parámetros.
+
+    Args:
+        manifest (dict): Manifiesto actual de la etapa.
+        output_file (str): Archivo de salida de la etapa.
+        force (bool): Forzar la ejecución de la etapa.
+
+    Returns:
+        bool: True si la etapa puede omitirse.
+    """
+    manifest_path = get_manifest_path(output_file)
+    if force or not os.path.exists(output_file) or not os.path.exists(manifest_path):
+        return False
+    try:
+        with open(manifest_path, "r") as manifest_file:
+            stored = json.load(manifest_file)
+    except (OSError, json.JSONDecodeError):
+        return False
+
+    # Solo se comparan los hashes de las entradas, no sus rutas
+    current = {"inputs": {role: info["sha256"] for role, info in manifest["inputs"].items()}, "params": manifest["params"]}
+    previous = {"inputs": {role: info["sha256"] for role, info in stored.get("inputs", {}).items()}, "params": stored.get("params")}
+    # Una salida unida de varios fragmentos deja de estar actualizada si cambia alguno de ellos
+    shards_current = all(file_hash(info["path"]) == info["sha256"] for info in stored.get("shards", {}).values())
+    return (current == previous and shards_current and stored.get("output_sha256") == file_hash(output_file))
+
+def write_stage_manifest(manifest, output_file):
+    """
+    Guarda el manifiesto de una etapa junto a su archivo de salida.
+
+    Args:
+        manifest (dict): Manifiesto de la etapa.
+        output_file (str): Archivo de salida de la etapa.
+    """
+    stored = dict(manifest, output_sha256=file_hash(output_file))
+    manifest_path = get_manifest_path(output_file)
+    with open(f"{manifest_path}.tmp", "w") as manifest_file:
+        json.dump(stored, manifest_file, indent=4)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
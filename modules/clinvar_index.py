@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:40:15 2026
+
+@author: kindi
+"""
+import os
+import sys
+import mmap
+import json
+import struct
+from array import array
+from bisect import bisect_left
+
+# Formato del índice: firma, longitud de la cabecera JSON, cabecera y columnas alineadas a 8 bytes
+INDEX_MAGIC = b"SFCVIDX1"
+INDEX_VERSION = 1
+
+# Columnas del índice: (nombre, tipo de array). 'key' combina el cromosoma y la posición
+# (id_cromosoma << 32 | posición); el resto de columnas de texto son ids de la tabla de cadenas.
+INDEX_COLUMNS = [("key", "Q"), ("ref", "I"), ("alt", "I"), ("gene", "I"), ("clinical_significance", "I"),
+                 ("clinsigsimple", "I"), ("rs", "I"), ("review_status", "I"), ("clinvar_id", "I"), ("stars", "B")]
+
+MAX_STARS = 4
+
+def get_index_path(clinvar_file):
+    """
+    Ruta del índice binario de un archivo de base de datos ClinVar (mismo nombre, extensión .idx).
+    """
+    return(f"{os.path.splitext(clinvar_file)[0]}.idx")
+
+def get_source_info(clinvar_file):
+    stat = os.stat(clinvar_file)
+    return({"file": os.path.basename(clinvar_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+
+def read_vcf_keys(vcf_path):
+    """
+    Claves ('cromosoma:posición:ref:alt') de las variantes de un VCF, en el orden del archivo.
+    """
+    variant_keys = []
+    with open(vcf_path, "r") as vcf_file:
+        for line in vcf_file:
+            if line.startswith("#"):
+                continue
+            fields = line.split("\t", 5)
+            if len(fields) > 4:
+                variant_keys.append(f"{fields[0]}:{fields[1]}:{fields[3]}:{fields[4]}")
+    return(variant_keys)
+
+def build_clinvar_index(clinvar_file):
+    """
+    Genera el índice binario de un archivo de base de datos ClinVar: las variantes ordenadas por cromosoma
+    y posición, con el cromosoma y la posición codificados como enteros, los textos (alelos, genes,
+    significado clínico...) en una tabla de cadenas sin repeticiones y el número de estrellas ya calculado.
+
+    Args:
+        clinvar_file (str): Ruta al archivo clinvar_database_<ensamblaje>_<versión>.txt.
+
+    Returns:
+        str: Ruta al índice generado.
+    """
+    # map_review_status está en el módulo PR, que a su vez usa este índice
+    from modules.run_pr_module import map_review_status
+
+    strings = {}
+    def intern(text):
+        string_id = strings.get(text)
+        if string_id is None:
+            string_id = strings[text] = len(strings)
+        return(string_id)
+
+    rows = []
+    with open(clinvar_file, "r") as db_file:
+        for order, line in enumerate(db_file):
+            line = line.rstrip()
+            if line == "":
+                continue
+            fields = line.strip().split("\t")
+            # Las variantes sin posición en el VCF no se pueden buscar
+            try:
+                pos = int(fields[15])
+            except ValueError:
+                continue
+            if pos < 0 or pos >= 2 ** 32:
+                continue
+            key = intern(fields[10]) << 32 | pos
+            rows.append((key, order, intern(fields[16]), intern(fields[17]), intern(fields[2]), intern(fields[3]),
+                         intern(fields[4]), intern(fields[5]), intern(fields[13]), intern(fields[6]),
+                         map_review_status(fields[13])))
+
+    # Orden por cromosoma y posición; dentro de una posición se conserva el orden del archivo
+    rows.sort()
+
+    # Número de variantes distintas con al menos una fila de cada nivel de evidencia
+    max_stars = {}
+    for row in rows:
+        variant = (row[0], row[2], row[3])
+        max_stars[variant] = max(max_stars.get(variant, 0), row[10])
+    counts = [0] * (MAX_STARS + 1)
+    for stars in max_stars.values():
+        for level in range(stars + 1):
+            counts[level] += 1
+
+    # Columnas y tabla de cadenas
+    columns = {name: array(typecode) for name, typecode in INDEX_COLUMNS}
+    positions = {"key": 0, "ref": 2, "alt": 3, "gene": 4, "clinical_significance": 5, "clinsigsimple": 6,
+                 "rs": 7, "review_status": 8, "clinvar_id": 9, "stars": 10}
+    for name, column in columns.items():
+        position = positions[name]
+        column.extend(row[position] for row in rows)
+    blob = bytearray()
+    offsets = array("Q", [0])
+    for text in strings:
+        blob += text.encode()
+        offsets.append(len(blob))
+    sections = [(name, columns[name].tobytes()) for name, _ in INDEX_COLUMNS]
+    sections += [("string_offsets", offsets.tobytes()), ("string_data", bytes(blob))]
+
+    # Cabecera con la posición de cada sección
+    chrom_ids = sorted({row[0] >> 32 for row in rows})
+    strings_list = list(strings)
+    chroms = {strings_list[chrom_id]: chrom_id for chrom_id in chrom_ids}
+    header = {"version": INDEX_VERSION, "byteorder": sys.byteorder, "rows": len(rows), "strings": len(strings),
+              "chroms": chroms, "counts": counts, "source": get_source_info(clinvar_file), "sections": {}}
+    # La longitud de la cabecera depende de las posiciones, que dependen de la longitud de la cabecera:
+    # se reserva espacio de sobra para las posiciones
+    header_size = len(json.dumps(header)) + 64 * len(sections) + 64
+    offset = align(len(INDEX_MAGIC) + 4 + header_size)
+    for name, data in sections:
+        header["sections"][name] = [offset, len(data)]
+        offset = align(offset + len(data))
+    header_bytes = json.dumps(header).encode().ljust(header_size)
+
+    # Escritura atómica: otro proceso puede estar leyendo el índice anterior
+    index_path = get_index_path(clinvar_file)
+    temp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as index_file:
+        index_file.write(INDEX_MAGIC + struct.pack("<I", header_size) + header_bytes)
+        for name, data in sections:
+            index_file.write(b"\0" * (header["sections"][name][0] - index_file.tell()))
+            index_file.write(data)
+    os.replace(temp_path, index_path)
+    return(index_path)
+
+def align(offset):
+    return((offset + 7) // 8 * 8)
+
+def read_index_header(index_file):
+    """
+    Lee la cabecera de un índice (de un archivo abierto o de su mmap).
+    """
+    if index_file[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        raise ValueError("no es un índice de ClinVar")
+    header_size = struct.unpack_from("<I", index_file, len(INDEX_MAGIC))[0]
+    start = len(INDEX_MAGIC) + 4
+    return(json.loads(bytes(index_file[start:start + header_size])))
+
+class ClinvarIndex:
+    """
+    Base de datos ClinVar filtrada por nivel de evidencia, leída de su índice binario con mmap.
+
+    Se usa como el diccionario de run_clinvar_filtering (get, 'in', [] y len) con claves
+    'cromosoma:posición:ref:alt', pero no carga las variantes en memoria: cada búsqueda es una búsqueda
+    binaria en las columnas del archivo, y los procesos que abren el mismo índice comparten sus páginas.
+    Si una variante aparece en varias filas, se devuelve la última que cumple el nivel de evidencia.
+    """
+    def __init__(self, index_path, evidence_level=0):
+        self.index_path = index_path
+        self.evidence_level = int(evidence_level)
+        with open(index_path, "rb") as index_file:
+            self.mm = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = read_index_header(self.mm)
+        self.chroms = self.header["chroms"]
+        view = memoryview(self.mm)
+        self.columns = {}
+        for name, typecode in INDEX_COLUMNS + [("string_offsets", "Q")]:
+            offset, length = self.header["sections"][name]
+            self.columns[name] = view[offset:offset + length].cast(typecode)
+        offset, length = self.header["sections"]["string_data"]
+        self.string_data = view[offset:offset + length]
+
+    def __reduce__(self):
+        # En otros procesos se vuelve a abrir el archivo (y se comparten sus páginas) en lugar de copiarlo
+        return(ClinvarIndex, (self.index_path, self.evidence_level))
+
+    def string(self, string_id):
+        offsets = self.columns["string_offsets"]
+        return(self.string_data[offsets[string_id]:offsets[string_id + 1]])
+
+    def encode_key(self, variant_key):
+        """
+        Clave de una variante en el índice: (cromosoma y posición codificados, ref, alt), o None si no es válida
+        o su cromosoma no está en ClinVar.
+        """
+        try:
+            chrom, pos, ref, alt = variant_key.split(":")
+            return((self.chroms[chrom] << 32 | int(pos), ref.encode(), alt.encode()))
+        except (ValueError, KeyError):
+            return None
+
+    def find_row(self, key, ref, alt, lo=0):
+        """
+        Busca la posición codificada a partir de la fila lo y devuelve la fila de la variante y la primera
+        fila de su posición (para seguir buscando desde ella), o (None, primera fila).
+        """
+        keys = self.columns["key"]
+        first = bisect_left(keys, key, lo)
+        last = first
+        while last < len(keys) and keys[last] == key:
+            last += 1
+        # La última fila de la variante que cumple el nivel de evidencia, como al construir el diccionario
+        for row in range(last - 1, first - 1, -1):
+            if (self.columns["stars"][row] >= self.evidence_level and self.string(self.columns["ref"][row]) == ref
+                    and self.string(self.columns["alt"][row]) == alt):
+                return row, first
+        return None, first
+
+    def find(self, variant_key):
+        """
+        Busca una variante y devuelve su fila en el índice, o None si no está o no cumple el nivel de evidencia.
+        """
+        encoded = self.encode_key(variant_key)
+        if encoded is None:
+            return None
+        return(self.find_row(*encoded)[0])
+
+    def get_many(self, variant_keys):
+        """
+        Busca un conjunto de variantes recorriendo el índice una sola vez: las claves se ordenan como el
+        índice (cromosoma y posición) y cada búsqueda empieza en la fila donde terminó la anterior. El coste
+        depende del número de variantes buscadas y no del tamaño de ClinVar, y solo se guardan las encontradas.
+
+        Returns:
+            dict: La información de ClinVar de las variantes encontradas.
+        """
+        probes = []
+        for variant_key in set(variant_keys):
+            encoded = self.encode_key(variant_key)
+            if encoded is not None:
+                probes.append(encoded + (variant_key,))
+        probes.sort()
+        found = {}
+        lo = 0
+        for key, ref, alt, variant_key in probes:
+            row, lo = self.find_row(key, ref, alt, lo)
+            if row is not None:
+                found[variant_key] = self.row_info(row)
+        return found
+
+    def lookup_vcf(self, vcf_path):
+        """
+        Busca todas las variantes de un VCF (por ejemplo, el de una intersección) en una sola pasada por el índice.
+
+        Returns:
+            dict: La información de ClinVar de las variantes del VCF que están en la base de datos.
+        """
+        return(self.get_many(read_vcf_keys(vcf_path)))
+
+    def find_levels(self, variant_key):
+        """
+        Busca una variante una sola vez y devuelve su fila en cada nivel de evidencia (de 0 a MAX_STARS):
+        la última fila con al menos ese número de estrellas, o None.
+        """
+        levels = [None] * (MAX_STARS + 1)
+        encoded = self.encode_key(variant_key)
+        if encoded is None:
+            return levels
+        key, ref, alt = encoded
+        keys = self.columns["key"]
+        first = bisect_left(keys, key)
+        last = first
+        while last < len(keys) and keys[last] == key:
+            last += 1
+        # Recorriendo las filas desde la última, cada fila es la de los niveles hasta sus estrellas que aún no tienen fila
+        assigned = -1
+        for row in range(last - 1, first - 1, -1):
+            stars = self.columns["stars"][row]
+            if stars > assigned and self.string(self.columns["ref"][row]) == ref and self.string(self.columns["alt"][row]) == alt:
+                for level in range(assigned + 1, stars + 1):
+                    levels[level] = row
+                assigned = stars
+                if assigned == MAX_STARS:
+                    break
+        return levels
+
+    def row_info(self, row):
+        text = lambda name: str(self.string(self.columns[name][row]), "utf-8")
+        return({
+            "Gene": text("gene"),
+            "ClinicalSignificance": text("clinical_significance"),
+            "ClinSigSimple": text("clinsigsimple"),
+            "rs": text("rs"),
+            "ReviewStatus": '(' + str(self.columns["stars"][row]) + ') ' + text("review_status"),
+            "ClinvarID": text("clinvar_id")
+        })
+
+    def get(self, variant_key, default=None):
+        row = self.find(variant_key)
+        if row is None:
+            return default
+        return(self.row_info(row))
+
+    def get_levels(self, variant_key):
+        """
+        Información de la variante en cada nivel de evidencia (de 0 a MAX_STARS), o None en los niveles en
+        los que no está, con una sola búsqueda.
+        """
+        return([None if row is None else self.row_info(row) for row in self.find_levels(variant_key)])
+
+    def __contains__(self, variant_key):
+        return self.find(variant_key) is not None
+
+    def __getitem__(self, variant_key):
+        value = self.get(variant_key)
+        if value is None:
+            raise KeyError(variant_key)
+        return value
+
+    def __len__(self):
+        return self.header["counts"][min(max(self.evidence_level, 0), MAX_STARS)]
+
+class ClinvarTiers(dict):
+    """
+    Variantes de ClinVar con su información en cada nivel de evidencia, para cuando no se puede usar el
+    índice binario: se leen en una sola pasada y se consultan igual que ClinvarIndex.get_levels.
+    """
+    def get_levels(self, variant_key):
+        return(self.get(variant_key, [None] * (MAX_STARS + 1)))
+
+def read_clinvar_tiers(clinvar_file):
+    """
+    Lee un archivo ClinVar y guarda, para cada variante y nivel de evidencia, la última fila con al menos
+    ese número de estrellas (la que usaría run_clinvar_filtering con ese nivel).
+
+    Returns:
+        ClinvarTiers: Las variantes con su información en cada nivel de evidencia.
+    """
+    from modules.run_pr_module import map_review_status
+
+    clinvar_tiers = ClinvarTiers()
+    with open(clinvar_file, "r") as db_file:
+        for line in db_file:
+            line = line.rstrip()
+            if line == "":
+                continue
+            fields = line.strip().split("\t")
+            stars = map_review_status(fields[13])
+            info = {
+                "Gene": fields[2],
+                "ClinicalSignificance": fields[3],
+                "ClinSigSimple": fields[4],
+                "rs": fields[5],
+                "ReviewStatus": '(' + str(stars) + ') ' + fields[13],
+                "ClinvarID": fields[6]
+            }
+            levels = clinvar_tiers.setdefault(f"{fields[10]}:{fields[15]}:{fields[16]}:{fields[17]}", [None] * (MAX_STARS + 1))
+            for level in range(min(stars, MAX_STARS) + 1):
+                levels[level] = info
+    return(clinvar_tiers)
+
+def index_is_current(clinvar_file):
+    """
+    Comprueba si el índice de un archivo ClinVar existe y corresponde a la versión actual del archivo.
+    """
+    index_path = get_index_path(clinvar_file)
+    if not os.path.exists(index_path):
+        return False
+    try:
+        with open(index_path, "rb") as index_file:
+            with mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header = read_index_header(mm)
+    except (ValueError, OSError):
+        return False
+    return header.get("version") == INDEX_VERSION and header.get("byteorder") == sys.byteorder and header.get("source") == get_source_info(clinvar_file)
+
+def load_clinvar_index(clinvar_file, evidence_level):
+    """
+    Abre el índice binario de un archivo ClinVar, generándolo si no existe o si el archivo ha cambiado.
+
+    Args:
+        clinvar_file (str): Ruta al archivo de base de datos ClinVar.
+        evidence_level (int): Nivel de evidencia mínimo de las variantes.
+
+    Returns:
+        ClinvarIndex: La base de datos filtrada, o None si no se ha podido generar el índice.
+    """
+    try:
+        if not index_is_current(clinvar_file):
+            print(f"Generando el índice de ClinVar para {clinvar_file}...")
+            build_clinvar_index(clinvar_file)
+        return(ClinvarIndex(get_index_path(clinvar_file), evidence_level))
+    except OSError as e:
+        print(f"No se pudo usar el índice de ClinVar ({e}); se leerá el archivo completo.")
+        return None
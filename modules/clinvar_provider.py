@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:24:52 2026
+
+@author: kindi
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from modules.clinvar_index import load_clinvar_index, read_clinvar_tiers
+from modules.clinvar_sqlite import load_clinvar_sqlite
+from modules.clinvar_vcf import load_clinvar_vcf
+
+# Número máximo de bases de datos ClinVar filtradas (archivo y nivel de evidencia) que se conservan en
+# memoria en un proceso; las menos usadas recientemente se descartan
+CLINVAR_CACHE_SIZE = 2
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_loading_locks = {}
+
+def get_clinvar_file(clinvar_db, assembly):
+    """
+    Archivo ClinVar del ensamblaje indicado a partir de la ruta de la base de datos (de cualquier ensamblaje).
+    """
+    return(f"{clinvar_db.split('GRCh')[0]}GRCh{assembly}_{clinvar_db.split('_')[-1]}")
+
+def get_cache_key(evidence_level, clinvar_db, assembly):
+    """
+    Clave de la caché: el archivo, su tamaño y su fecha de modificación (si el archivo cambia, se vuelve a
+    cargar) y el nivel de evidencia. None si el archivo no existe.
+    """
+    clinvar_file = os.path.abspath(get_clinvar_file(clinvar_db, assembly))
+    try:
+        stat = os.stat(clinvar_file)
+    except OSError:
+        return None
+    return((clinvar_file, stat.st_size, stat.st_mtime_ns, int(evidence_level)))
+
+def get_cached(key, load):
+    """
+    Devuelve el valor de la caché con esa clave o lo carga con load(), una sola vez aunque lo pidan varios
+    hilos a la vez: el resto espera a que termine la carga.
+    """
+    if key is None:
+        return(load())
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return(_cache[key])
+        loading_lock = _loading_locks.setdefault(key, threading.Lock())
+
+    with loading_lock:
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return(_cache[key])
+        value = load()
+        with _cache_lock:
+            _loading_locks.pop(key, None)
+            # Los errores de carga (None) no se guardan, para volver a intentarlo
+            if value is not None:
+                _cache[key] = value
+                while len(_cache) > CLINVAR_CACHE_SIZE:
+                    _cache.popitem(last=False)
+    return(value)
+
+def get_clinvar_variants(evidence_level, clinvar_db, assembly, backend="index"):
+    """
+    Devuelve las variantes de ClinVar filtradas por nivel de evidencia, cargándolas como mucho una vez por
+    proceso: los módulos PR y RR de una muestra, y las muestras de un lote o del servidor, comparten la
+    misma base de datos. Si dos etapas la piden a la vez, la segunda espera a que la cargue la primera.
+
+    Args:
+        evidence_level (int): El nivel de evidencia deseado para filtrar las variantes.
+        clinvar_db (str): Ruta al archivo de la base de datos de ClinVar.
+        assembly (str): Ensamblaje genómico a utilizar.
+        backend (str): 'index' (índice binario), 'sqlite' (base de datos SQLite, con búsquedas en bloque) o
+                       'vcf' (VCF de ClinVar normalizado, con acceso aleatorio por tabix).
+
+    Returns:
+        dict: Las variantes filtradas, como run_clinvar_filtering (un ClinvarIndex si se usa el índice binario,
+              un ClinvarSqlite con el backend SQLite o un ClinvarVcf con el VCF de ClinVar).
+    """
+    # run_clinvar_filtering está en el módulo PR, que a su vez usa este proveedor
+    from modules.run_pr_module import run_clinvar_filtering
+
+    def load():
+        if backend == "sqlite":
+            clinvar_sqlite = load_clinvar_sqlite(get_clinvar_file(clinvar_db, assembly), evidence_level)
+            if clinvar_sqlite is not None:
+                return(clinvar_sqlite)
+        elif backend == "vcf":
+            clinvar_vcf = load_clinvar_vcf(os.path.dirname(get_clinvar_file(clinvar_db, assembly)), assembly, evidence_level)
+            if clinvar_vcf is not None:
+                return(clinvar_vcf)
+        return(run_clinvar_filtering(evidence_level, clinvar_db, assembly))
+
+    key = get_cache_key(evidence_level, clinvar_db, assembly)
+    return(get_cached(None if key is None else key + (backend,), load))
+
+def get_clinvar_tiers(clinvar_db, assembly):
+    """
+    Devuelve las variantes de ClinVar con su información en todos los niveles de evidencia, para anotar
+    cada hallazgo con los niveles con los que se informaría sin volver a leer la base de datos. Con el
+    índice binario (que guarda las estrellas de cada fila) es el propio índice; si no, se lee el archivo
+    una sola vez. Se guarda en la misma caché que get_clinvar_variants.
+
+    Args:
+        clinvar_db (str): Ruta al archivo de la base de datos de ClinVar.
+        assembly (str): Ensamblaje genómico a utilizar.
+
+    Returns:
+        ClinvarIndex o ClinvarTiers: Objeto con el método get_levels(clave).
+    """
+    def load():
+        clinvar_file = get_clinvar_file(clinvar_db, assembly)
+        clinvar_tiers = load_clinvar_index(clinvar_file, 0)
+        if clinvar_tiers is None:
+            clinvar_tiers = read_clinvar_tiers(clinvar_file)
+        return(clinvar_tiers)
+
+    key = get_cache_key(0, clinvar_db, assembly)
+    return(get_cached(None if key is None else key[:3] + ("tiers",), load))
+
+def clear_clinvar_cache():
+    """
+    Vacía la caché de ClinVar del proceso (por ejemplo, tras una recarga del servidor).
+    """
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:12:33 2026
+
+@author: kindi
+"""
+import os
+import hashlib
+from bisect import bisect_right
+
+from modules.clinvar_index import build_clinvar_index, get_index_path
+
+# Categorías cuyas variantes se buscan en ClinVar
+SHARD_CATEGORIES = ["pr", "rr"]
+
+def get_catalog_beds(categories_path, assembly):
+    """
+    Archivos BED de los catálogos PR y RR de un ensamblaje.
+    """
+    bed_files = [f"{categories_path}{category.upper()}/{category}_genes_grch{assembly}.bed" for category in SHARD_CATEGORIES]
+    return([bed_file for bed_file in bed_files if os.path.exists(bed_file)])
+
+def read_bed_regions(bed_files, padding, strip_chr=True):
+    """
+    Lee las regiones de los archivos BED, las amplía con el margen indicado y une las que se solapan.
+
+    Args:
+        bed_files (list): Archivos BED.
+        padding (int): Margen en pares de bases a cada lado de cada región.
+        strip_chr (bool): Quitar el prefijo 'chr' de los cromosomas (como en ClinVar).
+
+    Returns:
+        dict: Por cromosoma, las listas de inicios y finales de las regiones, en coordenadas del VCF (base 1,
+              ambos extremos incluidos).
+    """
+    regions = {}
+    for bed_file in bed_files:
+        with open(bed_file, "r") as bed:
+            for line in bed:
+                fields = line.strip().split("\t")
+                if len(fields) < 3 or line.startswith(("#", "track", "browser")):
+                    continue
+                chrom = fields[0][3:] if strip_chr and fields[0].startswith("chr") else fields[0]
+                regions.setdefault(chrom, []).append((max(int(fields[1]) + 1 - padding, 1), int(fields[2]) + padding))
+
+    merged = {}
+    for chrom, chrom_regions in regions.items():
+        starts, ends = [], []
+        for start, end in sorted(chrom_regions):
+            if starts and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        merged[chrom] = (starts, ends)
+    return(merged)
+
+def in_regions(regions, chrom, pos):
+    chrom_regions = regions.get(chrom)
+    if chrom_regions is None:
+        return False
+    starts, ends = chrom_regions
+    i = bisect_right(starts, pos) - 1
+    return i >= 0 and pos <= ends[i]
+
+def get_shard_path(clinvar_file, bed_files, padding):
+    """
+    Ruta del fragmento de ClinVar para unos catálogos: el nombre incluye un hash del contenido de los BED y
+    del margen, y el ensamblaje y la versión de ClinVar, así que cambia si cambia cualquiera de ellos.
+    El nombre conserva el formato '<prefijo>GRCh<ensamblaje>_<versión>.txt' de las bases de datos ClinVar.
+    """
+    digest = hashlib.sha1(str(padding).encode())
+    for bed_file in sorted(bed_files):
+        with open(bed_file, "rb") as bed:
+            digest.update(bed.read())
+    clinvar_dir, clinvar_name = os.path.split(clinvar_file)
+    release = clinvar_name[clinvar_name.index("GRCh"):]
+    return(os.path.join(clinvar_dir, f"clinvar_shard_{digest.hexdigest()[:10]}_{release}"))
+
+def write_clinvar_shard(clinvar_file, shard_path, regions):
+    """
+    Escribe las filas de ClinVar (y la cabecera) cuya posición en el VCF está dentro de las regiones, y
+    genera su índice binario.
+
+    Returns:
+        int: Número de variantes del fragmento.
+    """
+    n_variants = 0
+    temp_path = f"{shard_path}.{os.getpid()}.tmp"
+    with open(clinvar_file, "r", newline="") as db_file, open(temp_path, "w", newline="", buffering=1024 * 1024) as shard:
+        shard.write(db_file.readline())
+        for line in db_file:
+            fields = line.split("\t", 16)
+            try:
+                pos = int(fields[15])
+            except (ValueError, IndexError):
+                continue
+            if in_regions(regions, fields[10], pos):
+                shard.write(line)
+                n_variants += 1
+    os.replace(temp_path, shard_path)
+    build_clinvar_index(shard_path)
+    return(n_variants)
+
+def remove_old_shards(shard_path):
+    """
+    Borra los fragmentos anteriores del mismo ensamblaje (otra versión de ClinVar u otros catálogos).
+    """
+    clinvar_dir, shard_name = os.path.split(shard_path)
+    assembly = shard_name[shard_name.index("GRCh"):].split("_")[0]
+    keep = [shard_name, os.path.basename(get_index_path(shard_path))]
+    for file in os.listdir(clinvar_dir or "."):
+        if file.startswith("clinvar_shard_") and f"_{assembly}_" in file and file not in keep and not file.endswith(".tmp"):
+            os.remove(os.path.join(clinvar_dir, file))
+
+def get_clinvar_shard(clinvar_db, assembly, categories_path, padding=1000):
+    """
+    Obtiene el fragmento de ClinVar con solo las variantes de las regiones de los catálogos PR y RR (con un
+    margen), generándolo si no existe. Se regenera automáticamente cuando cambia la versión de ClinVar o
+    los archivos BED de los catálogos.
+
+    Args:
+        clinvar_db (str): Ruta al archivo de base de datos ClinVar (de cualquier ensamblaje).
+        assembly (str): Ensamblaje genómico a utilizar.
+        categories_path (str): Ruta al directorio categories.
+        padding (int): Margen en pares de bases a cada lado de cada región.
+
+    Returns:
+        str: Ruta al fragmento, que se usa en lugar de la base de datos (o clinvar_db si no hay catálogos).
+    """
+    clinvar_file = f"{clinvar_db.split('GRCh')[0]}GRCh{assembly}_{clinvar_db.split('_')[-1]}"
+    bed_files = get_catalog_beds(categories_path, assembly)
+    if not bed_files:
+        return(clinvar_db)
+    shard_path = get_shard_path(clinvar_file, bed_files, padding)
+    if not os.path.exists(shard_path):
+        print(f"Generando el fragmento de ClinVar de los catálogos PR y RR (GRCh{assembly}, margen {padding} pb)...")
+        n_variants = write_clinvar_shard(clinvar_file, shard_path, read_bed_regions(bed_files, padding))
+        print(f"Fragmento de ClinVar generado: {n_variants} variantes en {shard_path}.")
+        remove_old_shards(shard_path)
+    return(shard_path)
+
+def restrict_clinvar_db(clinvar_db, assembly, config_data):
+    """
+    Sustituye la base de datos ClinVar por su fragmento de los catálogos si está activado en config.json
+    ('clinvar_catalog_shard', con el margen 'clinvar_shard_padding').
+    """
+    if clinvar_db is None or not config_data.get("clinvar_catalog_shard", False):
+        return(clinvar_db)
+    return(get_clinvar_shard(clinvar_db, assembly, config_data["categories_path"], config_data.get("clinvar_shard_padding", 1000)))
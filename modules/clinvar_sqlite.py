@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:06:31 2026
+
+@author: kindi
+"""
+import os
+import json
+import sqlite3
+import threading
+
+from modules.clinvar_index import get_source_info, read_vcf_keys, MAX_STARS
+
+SQLITE_VERSION = 1
+
+# Filas que se insertan de una vez al generar la base de datos
+INSERT_BATCH_ROWS = 50000
+
+# Significados clínicos patogénicos o probablemente patogénicos, para las consultas de los curadores
+PATHOGENIC_SIGNIFICANCES = ["Pathogenic", "Likely pathogenic", "Pathogenic/Likely pathogenic"]
+
+# 'id' es el número de fila en el archivo ClinVar: entre las filas de una variante, gana la última
+CLINVAR_SCHEMA = """
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE variants (
+    id INTEGER PRIMARY KEY, chrom TEXT, pos INTEGER, ref TEXT, alt TEXT, gene TEXT,
+    clinical_significance TEXT, clinsigsimple TEXT, rs TEXT, rcv TEXT, review_status TEXT, stars INTEGER,
+    type TEXT, name TEXT, phenotype_list TEXT, start INTEGER, stop INTEGER
+);
+CREATE TABLE variant_genes (gene TEXT, variant_id INTEGER);
+CREATE TABLE variant_rcvs (rcv TEXT, variant_id INTEGER);
+"""
+
+CLINVAR_INDEXES = """
+CREATE INDEX variants_position ON variants (chrom, pos);
+CREATE INDEX variants_stars ON variants (stars);
+CREATE INDEX variant_genes_gene ON variant_genes (gene, variant_id);
+CREATE INDEX variant_rcvs_rcv ON variant_rcvs (rcv);
+"""
+
+# Columnas de las consultas de los curadores, con los nombres de las bases de datos ClinVar
+QUERY_COLUMNS = [("chrom", "Chromosome"), ("pos", "PositionVCF"), ("ref", "ReferenceAlleleVCF"), ("alt", "AlternateAlleleVCF"),
+                 ("gene", "GeneSymbol"), ("clinical_significance", "ClinicalSignificance"), ("clinsigsimple", "ClinSigSimple"),
+                 ("rs", "RS# (dbSNP)"), ("rcv", "RCVaccession"), ("review_status", "ReviewStatus"), ("stars", "Stars"),
+                 ("type", "Type"), ("name", "Name"), ("phenotype_list", "PhenotypeList")]
+
+def get_sqlite_path(clinvar_file):
+    """
+    Ruta de la base de datos SQLite de un archivo ClinVar (mismo nombre, extensión .sqlite).
+    """
+    return(f"{os.path.splitext(clinvar_file)[0]}.sqlite")
+
+def to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def build_clinvar_sqlite(clinvar_file):
+    """
+    Genera la base de datos SQLite de un archivo ClinVar, con índices por posición, gen, RCV y número de
+    estrellas, para las consultas por gen o región y las búsquedas en bloque de un VCF.
+
+    Args:
+        clinvar_file (str): Ruta al archivo clinvar_database_<ensamblaje>_<versión>.txt.
+
+    Returns:
+        str: Ruta a la base de datos generada.
+    """
+    # map_review_status está en el módulo PR, que a su vez usa el proveedor de ClinVar
+    from modules.run_pr_module import map_review_status
+
+    sqlite_path = get_sqlite_path(clinvar_file)
+    temp_path = f"{sqlite_path}.{os.getpid()}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        # Es un archivo temporal: si se interrumpe, se vuelve a generar
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.executescript(CLINVAR_SCHEMA)
+        variants, genes, rcvs = [], [], []
+
+        def insert():
+            connection.executemany("INSERT INTO variants VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", variants)
+            connection.executemany("INSERT INTO variant_genes VALUES (?, ?)", genes)
+            connection.executemany("INSERT INTO variant_rcvs VALUES (?, ?)", rcvs)
+            variants.clear()
+            genes.clear()
+            rcvs.clear()
+
+        with open(clinvar_file, "r") as db_file:
+            db_file.readline()
+            for row_id, line in enumerate(db_file, start=1):
+                line = line.rstrip()
+                if line == "":
+                    continue
+                fields = line.strip().split("\t")
+                variants.append((row_id, fields[10], to_int(fields[15]), fields[16], fields[17], fields[2], fields[3], fields[4],
+                                 fields[5], fields[6], fields[13], map_review_status(fields[13]), fields[0], fields[1], fields[8],
+                                 to_int(fields[11]), to_int(fields[12])))
+                genes.extend((gene, row_id) for gene in fields[2].split(";") if gene and gene != "-")
+                rcvs.extend((rcv, row_id) for rcv in fields[6].split("|") if rcv)
+                if len(variants) >= INSERT_BATCH_ROWS:
+                    insert()
+        insert()
+
+        # Los índices se crean al final, que es más rápido que mantenerlos durante la carga
+        connection.executescript(CLINVAR_INDEXES)
+        connection.executemany("INSERT INTO metadata VALUES (?, ?)", [("version", str(SQLITE_VERSION)),
+                                                                     ("source", json.dumps(get_source_info(clinvar_file)))])
+        connection.commit()
+    except BaseException:
+        connection.close()
+        os.remove(temp_path)
+        raise
+    connection.close()
+    os.replace(temp_path, sqlite_path)
+    return(sqlite_path)
+
+def sqlite_is_current(clinvar_file):
+    """
+    Comprueba si la base de datos SQLite de un archivo ClinVar existe y corresponde a su versión actual.
+    """
+    sqlite_path = get_sqlite_path(clinvar_file)
+    if not os.path.exists(sqlite_path):
+        return False
+    try:
+        connection = sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True)
+        try:
+            metadata = dict(connection.execute("SELECT key, value FROM metadata").fetchall())
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return False
+    return metadata.get("version") == str(SQLITE_VERSION) and json.loads(metadata.get("source", "null")) == get_source_info(clinvar_file)
+
+def split_variant_key(variant_key):
+    """
+    Cromosoma, posición (entero), referencia y alternativo de una clave 'cromosoma:posición:ref:alt', o None.
+    """
+    try:
+        chrom, pos, ref, alt = variant_key.split(":")
+        return((chrom, int(pos), ref, alt))
+    except ValueError:
+        return None
+
+class ClinvarSqlite:
+    """
+    Base de datos ClinVar filtrada por nivel de evidencia, en SQLite.
+
+    Se usa como el diccionario de run_clinvar_filtering (get, 'in', [] y len) y además permite buscar en
+    una sola consulta todas las variantes de un VCF de intersección (lookup_vcf) y las consultas de los
+    curadores por gen, región, archivo BED o RCV. Cada hilo usa su propia conexión de solo lectura.
+    """
+    def __init__(self, sqlite_path, evidence_level=0):
+        self.sqlite_path = sqlite_path
+        self.evidence_level = int(evidence_level)
+        self.local = threading.local()
+        self.n_variants = None
+
+    def __reduce__(self):
+        return(ClinvarSqlite, (self.sqlite_path, self.evidence_level))
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = sqlite3.connect(f"file:{self.sqlite_path}?mode=ro", uri=True)
+        return connection
+
+    @staticmethod
+    def row_info(row):
+        gene, clinical_significance, clinsigsimple, rs, review_status, stars, rcv = row
+        return({
+            "Gene": gene,
+            "ClinicalSignificance": clinical_significance,
+            "ClinSigSimple": clinsigsimple,
+            "rs": rs,
+            "ReviewStatus": '(' + str(stars) + ') ' + review_status,
+            "ClinvarID": rcv
+        })
+
+    def get(self, variant_key, default=None):
+        variant = split_variant_key(variant_key)
+        if variant is None:
+            return default
+        row = self.connection().execute(
+            "SELECT gene, clinical_significance, clinsigsimple, rs, review_status, stars, rcv FROM variants "
+            "WHERE chrom = ? AND pos = ? AND ref = ? AND alt = ? AND stars >= ? ORDER BY id DESC LIMIT 1",
+            variant + (self.evidence_level,)).fetchone()
+        return default if row is None else self.row_info(row)
+
+    def get_levels(self, variant_key):
+        """
+        Información de la variante en cada nivel de evidencia (de 0 a MAX_STARS), como ClinvarIndex.get_levels.
+        """
+        levels = [None] * (MAX_STARS + 1)
+        variant = split_variant_key(variant_key)
+        if variant is None:
+            return levels
+        assigned = -1
+        for row in self.connection().execute(
+                "SELECT gene, clinical_significance, clinsigsimple, rs, review_status, stars, rcv FROM variants "
+                "WHERE chrom = ? AND pos = ? AND ref = ? AND alt = ? ORDER BY id DESC", variant):
+            stars = min(row[5], MAX_STARS)
+            if stars > assigned:
+                for level in range(assigned + 1, stars + 1):
+                    levels[level] = self.row_info(row)
+                assigned = stars
+        return levels
+
+    def __contains__(self, variant_key):
+        return self.get(variant_key) is not None
+
+    def __getitem__(self, variant_key):
+        value = self.get(variant_key)
+        if value is None:
+            raise KeyError(variant_key)
+        return value
+
+    def __len__(self):
+        if self.n_variants is None:
+            self.n_variants = self.connection().execute(
+                "SELECT COUNT(*) FROM (SELECT DISTINCT chrom, pos, ref, alt FROM variants WHERE stars >= ?)",
+                (self.evidence_level,)).fetchone()[0]
+        return self.n_variants
+
+    def get_many(self, variant_keys):
+        """
+        Busca un conjunto de variantes en una sola consulta (con una tabla temporal de claves).
+
+        Returns:
+            dict: La información de ClinVar de las variantes encontradas.
+        """
+        variants = {variant for variant in map(split_variant_key, variant_keys) if variant is not None}
+        connection = self.connection()
+        connection.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_keys (chrom TEXT, pos INTEGER, ref TEXT, alt TEXT)")
+        connection.execute("DELETE FROM lookup_keys")
+        connection.executemany("INSERT INTO lookup_keys VALUES (?, ?, ?, ?)", variants)
+        found = {}
+        for row in connection.execute(
+                "SELECT chrom, pos, ref, alt, gene, clinical_significance, clinsigsimple, rs, review_status, stars, rcv FROM ("
+                "  SELECT v.*, ROW_NUMBER() OVER (PARTITION BY v.chrom, v.pos, v.ref, v.alt ORDER BY v.id DESC) AS rank"
+                "  FROM lookup_keys AS k JOIN variants AS v ON v.chrom = k.chrom AND v.pos = k.pos AND v.ref = k.ref AND v.alt = k.alt"
+                "  WHERE v.stars >= ?"
+                ") WHERE rank = 1", (self.evidence_level,)):
+            found[f"{row[0]}:{row[1]}:{row[2]}:{row[3]}"] = self.row_info(row[4:])
+        connection.execute("DELETE FROM lookup_keys")
+        connection.commit()
+        return found
+
+    def lookup_vcf(self, vcf_path):
+        """
+        Busca en una sola consulta todas las variantes de un VCF (por ejemplo, el de una intersección).
+
+        Returns:
+            dict: La información de ClinVar de las variantes del VCF que están en la base de datos.
+        """
+        return(self.get_many(read_vcf_keys(vcf_path)))
+
+    def query(self, where, params, min_stars=None, significances=None, join=""):
+        """
+        Consulta de los curadores: filas de ClinVar que cumplen la condición, el número mínimo de estrellas
+        (por defecto, el nivel de evidencia) y, si se indican, los significados clínicos.
+
+        Returns:
+            list: Una fila (dict con los nombres de columna de ClinVar) por registro, ordenadas por posición.
+        """
+        conditions = [where, "v.stars >= ?"]
+        params = list(params) + [self.evidence_level if min_stars is None else int(min_stars)]
+        if significances:
+            conditions.append(f"v.clinical_significance IN ({', '.join('?' * len(significances))})")
+            params.extend(significances)
+        columns = ", ".join(f"v.{column}" for column, _ in QUERY_COLUMNS)
+        sql = f"SELECT DISTINCT {columns}, v.id FROM variants AS v {join} WHERE {' AND '.join(conditions)} ORDER BY v.chrom, v.pos, v.id"
+        return([dict(zip([name for _, name in QUERY_COLUMNS], row)) for row in self.connection().execute(sql, params)])
+
+    def query_gene(self, gene, min_stars=None, significances=None):
+        """
+        Registros de ClinVar de un gen (por ejemplo, los P/LP de BRCA2 con al menos 2 estrellas:
+        query_gene("BRCA2", 2, PATHOGENIC_SIGNIFICANCES)).
+        """
+        return(self.query("g.gene = ?", [gene], min_stars, significances, "JOIN variant_genes AS g ON g.variant_id = v.id"))
+
+    def query_region(self, chrom, start, end, min_stars=None, significances=None):
+        """
+        Registros de ClinVar con la posición del VCF en una región (base 1, ambos extremos incluidos).
+        """
+        chrom = chrom[3:] if chrom.startswith("chr") else chrom
+        return(self.query("v.chrom = ? AND v.pos BETWEEN ? AND ?", [chrom, int(start), int(end)], min_stars, significances))
+
+    def query_bed(self, bed_file, min_stars=None, significances=None):
+        """
+        Registros de ClinVar que solapan las regiones de un archivo BED.
+        """
+        records = []
+        with open(bed_file, "r") as bed:
+            for line in bed:
+                fields = line.strip().split("\t")
+                if len(fields) < 3 or line.startswith(("#", "track", "browser")):
+                    continue
+                records.extend(self.query_region(fields[0], int(fields[1]) + 1, int(fields[2]), min_stars, significances))
+        return(records)
+
+    def query_rcv(self, rcv):
+        """
+        Registros de ClinVar de un RCV (cualquier nivel de evidencia).
+        """
+        return(self.query("r.rcv = ?", [rcv], 0, None, "JOIN variant_rcvs AS r ON r.variant_id = v.id"))
+
+def load_clinvar_sqlite(clinvar_file, evidence_level):
+    """
+    Abre la base de datos SQLite de un archivo ClinVar, generándola si no existe o si el archivo ha cambiado.
+
+    Args:
+        clinvar_file (str): Ruta al archivo de base de datos ClinVar.
+        evidence_level (int): Nivel de evidencia mínimo de las variantes.
+
+    Returns:
+        ClinvarSqlite: La base de datos filtrada, o None si no se ha podido generar.
+    """
+    try:
+        if not sqlite_is_current(clinvar_file):
+            print(f"Generando la base de datos SQLite de ClinVar para {clinvar_file}...")
+            build_clinvar_sqlite(clinvar_file)
+        return(ClinvarSqlite(get_sqlite_path(clinvar_file), evidence_level))
+    except (OSError, sqlite3.Error) as e:
+        print(f"No se pudo usar la base de datos SQLite de ClinVar ({e}).")
+        return None
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:47:09 2026
+
+@author: kindi
+"""
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+from itertools import groupby
+
+# Almacén de versiones de ClinVar: <clinvar_path>store/<ensamblaje>/
+STORE_DIR = "store"
+STORE_MANIFEST = "releases.json"
+
+# Cada cuántas versiones se guarda una copia completa (las demás solo guardan sus cambios)
+SNAPSHOT_INTERVAL = 10
+
+# Tipos de cambio de una variante entre dos versiones
+CHANGE_TYPES = ["added", "removed", "reclassified", "review_status", "updated"]
+
+# Columnas de las bases de datos ClinVar usadas para clasificar los cambios
+CLINSIG_COLUMN = 3
+REVIEW_STATUS_COLUMN = 13
+
+CHANGE_SET_HEADER = "#change\tChromosome\tPositionVCF\tReferenceAlleleVCF\tAlternateAlleleVCF\trow\n"
+
+def get_store_path(clinvar_path, assembly):
+    return(os.path.join(clinvar_path, STORE_DIR, assembly))
+
+def parse_clinvar_name(clinvar_file):
+    """
+    Ensamblaje y versión de un archivo clinvar_database_<ensamblaje>_<versión>.txt.
+    """
+    name = os.path.splitext(os.path.basename(clinvar_file))[0]
+    assembly, version = name[len("clinvar_database_"):].split("_")
+    return(assembly, version)
+
+def read_manifest(store_path):
+    try:
+        with open(os.path.join(store_path, STORE_MANIFEST), "r") as manifest_file:
+            return(json.load(manifest_file))
+    except (OSError, ValueError):
+        return({"releases": []})
+
+def write_manifest(store_path, manifest):
+    temp_path = os.path.join(store_path, f"{STORE_MANIFEST}.{os.getpid()}.tmp")
+    with open(temp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(temp_path, os.path.join(store_path, STORE_MANIFEST))
+
+def list_releases(clinvar_path, assembly):
+    """
+    Versiones de ClinVar guardadas en el almacén de un ensamblaje ('GRCh37' o 'GRCh38'), de la más antigua
+    a la más reciente.
+    """
+    return([release["version"] for release in read_manifest(get_store_path(clinvar_path, assembly))["releases"]])
+
+def variant_key(row):
+    """
+    Clave de ordenación de una fila: cromosoma, posición, referencia y alternativo separados por tabuladores.
+    Como el tabulador va antes que cualquier carácter de los campos, ordenar por cromosoma y después por el
+    resto de la clave da el mismo orden que ordenar las claves completas.
+    """
+    fields = row.split("\t", 18)
+    return("\t".join((fields[10], fields[15], fields[16], fields[17].rstrip("\r\n"))))
+
+def group_rows(rows):
+    """
+    Agrupa las filas (ya ordenadas por clave) de cada variante: (clave, [filas]).
+    """
+    for key, key_rows in groupby(rows, key=variant_key):
+        yield key, list(key_rows)
+
+def read_release_groups(clinvar_file, temp_dir):
+    """
+    Lee una base de datos ClinVar y devuelve sus variantes ordenadas por clave, conservando el orden de
+    las filas de cada variante. Las filas se reparten primero en un archivo temporal por cromosoma, así
+    que solo se ordena en memoria un cromosoma cada vez.
+
+    Returns:
+        tuple: La cabecera y un generador de (clave, [filas]).
+    """
+    buckets = {}
+    with open(clinvar_file, "r", newline="") as db_file:
+        header = db_file.readline()
+        for row in db_file:
+            if not row.strip():
+                continue
+            chrom = row.split("\t", 11)[10]
+            bucket = buckets.get(chrom)
+            if bucket is None:
+                bucket = buckets[chrom] = open(os.path.join(temp_dir, f"chrom_{len(buckets)}.txt"), "w+", newline="")
+            bucket.write(row)
+
+    def generate():
+        try:
+            for chrom in sorted(buckets):
+                bucket = buckets[chrom]
+                bucket.seek(0)
+                rows = bucket.readlines()
+                rows.sort(key=variant_key)
+                yield from group_rows(rows)
+        finally:
+            for bucket in buckets.values():
+                bucket.close()
+    return(header, generate())
+
+def merge_groups(left, right):
+    """
+    Recorre a la vez dos secuencias de variantes ordenadas por clave y devuelve (clave, filas de la
+    izquierda o None, filas de la derecha o None).
+    """
+    left_item = next(left, None)
+    right_item = next(right, None)
+    while left_item is not None or right_item is not None:
+        if right_item is None or (left_item is not None and left_item[0] < right_item[0]):
+            yield left_item[0], left_item[1], None
+            left_item = next(left, None)
+        elif left_item is None or right_item[0] < left_item[0]:
+            yield right_item[0], None, right_item[1]
+            right_item = next(right, None)
+        else:
+            yield left_item[0], left_item[1], right_item[1]
+            left_item = next(left, None)
+            right_item = next(right, None)
+
+def classify_change(old_rows, new_rows):
+    """
+    Tipo de cambio de una variante entre dos versiones, o None si no ha cambiado. Una variante está
+    reclasificada si cambia su significado clínico; si solo cambia el estado de revisión, el cambio es
+    'review_status', y cualquier otro cambio en sus filas es 'updated'.
+    """
+    if old_rows is None:
+        return("added")
+    if new_rows is None:
+        return("removed")
+    if old_rows == new_rows:
+        return(None)
+    old_fields = [row.split("\t") for row in old_rows]
+    new_fields = [row.split("\t") for row in new_rows]
+    column_values = lambda fields, column: sorted(row_fields[column] for row_fields in fields)
+    if column_values(old_fields, CLINSIG_COLUMN) != column_values(new_fields, CLINSIG_COLUMN):
+        return("reclassified")
+    if column_values(old_fields, REVIEW_STATUS_COLUMN) != column_values(new_fields, REVIEW_STATUS_COLUMN):
+        return("review_status")
+    return("updated")
+
+def read_snapshot_groups(snapshot_file):
+    """
+    Lee una copia completa del almacén (ya ordenada por clave).
+
+    Returns:
+        tuple: La cabecera y un generador de (clave, [filas]).
+    """
+    snapshot = gzip.open(snapshot_file, "rt", newline="")
+    header = snapshot.readline()
+
+    def generate():
+        with snapshot:
+            yield from group_rows(snapshot)
+    return(header, generate())
+
+def read_change_set(change_set_file):
+    """
+    Lee un conjunto de cambios: (clave, (tipo de cambio, [filas nuevas])), ordenado por clave. Las variantes
+    eliminadas no tienen filas.
+    """
+    with gzip.open(change_set_file, "rt", newline="") as changes:
+        changes.readline()
+        records = (line.split("\t", 5) for line in changes)
+        for key, key_records in groupby(records, key=lambda fields: "\t".join(fields[1:5]).rstrip("\n")):
+            key_records = list(key_records)
+            rows = [fields[5] for fields in key_records if len(fields) == 6]
+            yield key, (key_records[0][0], rows)
+
+def apply_change_set(groups, change_set_file):
+    """
+    Aplica un conjunto de cambios a las variantes de la versión anterior.
+    """
+    for key, rows, change in merge_groups(groups, read_change_set(change_set_file)):
+        if change is None:
+            yield key, rows
+        elif change[0] != "removed":
+            yield key, change[1]
+
+def diff_releases(old_groups, new_groups, change_set_file):
+    """
+    Compara dos versiones y escribe sus cambios (variantes añadidas, eliminadas, reclasificadas, con otro
+    estado de revisión o con otros cambios), con las filas nuevas de cada variante cambiada.
+
+    Returns:
+        tuple: El número de cambios de cada tipo y un hash SHA-1 y el número de filas de la versión nueva
+               (ordenada por clave), para comprobar la versión al reconstruirla.
+    """
+    counts = dict.fromkeys(CHANGE_TYPES, 0)
+    digest = hashlib.sha1()
+    n_rows = 0
+    temp_path = f"{change_set_file}.{os.getpid()}.tmp"
+    with gzip.open(temp_path, "wt", newline="", compresslevel=6) as changes:
+        changes.write(CHANGE_SET_HEADER)
+        for key, old_rows, new_rows in merge_groups(old_groups, new_groups):
+            if new_rows is not None:
+                digest.update("".join(new_rows).encode())
+                n_rows += len(new_rows)
+            change = classify_change(old_rows, new_rows)
+            if change is None:
+                continue
+            counts[change] += 1
+            if new_rows is None:
+                changes.write(f"{change}\t{key}\n")
+            else:
+                changes.write("".join(f"{change}\t{key}\t{row}" for row in new_rows))
+    os.replace(temp_path, change_set_file)
+    return(counts, digest.hexdigest(), n_rows)
+
+def write_snapshot(header, groups, snapshot_file):
+    """
+    Escribe una copia completa de una versión, ordenada por clave.
+
+    Returns:
+        tuple: El hash SHA-1 y el número de filas de la versión (sin la cabecera).
+    """
+    digest = hashlib.sha1()
+    n_rows = 0
+    temp_path = f"{snapshot_file}.{os.getpid()}.tmp"
+    with gzip.open(temp_path, "wt", newline="", compresslevel=6) as snapshot:
+        snapshot.write(header)
+        for _, rows in groups:
+            text = "".join(rows)
+            digest.update(text.encode())
+            n_rows += len(rows)
+            snapshot.write(text)
+    os.replace(temp_path, snapshot_file)
+    return(digest.hexdigest(), n_rows)
+
+def release_groups(store_path, manifest, version):
+    """
+    Variantes de una versión guardada: su copia completa más cercana y los conjuntos de cambios posteriores.
+
+    Returns:
+        tuple: La cabecera y un generador de (clave, [filas]).
+    """
+    releases = manifest["releases"]
+    position = [release["version"] for release in releases].index(version)
+    base = max(i for i in range(position + 1) if releases[i].get("snapshot"))
+    header, groups = read_snapshot_groups(os.path.join(store_path, releases[base]["snapshot"]))
+    for release in releases[base + 1:position + 1]:
+        groups = apply_change_set(groups, os.path.join(store_path, release["changes"]))
+    return(header, groups)
+
+def store_release(clinvar_file, snapshot_interval=SNAPSHOT_INTERVAL):
+    """
+    Guarda una versión de ClinVar en el almacén: sus cambios respecto a la versión anterior y, cada
+    snapshot_interval versiones (o si es la primera), una copia completa. Las versiones anteriores que
+    siguen en el directorio clinvar como archivos completos se guardan antes, y después se borran (y sus
+    índices), porque se pueden reconstruir desde el almacén.
+
+    Args:
+        clinvar_file (str): Ruta al archivo clinvar_database_<ensamblaje>_<versión>.txt.
+        snapshot_interval (int): Cada cuántas versiones se guarda una copia completa.
+
+    Returns:
+        dict: La entrada de la versión en el almacén (versión, archivos y número de cambios de cada tipo).
+    """
+    clinvar_path = os.path.dirname(clinvar_file)
+    assembly, version = parse_clinvar_name(clinvar_file)
+    store_path = get_store_path(clinvar_path, assembly)
+    os.makedirs(store_path, exist_ok=True)
+    manifest = read_manifest(store_path)
+    stored = [release["version"] for release in manifest["releases"]]
+
+    # Versiones anteriores que aún no están en el almacén
+    older_files = sorted(os.path.join(clinvar_path, file) for file in os.listdir(clinvar_path)
+                         if file.startswith(f"clinvar_database_{assembly}_") and file.endswith(".txt"))
+    for older_file in older_files:
+        older_version = parse_clinvar_name(older_file)[1]
+        if older_version < version and older_version not in stored and (not stored or older_version > stored[-1]):
+            add_release(store_path, manifest, older_file, snapshot_interval)
+            stored.append(older_version)
+
+    if version in stored:
+        release = manifest["releases"][stored.index(version)]
+    else:
+        release = add_release(store_path, manifest, clinvar_file, snapshot_interval)
+
+    # Los archivos completos de las versiones anteriores se pueden reconstruir desde el almacén
+    for older_file in older_files:
+        older_version = parse_clinvar_name(older_file)[1]
+        if older_version < version and older_version in list_releases(clinvar_path, assembly):
+            for file in [older_file, f"{os.path.splitext(older_file)[0]}.idx", f"{os.path.splitext(older_file)[0]}.sqlite"]:
+                if os.path.exists(file):
+                    os.remove(file)
+    return(release)
+
+def add_release(store_path, manifest, clinvar_file, snapshot_interval):
+    """
+    Añade una versión al final del almacén y actualiza su manifiesto.
+    """
+    version = parse_clinvar_name(clinvar_file)[1]
+    releases = manifest["releases"]
+    if releases and version <= releases[-1]["version"]:
+        raise ValueError(f"La versión {version} de ClinVar es anterior a la última del almacén ({releases[-1]['version']}).")
+    release = {"version": version, "snapshot": None, "changes": None, "counts": None}
+
+    with tempfile.TemporaryDirectory(dir=store_path) as temp_dir:
+        header, new_groups = read_release_groups(clinvar_file, temp_dir)
+        if releases:
+            # Los cambios respecto a la versión anterior se guardan siempre (para los reanálisis)
+            _, old_groups = release_groups(store_path, manifest, releases[-1]["version"])
+            release["changes"] = f"{version}.changes.gz"
+            release["counts"], release["sha1"], release["rows"] = diff_releases(old_groups, new_groups, os.path.join(store_path, release["changes"]))
+            since_snapshot = len(releases) - max(i for i, stored in enumerate(releases) if stored.get("snapshot"))
+            if since_snapshot >= snapshot_interval:
+                header, new_groups = read_release_groups(clinvar_file, temp_dir)
+        if not releases or since_snapshot >= snapshot_interval:
+            release["snapshot"] = f"{version}.snapshot.gz"
+            release["sha1"], release["rows"] = write_snapshot(header, new_groups, os.path.join(store_path, release["snapshot"]))
+
+    releases.append(release)
+    write_manifest(store_path, manifest)
+    if release["counts"] is not None:
+        summary = ", ".join(f"{count} {change}" for change, count in release["counts"].items())
+        print(f"ClinVar {version} guardado en el almacén. Cambios respecto a {releases[-2]['version']}: {summary}.")
+    return(release)
+
+def materialize_release(clinvar_path, assembly, version):
+    """
+    Reconstruye una versión guardada como archivo clinvar_database_<ensamblaje>_<versión>.txt en el
+    directorio clinvar (si no existe ya) y genera su índice. Las filas de la versión reconstruida están
+    ordenadas por variante, con las filas de cada variante en su orden original, así que las búsquedas
+    dan los mismos resultados que con el archivo descargado.
+
+    Args:
+        clinvar_path (str): Ruta al directorio clinvar.
+        assembly (str): Ensamblaje ('GRCh37' o 'GRCh38').
+        version (str): Versión de ClinVar (AAAAMMDD).
+
+    Returns:
+        str: Ruta al archivo de la versión.
+
+    Raises:
+        ValueError: Si la versión no está en el almacén o la reconstrucción no coincide con la guardada.
+    """
+    # El índice está en clinvar_index, que usa map_review_status del módulo PR
+    from modules.clinvar_index import build_clinvar_index
+
+    clinvar_file = os.path.join(clinvar_path, f"clinvar_database_{assembly}_{version}.txt")
+    if os.path.exists(clinvar_file):
+        return(clinvar_file)
+    store_path = get_store_path(clinvar_path, assembly)
+    manifest = read_manifest(store_path)
+    versions = [release["version"] for release in manifest["releases"]]
+    if version not in versions:
+        raise ValueError(f"La versión {version} de ClinVar ({assembly}) no está en el almacén. Versiones disponibles: {', '.join(versions) or 'ninguna'}.")
+    release = manifest["releases"][versions.index(version)]
+
+    print(f"Reconstruyendo ClinVar {assembly} {version} desde el almacén...")
+    header, groups = release_groups(store_path, manifest, version)
+    digest = hashlib.sha1()
+    temp_path = f"{clinvar_file}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "w", newline="", buffering=1024 * 1024) as db_file:
+            db_file.write(header)
+            for _, rows in groups:
+                text = "".join(rows)
+                digest.update(text.encode())
+                db_file.write(text)
+        if digest.hexdigest() != release["sha1"]:
+            raise ValueError(f"La versión {version} de ClinVar reconstruida no coincide con la guardada en el almacén.")
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, clinvar_file)
+    build_clinvar_index(clinvar_file)
+    return(clinvar_file)
+
+def get_changed_variants(clinvar_path, assembly, since_version, until_version=None):
+    """
+    Variantes que han cambiado entre dos versiones guardadas, para reanalizar solo las muestras (o las
+    variantes) afectadas.
+
+    Args:
+        clinvar_path (str): Ruta al directorio clinvar.
+        assembly (str): Ensamblaje ('GRCh37' o 'GRCh38').
+        since_version (str): Versión de partida (sus cambios no se incluyen).
+        until_version (str, optional): Última versión incluida (por defecto, la más reciente).
+
+    Returns:
+        dict: Por variante ('cromosoma:posición:ref:alt'), el tipo de su último cambio.
+    """
+    store_path = get_store_path(clinvar_path, assembly)
+    releases = read_manifest(store_path)["releases"]
+    until_version = until_version or releases[-1]["version"]
+    changed = {}
+    for release in releases:
+        if since_version < release["version"] <= until_version and release["changes"] is not None:
+            for key, (change, _) in read_change_set(os.path.join(store_path, release["changes"])):
+                changed[key.replace("\t", ":")] = change
+    return(changed)
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:48:05 2026
+
+@author: kindi
+"""
+import os
+import json
+import shutil
+import subprocess
+import threading
+import urllib.request
+
+from modules.checkpoint import get_stage_manifest, get_tool_version, stage_is_current, write_stage_manifest, get_manifest_path
+from modules.normalize_vcf import get_reference, NORM_ARGS
+from modules.clinvar_index import read_vcf_keys, MAX_STARS
+
+# URL del VCF de ClinVar de cada ensamblaje (se puede cambiar con 'clinvar_vcf_url' en config.json)
+CLINVAR_VCF_URL = "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh{assembly}/clinvar.vcf.gz"
+
+DOWNLOAD_CHUNK = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+# Las variantes buscadas a menos de esta distancia (pb) se leen con una sola consulta tabix
+FETCH_WINDOW = 1000
+
+def get_clinvar_vcf_path(clinvar_path, assembly):
+    return(os.path.join(clinvar_path, f"clinvar_GRCh{assembly}.vcf.gz"))
+
+def get_normalized_clinvar_vcf_path(clinvar_path, assembly):
+    return(os.path.join(clinvar_path, f"clinvar_GRCh{assembly}.norm.vcf.gz"))
+
+def download_clinvar_vcf(clinvar_vcf, clinvar_vcf_url):
+    """
+    Descarga el VCF de ClinVar (escritura atómica, para no dejar un archivo a medias).
+    """
+    temp_path = f"{clinvar_vcf}.{os.getpid()}.tmp"
+    with urllib.request.urlopen(clinvar_vcf_url, timeout=DOWNLOAD_TIMEOUT) as response, open(temp_path, "wb") as out_file:
+        shutil.copyfileobj(response, out_file, DOWNLOAD_CHUNK)
+    os.replace(temp_path, clinvar_vcf)
+
+def normalize_clinvar_vcf(clinvar_vcf, normalized_vcf, assembly):
+    """
+    Normaliza el VCF de ClinVar igual que las muestras (bcftools norm con la misma referencia y las mismas
+    opciones), lo comprime con bgzip y lo indexa con tabix. Se omite si ya se normalizó con las mismas entradas.
+
+    Returns:
+        str: Ruta al VCF normalizado.
+    """
+    reference = get_reference(assembly)
+    manifest = get_stage_manifest("normalize_clinvar", {"vcf": clinvar_vcf, "reference": reference},
+                                  {"bcftools": get_tool_version(["bcftools", "--version"]), "args": NORM_ARGS})
+    if stage_is_current(manifest, normalized_vcf) and os.path.exists(f"{normalized_vcf}.tbi"):
+        return(normalized_vcf)
+
+    print(f"Normalizando el VCF de ClinVar (GRCh{assembly})...")
+    temp_path = f"{normalized_vcf}.{os.getpid()}.tmp.vcf.gz"
+    subprocess.run(["bcftools", "norm", "-Oz"] + NORM_ARGS + ["-f", reference, "-o", temp_path, clinvar_vcf], check=True)
+    subprocess.run(["bcftools", "index", "-t", temp_path], check=True)
+    # Número de registros, para len() sin recorrer el archivo
+    try:
+        manifest["records"] = int(subprocess.run(["bcftools", "index", "-n", temp_path], capture_output=True, text=True, check=True).stdout)
+    except (subprocess.CalledProcessError, ValueError):
+        manifest["records"] = None
+    os.replace(temp_path, normalized_vcf)
+    os.replace(f"{temp_path}.tbi", f"{normalized_vcf}.tbi")
+    write_stage_manifest(manifest, normalized_vcf)
+    return(normalized_vcf)
+
+def get_clinvar_vcf(clinvar_path, assembly, clinvar_update="no", clinvar_vcf_url=CLINVAR_VCF_URL):
+    """
+    Obtiene el VCF de ClinVar de un ensamblaje, normalizado como las muestras e indexado con tabix. Se
+    descarga si no existe o si la política de actualización es 'yes'.
+
+    Args:
+        clinvar_path (str): Ruta al directorio clinvar.
+        assembly (str): Ensamblaje genómico a utilizar.
+        clinvar_update (str): Política de actualización de ClinVar ('yes' para volver a descargarlo).
+        clinvar_vcf_url (str): URL del VCF, con '{assembly}' en lugar del ensamblaje.
+
+    Returns:
+        str: Ruta al VCF normalizado, o None si no se ha podido obtener.
+    """
+    clinvar_vcf = get_clinvar_vcf_path(clinvar_path, assembly)
+    try:
+        if clinvar_update == "yes" or not os.path.exists(clinvar_vcf):
+            print(f"Descargando el VCF de ClinVar (GRCh{assembly})...")
+            download_clinvar_vcf(clinvar_vcf, clinvar_vcf_url.format(assembly=assembly))
+        return(normalize_clinvar_vcf(clinvar_vcf, get_normalized_clinvar_vcf_path(clinvar_path, assembly), assembly))
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"No se pudo preparar el VCF de ClinVar: {e}")
+        return None
+
+def parse_clinvar_info(variation_id, info_field):
+    """
+    Información de un registro del VCF de ClinVar, con los mismos campos y formato que la base de datos
+    variant_summary (ClinvarID es el identificador de la variante en ClinVar, la columna ID del VCF).
+
+    Returns:
+        tuple: (información de la variante, número de estrellas).
+    """
+    # map_review_status está en el módulo PR, que a su vez usa este módulo a través del proveedor
+    from modules.run_pr_module import map_review_status
+
+    info = dict(item.split("=", 1) for item in info_field.split(";") if "=" in item)
+    review_status = info.get("CLNREVSTAT", "no_assertion_provided").replace("_", " ")
+    stars = map_review_status(review_status)
+    significances = f"{info.get('CLNSIG', '')}|{info.get('CLNSIGCONF', '')}"
+    pathogenic = "Pathogenic" in significances or "Likely_pathogenic" in significances
+    return({
+        "Gene": ";".join(gene.split(":")[0] for gene in info.get("GENEINFO", "").split("|") if gene),
+        "ClinicalSignificance": info.get("CLNSIG", "not_provided").replace("_", " "),
+        "ClinSigSimple": "1" if pathogenic else "0",
+        "rs": info.get("RS", "-1"),
+        "ReviewStatus": '(' + str(stars) + ') ' + review_status,
+        "ClinvarID": variation_id
+    }, stars)
+
+class ClinvarVcf:
+    """
+    Base de datos ClinVar filtrada por nivel de evidencia, leída del VCF de ClinVar normalizado (bgzip y
+    tabix) con acceso aleatorio: cada búsqueda lee solo la región de las variantes buscadas, sin cargar el
+    archivo. Se usa como el diccionario de run_clinvar_filtering (get, 'in', [] y len), con claves
+    'cromosoma:posición:ref:alt'. Si una variante aparece en varios registros, se devuelve el último que
+    cumple el nivel de evidencia.
+    """
+    def __init__(self, vcf_path, evidence_level=0):
+        self.vcf_path = vcf_path
+        self.evidence_level = int(evidence_level)
+        self.local = threading.local()
+
+    def __reduce__(self):
+        # En otros procesos se vuelve a abrir el archivo
+        return(ClinvarVcf, (self.vcf_path, self.evidence_level))
+
+    def tabix(self):
+        # pysam se importa aquí para no retrasar el arranque; cada hilo usa su propio archivo abierto
+        tabix_file = getattr(self.local, "tabix_file", None)
+        if tabix_file is None:
+            import pysam
+            tabix_file = self.local.tabix_file = pysam.TabixFile(self.vcf_path)
+            self.local.contigs = set(tabix_file.contigs)
+        return tabix_file
+
+    def fetch(self, chrom, start, end):
+        """
+        Registros que empiezan entre start y end (base 1, ambos extremos incluidos), como
+        (posición, ref, alt, información, estrellas).
+        """
+        tabix_file = self.tabix()
+        chrom = chrom[3:] if chrom.startswith("chr") else chrom
+        chrom = "MT" if chrom == "M" else chrom
+        if chrom not in self.local.contigs:
+            return
+        for line in tabix_file.fetch(chrom, start - 1, end):
+            fields = line.split("\t", 8)
+            pos = int(fields[1])
+            if start <= pos <= end:
+                yield (pos, fields[3], fields[4]) + parse_clinvar_info(fields[2], fields[7])
+
+    def records(self, variant_key):
+        """
+        Registros de una variante, como (información, estrellas), en el orden del archivo.
+        """
+        try:
+            chrom, pos, ref, alt = variant_key.split(":")
+            pos = int(pos)
+        except ValueError:
+            return []
+        return([(info, stars) for record_pos, record_ref, record_alt, info, stars in self.fetch(chrom, pos, pos)
+                if record_ref == ref and record_alt == alt])
+
+    def get(self, variant_key, default=None):
+        found = default
+        for info, stars in self.records(variant_key):
+            if stars >= self.evidence_level:
+                found = info
+        return found
+
+    def get_levels(self, variant_key):
+        """
+        Información de la variante en cada nivel de evidencia (de 0 a MAX_STARS), o None en los niveles en
+        los que no está, con una sola consulta.
+        """
+        levels = [None] * (MAX_STARS + 1)
+        for info, stars in self.records(variant_key):
+            for level in range(min(stars, MAX_STARS) + 1):
+                levels[level] = info
+        return levels
+
+    def get_many(self, variant_keys):
+        """
+        Busca un conjunto de variantes: se ordenan por posición y las que están a menos de FETCH_WINDOW pb se
+        leen con una sola consulta tabix. El coste depende del número de variantes buscadas, no del tamaño de ClinVar.
+
+        Returns:
+            dict: La información de ClinVar de las variantes encontradas.
+        """
+        wanted = {}
+        for variant_key in set(variant_keys):
+            try:
+                chrom, pos, ref, alt = variant_key.split(":")
+                wanted.setdefault(chrom, {})[(int(pos), ref, alt)] = variant_key
+            except ValueError:
+                continue
+        found = {}
+        for chrom, chrom_wanted in wanted.items():
+            positions = sorted({pos for pos, _, _ in chrom_wanted})
+            first = 0
+            for i in range(len(positions)):
+                if i + 1 < len(positions) and positions[i + 1] - positions[i] < FETCH_WINDOW:
+                    continue
+                for pos, ref, alt, info, stars in self.fetch(chrom, positions[first], positions[i]):
+                    variant_key = chrom_wanted.get((pos, ref, alt))
+                    if variant_key is not None and stars >= self.evidence_level:
+                        found[variant_key] = info
+                first = i + 1
+        return found
+
+    def lookup_vcf(self, vcf_path):
+        """
+        Busca todas las variantes de un VCF (por ejemplo, el de una intersección) por regiones.
+
+        Returns:
+            dict: La información de ClinVar de las variantes del VCF que están en la base de datos.
+        """
+        return(self.get_many(read_vcf_keys(vcf_path)))
+
+    def query_region(self, chrom, start, end, min_stars=None):
+        """
+        Registros de ClinVar con la posición en una región (base 1, ambos extremos incluidos), por ejemplo
+        la de un gen del catálogo.
+        """
+        min_stars = self.evidence_level if min_stars is None else int(min_stars)
+        return([dict(info, Chromosome=chrom, PositionVCF=pos, ReferenceAlleleVCF=ref, AlternateAlleleVCF=alt)
+                for pos, ref, alt, info, stars in self.fetch(chrom, int(start), int(end)) if stars >= min_stars])
+
+    def query_bed(self, bed_file, min_stars=None):
+        """
+        Registros de ClinVar de las regiones de un archivo BED (por ejemplo, los genes de un catálogo).
+        """
+        records = []
+        with open(bed_file, "r") as bed:
+            for line in bed:
+                fields = line.strip().split("\t")
+                if len(fields) < 3 or line.startswith(("#", "track", "browser")):
+                    continue
+                records.extend(self.query_region(fields[0], int(fields[1]) + 1, int(fields[2]), min_stars))
+        return(records)
+
+    def __contains__(self, variant_key):
+        return self.get(variant_key) is not None
+
+    def __getitem__(self, variant_key):
+        value = self.get(variant_key)
+        if value is None:
+            raise KeyError(variant_key)
+        return value
+
+    def __len__(self):
+        # Registros del VCF (de todos los niveles de evidencia), guardados al normalizarlo
+        try:
+            with open(get_manifest_path(self.vcf_path), "r") as manifest_file:
+                return(json.load(manifest_file).get("records") or 0)
+        except (OSError, ValueError):
+            return 0
+
+def load_clinvar_vcf(clinvar_path, assembly, evidence_level):
+    """
+    Abre el VCF de ClinVar normalizado de un ensamblaje (preparado por get_clinvar_vcf).
+
+    Returns:
+        ClinvarVcf: La base de datos filtrada, o None si el VCF no existe o no se puede abrir con pysam.
+    """
+    normalized_vcf = get_normalized_clinvar_vcf_path(clinvar_path, assembly)
+    if not os.path.exists(normalized_vcf):
+        print(f"No se encontró el VCF de ClinVar normalizado ({normalized_vcf}).")
+        return None
+    clinvar_vcf = ClinvarVcf(normalized_vcf, evidence_level)
+    try:
+        clinvar_vcf.tabix()
+    except (ImportError, OSError, ValueError) as e:
+        print(f"No se pudo usar el VCF de ClinVar ({e}).")
+        return None
+    return(clinvar_vcf)
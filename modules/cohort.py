@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 21:15:48 2026
+
+@author: kindi
+"""
+import os
+import gzip
+import csv
+import time
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from modules.normalize_vcf import normalize_vcf, write_regions_bed
+from modules.intersect_vcf_bed import intersect_vcf_with_beds
+from modules.run_pr_module import get_intervar_variant_key, write_combined_results_to_tsv
+from modules.run_pr_module import run_intervar as run_intervar_pr, parse_intervar_output as parse_intervar_output_pr, combine_results as combine_results_pr
+from modules.run_rr_module import run_intervar as run_intervar_rr, parse_intervar_output as parse_intervar_output_rr, combine_results as combine_results_rr
+from modules.run_fg_module import run_pharmacogenomic_risk_module
+from modules.write_report import write_report
+from modules.workspace import Workspace
+from modules.clinvar_index import ClinvarTiers
+from modules.clinvar_provider import get_clinvar_tiers
+from modules.findings_store import write_findings
+
+# Recursos compartidos por los procesos del pool (se asignan en _init_cohort_worker)
+_cohort_shared = {}
+
+def open_vcf(vcf_path):
+    """
+    Abre un archivo VCF en modo texto, esté comprimido o no.
+
+    Args:
+        vcf_path (str): Ruta al archivo VCF.
+
+    Returns:
+        file: El archivo abierto en modo texto.
+    """
+    with open(vcf_path, "rb") as vcf_file:
+        magic = vcf_file.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(vcf_path, "rt")
+    return open(vcf_path, "r")
+
+def get_vcf_samples(vcf_path):
+    """
+    Obtiene los nombres de las muestras de la cabecera de un VCF.
+
+    Args:
+        vcf_path (str): Ruta al archivo VCF.
+
+    Returns:
+        list: Lista con los nombres de las muestras.
+    """
+    with open_vcf(vcf_path) as vcf_file:
+        for line in vcf_file:
+            if line.startswith("#CHROM"):
+                return line.rstrip("\n").split("\t")[9:]
+            if not line.startswith("#"):
+                break
+    return []
+
+def genotype_to_zygosity(sample_field):
+    """
+    Convierte el campo de una muestra del VCF a la cigosidad que usa InterVar (het u hom).
+
+    Args:
+        sample_field (str): Campo de la muestra (por ejemplo, '0/1:35,20:55').
+
+    Returns:
+        str: 'het', 'hom' o None si la muestra no porta el alelo alternativo.
+    """
+    alleles = sample_field.split(":")[0].replace("|", "/").split("/")
+    alt_alleles = [allele for allele in alleles if allele not in ["0", "."]]
+    if not alt_alleles:
+        return None
+    if len(alt_alleles) == len(alleles) and len(set(alt_alleles)) == 1:
+        return "hom"
+    return "het"
+
+def split_intersection_by_sample(cohort_workspace, category, sample_workspaces):
+    """
+    Divide el VCF de intersección de la cohorte en un VCF por muestra, con la columna de esa muestra
+    y solo las variantes que porta.
+
+    Args:
+        cohort_workspace (Workspace): Directorio de trabajo de la cohorte.
+        category (str): Categoría de la intersección (pr, rr o fg).
+        sample_workspaces (dict): Directorio de trabajo de cada muestra, en el orden del VCF.
+    """
+    cohort_int_vcf = cohort_workspace.intersection_vcf(category)
+    samples = list(sample_workspaces.keys())
+    sample_lines = {sample: [] for sample in samples}
+
+    with open(cohort_int_vcf, "r") as vcf_file:
+        for line in vcf_file:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            for i, sample in enumerate(samples):
+                sample_field = fields[9 + i]
+                if genotype_to_zygosity(sample_field) is not None:
+                    sample_lines[sample].append("\t".join(fields[:9] + [sample_field]) + "\n")
+
+    for sample, sample_workspace in sample_workspaces.items():
+        with open(sample_workspace.intersection_vcf(category), "w") as fout:
+            fout.writelines(sample_lines[sample])
+
+def write_sites_intersection(cohort_workspace, category, sites_workspace):
+    """
+    Escribe las variantes de la intersección de la cohorte con una única muestra ficticia heterocigota,
+    para que InterVar anote todos los sitios una sola vez, independientemente de qué muestra los porte.
+
+    Args:
+        cohort_workspace (Workspace): Directorio de trabajo de la cohorte.
+        category (str): Categoría de la intersección (pr o rr).
+        sites_workspace (Workspace): Directorio de trabajo de los sitios de la cohorte.
+    """
+    with open(cohort_workspace.intersection_vcf(category), "r") as vcf_file, open(sites_workspace.intersection_vcf(category), "w") as fout:
+        for line in vcf_file:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            fout.write("\t".join(fields[:8] + ["GT", "0/1"]) + "\n")
+
+def get_sample_intervar_results(intervar_results, sample_workspace, category):
+    """
+    Selecciona los resultados de InterVar de la cohorte que porta una muestra y les asigna su genotipo.
+
+    Args:
+        intervar_results (dict): Resultados de InterVar para todos los sitios de la cohorte.
+        sample_workspace (Workspace): Directorio de trabajo de la muestra.
+        category (str): Categoría de genes (pr o rr).
+
+    Returns:
+        dict: Resultados de InterVar de la muestra, con el genotipo de la muestra en 'GT'.
+    """
+    sample_results = {}
+    with open(sample_workspace.intersection_vcf(category), "r") as vcf_file:
+        for line in vcf_file:
+            fields = line.rstrip("\n").split("\t")
+            variant_int = get_intervar_variant_key(fields[0], fields[1], fields[3], fields[4])
+            intervar_info = intervar_results.get(variant_int)
+            if intervar_info is not None:
+                sample_results[variant_int] = dict(intervar_info, GT=genotype_to_zygosity(fields[9]))
+    return(sample_results)
+
+def restrict_clinvar_to_cohort(clinvar_dct, cohort_workspace, categories):
+    """
+    Reduce el diccionario de ClinVar a las variantes presentes en las intersecciones de la cohorte,
+    para no copiar la base de datos completa a cada proceso.
+
+    Args:
+        clinvar_dct (dict): Variantes de ClinVar.
+        cohort_workspace (Workspace): Directorio de trabajo de la cohorte.
+        categories (list): Categorías analizadas.
+
+    Returns:
+        dict: Variantes de ClinVar presentes en la cohorte.
+    """
+    # El índice binario y la base de datos SQLite buscan todas las variantes juntas, ordenadas por posición
+    if hasattr(clinvar_dct, "get_many"):
+        return(clinvar_dct.get_many(get_cohort_variant_keys(cohort_workspace, categories)))
+    restricted = {}
+    for variant_key in get_cohort_variant_keys(cohort_workspace, categories):
+        if variant_key in clinvar_dct:
+            restricted[variant_key] = clinvar_dct[variant_key]
+    return(restricted)
+
+def restrict_clinvar_tiers_to_cohort(clinvar_tiers, cohort_workspace, categories):
+    """
+    Igual que restrict_clinvar_to_cohort, con la información de ClinVar de cada nivel de evidencia.
+
+    Returns:
+        ClinvarTiers: Variantes de ClinVar presentes en la cohorte, en todos los niveles de evidencia.
+    """
+    restricted = ClinvarTiers()
+    for variant_key in get_cohort_variant_keys(cohort_workspace, categories):
+        levels = clinvar_tiers.get_levels(variant_key)
+        if any(levels):
+            restricted[variant_key] = levels
+    return(restricted)
+
+def get_cohort_variant_keys(cohort_workspace, categories):
+    """
+    Claves ('cromosoma:posición:ref:alt') de las variantes de las intersecciones PR y RR de la cohorte.
+    """
+    for category in categories:
+        if category not in ["pr", "rr"]:
+            continue
+        with open(cohort_workspace.intersection_vcf(category), "r") as vcf_file:
+            for line in vcf_file:
+                if line.startswith("#"):
+                    continue
+                fields = line.split("\t")
+                yield f"{fields[0]}:{fields[1]}:{fields[3]}:{fields[4]}"
+
+def _init_cohort_worker(shared):
+    """
+    Inicializa cada proceso del pool con los recursos compartidos de la cohorte.
+    """
+    global _cohort_shared
+    _cohort_shared = shared
+
+def analyze_cohort_sample(sample, sample_workspace, cohort_name, cohort_key, categories, mode, assembly, hpos_txt, config_data):
+    """
+    Analiza una muestra de la cohorte a partir de su VCF de intersección: genotipos, combinación con
+    ClinVar, diplotipos farmacogenéticos e informe final.
+
+    Args:
+        sample (str): Nombre de la muestra.
+        sample_workspace (Workspace): Directorio de trabajo de la muestra.
+        cohort_name (str): Nombre de la cohorte (nombre base del VCF).
+        cohort_key (str): Identificador del VCF de la cohorte (Workspace.input_key), que nombra el informe y
+                          la muestra en la base de datos de hallazgos.
+        categories (list): Categorías a analizar.
+        mode (str): Modo de análisis ("basic" o "advanced").
+        assembly (str): Ensamblaje genómico a utilizar.
+        hpos_txt (str): Ruta al archivo de HPOs (o None).
+        config_data (dict): Valores del archivo de configuración.
+
+    Returns:
+        dict: Resumen de la muestra para el informe de la cohorte.
+    """
+    start = time.perf_counter()
+    resources = _cohort_shared["resources"]
+    intervar_results = _cohort_shared["intervar_results"]
+    categories_path = config_data["categories_path"]
+    summary = {"sample": sample, "status": "ok", "PR": "NA", "RR": "NA", "FG": "NA", "report": "NA"}
+
+    try:
+        pr_results = rr_results = fg_results = haplot_results = None
+        for category, combine in [("pr", combine_results_pr), ("rr", combine_results_rr)]:
+            if category not in categories:
+                continue
+            sample_intervar = get_sample_intervar_results(intervar_results[category], sample_workspace, category)
+            if mode == "advanced":
+                results = combine(sample_workspace, category, sample_intervar, resources["clinvar_dct"], resources.get("clinvar_tiers"))
+                write_combined_results_to_tsv(results, sample_workspace, category)
+            else:
+                results = sample_intervar
+            summary[category.upper()] = len(results)
+            if category == "pr":
+                pr_results = results
+            else:
+                rr_results = results
+
+        if "fg" in categories:
+            fg_results, haplot_results = run_pharmacogenomic_risk_module(categories_path, sample_workspace, assembly, resources["fg_json"], resources["diplo_pheno_dct"])
+            summary["FG"] = "; ".join(f"{result['Gene']} {result['Diplotipo']}" for result in haplot_results)
+
+        out_file = write_report(pr_results, rr_results, fg_results, haplot_results, categories_path, config_data["out_path"], categories, f"{cohort_name}_{sample}.vcf", hpos_txt, resources,
+                                report_name=f"{cohort_key}_{sample}")
+        summary["report"] = out_file or "NA"
+        if not out_file:
+            summary["status"] = "error"
+        elif config_data.get("findings_db"):
+            write_findings(config_data["findings_db"], f"{cohort_key}_{sample}", {"pr": pr_results, "rr": rr_results}, out_file)
+    except Exception as e:
+        print(f"Error al analizar la muestra {sample}: {e}")
+        summary["status"] = "error"
+
+    summary["seconds"] = f"{time.perf_counter() - start:.2f}"
+    return(summary)
+
+def write_cohort_summary(summaries, out_path, cohort_key):
+    """
+    Escribe el resumen de la cohorte: número de variantes P/LP por categoría, diplotipos e informe de cada muestra.
+
+    Args:
+        summaries (list): Resúmenes de las muestras.
+        out_path (str): Ruta al directorio de resultados.
+        cohort_key (str): Identificador del VCF de la cohorte (Workspace.input_key).
+
+    Returns:
+        str: Ruta al archivo de resumen.
+    """
+    summary_file = f"{out_path}{cohort_key}_cohort_summary.tsv"
+    with open(summary_file, "w", newline="") as tsv_file:
+        fieldnames = ["sample", "status", "PR", "RR", "FG", "seconds", "report"]
+        writer = csv.DictWriter(tsv_file, fieldnames=fieldnames, delimiter="\t")
+        writer.writeheader()
+        for summary in summaries:
+            writer.writerow(summary)
+    return(summary_file)
+
+def run_cohort(vcf_file, hpos_txt, categories, mode, evidence, assembly, clinvar_db, config_data, resources, jobs=1, force_stages=None, retention="keep"):
+    """
+    Analiza un VCF multimuestra: normaliza e intersecta la cohorte una sola vez, anota sus sitios con InterVar
+    y reparte el trabajo de cada muestra en un pool de procesos.
+
+    Args:
+        vcf_file (str): Ruta al VCF multimuestra.
+        hpos_txt (str): Ruta al archivo de HPOs (o None), común a todas las muestras.
+        categories (list): Categorías a analizar.
+        mode (str): Modo de análisis ("basic" o "advanced").
+        evidence (int): Nivel de evidencia de ClinVar.
+        assembly (str): Ensamblaje genómico a utilizar.
+        clinvar_db (str): Ruta al archivo de base de datos ClinVar (None en modo básico).
+        config_data (dict): Valores del archivo de configuración.
+        resources (dict): Recursos compartidos ya cargados.
+        jobs (int): Número de procesos para el análisis por muestra.
+        force_stages (list, optional): Etapas que se repiten aunque sus entradas no hayan cambiado.
+        retention (str): Política de retención de los archivos intermedios ('keep', 'delete' u 'on_success').
+
+    Returns:
+        str: Ruta al resumen de la cohorte.
+
+    Raises:
+        RuntimeError: Si falla la normalización o la intersección de la cohorte: sin ellas no hay muestras
+                      que analizar, y los archivos de una ejecución anterior no corresponden a este VCF.
+    """
+    start = time.perf_counter()
+    categories_path = config_data["categories_path"]
+    temp_path = config_data["temp_path"]
+    intervar_path = config_data["intervar_path"]
+    cohort_name = vcf_file.split('/')[-1].split('.vcf')[0]
+    cohort_key = Workspace.input_key(vcf_file)
+    if force_stages is None:
+        force_stages = []
+
+    # Directorio de trabajo de la cohorte, con un subdirectorio por muestra
+    with Workspace.for_input(temp_path, vcf_file, retention) as workspace:
+        # Normalizar e intersectar la cohorte una sola vez
+        regions_bed = None
+        if config_data.get("normalize_catalog_regions", False):
+            regions_bed = write_regions_bed(workspace, categories, assembly, categories_path, config_data.get("normalize_padding", 200))
+        try:
+            norm_vcf = normalize_vcf(vcf_file, workspace, assembly, "normalize" in force_stages, config_data.get("normalize_threads", 0),
+                                     config_data.get("normalize_compression_level", 6), regions_bed,
+                                     config_data.get("normalize_engine", "bcftools"), config_data.get("normalize_native_max_bytes", 1000000))
+        except (subprocess.CalledProcessError, OSError) as e:
+            raise RuntimeError(f"La normalización de la cohorte {cohort_name} ha fallado: {e}") from e
+        intersected = intersect_vcf_with_beds(workspace, categories, assembly, categories_path, "intersect" in force_stages, norm_vcf)
+        if set(intersected) != set(categories):
+            raise RuntimeError(f"La intersección de la cohorte {cohort_name} ha fallado para "
+                               f"{', '.join(category for category in categories if category not in intersected)}")
+
+        samples = get_vcf_samples(norm_vcf)
+        print(f"Cohorte {cohort_name}: {len(samples)} muestras.")
+
+        # Directorio de trabajo de cada muestra
+        sample_workspaces = {}
+        for sample in samples:
+            sample_name = sample.replace(os.sep, '_').replace(' ', '_')
+            sample_workspaces[sample] = workspace.child(sample_name, f"samples/{sample_name}")
+        for category in categories:
+            split_intersection_by_sample(workspace, category, sample_workspaces)
+
+        # Anotar con InterVar todos los sitios de la cohorte una sola vez por categoría
+        intervar_results = {}
+        sites_workspace = workspace.child("sites")
+        for category, run_intervar, parse_intervar_output in [("pr", run_intervar_pr, parse_intervar_output_pr), ("rr", run_intervar_rr, parse_intervar_output_rr)]:
+            if category in categories:
+                print(f"Ejecutando InterVar sobre los sitios de la cohorte ({category.upper()})...")
+                write_sites_intersection(workspace, category, sites_workspace)
+                run_intervar(sites_workspace, category, assembly, intervar_path, "intervar" in force_stages)
+                intervar_results[category] = parse_intervar_output(sites_workspace, category, mode, assembly)
+
+        # Solo se copian a los procesos las variantes de ClinVar presentes en la cohorte
+        shared_resources = dict(resources)
+        if resources.get("clinvar_dct") is not None:
+            shared_resources["clinvar_dct"] = restrict_clinvar_to_cohort(resources["clinvar_dct"], workspace, categories)
+            # Modo de varios niveles de evidencia: ClinVar en todos los niveles, también restringido a la cohorte
+            if config_data.get("evidence_tiers", False):
+                shared_resources["clinvar_tiers"] = restrict_clinvar_tiers_to_cohort(get_clinvar_tiers(clinvar_db, assembly), workspace, categories)
+        shared = {"resources": shared_resources, "intervar_results": intervar_results}
+
+        # Repartir el análisis de las muestras en un pool de procesos
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_cohort_worker, initargs=(shared,)) as executor:
+            futures = [executor.submit(analyze_cohort_sample, sample, sample_workspaces[sample], cohort_name, cohort_key, categories, mode, assembly, hpos_txt, config_data) for sample in samples]
+            summaries = [future.result() for future in futures]
+
+    summary_file = write_cohort_summary(summaries, config_data["out_path"], cohort_key)
+    n_ok = len([summary for summary in summaries if summary["status"] == "ok"])
+    print(f"Muestras analizadas: {n_ok}/{len(samples)} en {time.perf_counter() - start:.2f} s.")
+    print(f"Resumen de la cohorte guardado en '{summary_file}'.")
+
+    return(summary_file)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:31:12 2026
+
+@author: kindi
+"""
+import sqlite3
+from datetime import datetime
+
+FINDINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS findings (
+    sample TEXT, category TEXT, chrom TEXT, pos INTEGER, ref TEXT, alt TEXT, gene TEXT, genotype TEXT,
+    intervar_classification TEXT, clinvar_significance TEXT, review_status TEXT, clinvar_id TEXT,
+    max_evidence_level INTEGER, report TEXT, run_date TEXT
+);
+CREATE INDEX IF NOT EXISTS findings_sample ON findings (sample);
+CREATE INDEX IF NOT EXISTS findings_gene ON findings (gene);
+CREATE INDEX IF NOT EXISTS findings_position ON findings (chrom, pos);
+"""
+
+# Tiempo máximo de espera (segundos) si otro proceso está escribiendo (modos por lotes y cohorte)
+FINDINGS_TIMEOUT = 60
+
+def open_findings_db(findings_db):
+    connection = sqlite3.connect(findings_db, timeout=FINDINGS_TIMEOUT)
+    connection.executescript(FINDINGS_SCHEMA)
+    return(connection)
+
+def write_findings(findings_db, sample, results_by_category, report):
+    """
+    Guarda los hallazgos PR y RR de una muestra en la base de datos de hallazgos, sustituyendo los de
+    análisis anteriores de la misma muestra.
+
+    Args:
+        findings_db (str): Ruta a la base de datos SQLite de hallazgos ('findings_db' en config.json).
+        sample (str): Nombre de la muestra.
+        results_by_category (dict): Resultados de cada categoría ('pr', 'rr'), o None si no se ha analizado.
+        report (str): Ruta al informe de la muestra.
+    """
+    run_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    for category, results in results_by_category.items():
+        for variant_key, info in (results or {}).items():
+            chrom, pos, ref, alt = variant_key.split(":")
+            rows.append((sample, category, chrom, int(pos), ref, alt, info.get("Gene"),
+                         info.get("Genotype"), info.get("IntervarClassification"),
+                         info.get("ClinvarClinicalSignificance"), info.get("ReviewStatus"), info.get("ClinvarID"),
+                         info.get("MaxEvidenceLevel"), report, run_date))
+    connection = open_findings_db(findings_db)
+    try:
+        with connection:
+            connection.execute("DELETE FROM findings WHERE sample = ?", (sample,))
+            connection.executemany("INSERT INTO findings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    finally:
+        connection.close()
+
+def query_findings(findings_db, gene=None, sample=None, chrom=None, start=None, end=None):
+    """
+    Hallazgos guardados, filtrados por gen, muestra o región (base 1, ambos extremos incluidos).
+
+    Returns:
+        list: Un dict por hallazgo.
+    """
+    conditions, params = [], []
+    for column, value in [("gene", gene), ("sample", sample), ("chrom", chrom)]:
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if start is not None and end is not None:
+        conditions.append("pos BETWEEN ? AND ?")
+        params.extend([int(start), int(end)])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    connection = open_findings_db(findings_db)
+    try:
+        connection.row_factory = sqlite3.Row
+        return([dict(row) for row in connection.execute(f"SELECT * FROM findings {where} ORDER BY sample, chrom, pos", params)])
+    finally:
+        connection.close()
@@ -4,16 +4,179 @@ Created on Sun Aug 13 15:12:18 2023
 
 @author: kindi
 """
+import io
 import os
 import gzip
 import csv
+import json
+import time
+import zlib
+import signal
+import subprocess
+import http.client
+import urllib.error
 import urllib.request
 from datetime import datetime
+from operator import itemgetter
+from contextlib import contextmanager, ExitStack
 import shutil
 
+from modules.clinvar_index import build_clinvar_index
+from modules.clinvar_store import store_release
+from modules.clinvar_sqlite import build_clinvar_sqlite
+
+# URL del archivo CLINVAR (se puede cambiar con 'clinvar_url' en config.json)
+CLINVAR_URL = "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/tab_delimited/variant_summary.txt.gz"
+
+# Estado de la última descarga (Last-Modified y ETag del servidor), para las peticiones condicionales
+RELEASE_STATE = "clinvar_release.json"
+
+# Descarga: tamaño de bloque, tiempo de espera, reintentos y espera inicial entre reintentos (segundos)
+DOWNLOAD_CHUNK = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_RETRIES = 5
+RETRY_DELAY = 1
+
+# Nombres de las columnas de interés
+CLINVAR_COLUMNS = ["Type", "Name", "GeneSymbol",
+                   "ClinicalSignificance", "ClinSigSimple", "RS# (dbSNP)", "RCVaccession",
+                   "PhenotypeIDS", "PhenotypeList", "Assembly", 
+                   "Chromosome", "Start", "Stop", "ReviewStatus", 
+                   "SubmitterCategories", "PositionVCF", 
+                   "ReferenceAlleleVCF", "AlternateAlleleVCF"]
+
+CLINVAR_ASSEMBLIES = ["GRCh37", "GRCh38"]
+
+# Filas que se acumulan antes de escribirlas de una vez en cada archivo de salida
+WRITE_BATCH_ROWS = 20000
+
+@contextmanager
+def open_clinvar_summary(summary_gz, threads=True):
+    """
+    Abre variant_summary.txt.gz en modo texto. Si pigz está instalado y threads es True, la descompresión
+    se hace en un proceso aparte con varios hilos; si no, se usa gzip.
+    
+    Args:
+        summary_gz (str): Ruta al archivo variant_summary.txt.gz.
+        threads (bool): Usar pigz si está disponible.
+    """
+    pigz = shutil.which("pigz") if threads else None
+    if pigz is None:
+        with gzip.open(summary_gz, "rt") as gz_file:
+            yield gz_file
+        return
+    process = subprocess.Popen([pigz, "-dc", summary_gz], stdout=subprocess.PIPE)
+    try:
+        with io.TextIOWrapper(process.stdout) as gz_file:
+            yield gz_file
+    finally:
+        process.stdout.close()
+        if process.wait() not in [0, -signal.SIGPIPE]:
+            raise RuntimeError(f"Error al descomprimir {summary_gz} con pigz (código {process.returncode})")
+
+def get_output_files(release_date, clinvar_path, assemblies=CLINVAR_ASSEMBLIES):
+    return({assembly: f"{clinvar_path}clinvar_database_{assembly}_{release_date.strftime('%Y%m%d')}.txt" for assembly in assemblies})
+
+def write_clinvar_data(summary_file, output_files, clinvar_sqlite=False):
+    """
+    Escribe las columnas de interés de cada fila de variant_summary en el archivo de su ensamblaje, en una
+    sola lectura. Los archivos se escriben con un nombre temporal y se renombran al terminar, para que una
+    lectura interrumpida no deje una base de datos incompleta, y después se genera el índice binario de cada
+    uno y se guardan sus cambios en el almacén de versiones.
+    
+    Args:
+        summary_file: Líneas de variant_summary ya descomprimidas (archivo en modo texto).
+        output_files (dict): El archivo de salida de cada ensamblaje.
+        clinvar_sqlite (bool): Generar también la base de datos SQLite de cada ensamblaje.
+    """
+    part_files = {assembly: os.path.join(os.path.dirname(output_file), f".{os.path.basename(output_file)}.part")
+                  for assembly, output_file in output_files.items()}
+    
+    try:
+        write_assembly_files(summary_file, part_files)
+    except BaseException:
+        for part_file in part_files.values():
+            if os.path.exists(part_file):
+                os.remove(part_file)
+        raise
+    
+    for assembly, part_file in part_files.items():
+        os.replace(part_file, output_files[assembly])
+        # Índice binario para buscar variantes sin cargar la base de datos completa
+        build_clinvar_index(output_files[assembly])
+        # Base de datos SQLite para las consultas por gen o región (backend 'sqlite')
+        if clinvar_sqlite:
+            build_clinvar_sqlite(output_files[assembly])
+        # Cambios respecto a la versión anterior en el almacén de versiones (que sustituye a los archivos anteriores)
+        try:
+            store_release(output_files[assembly])
+        except (OSError, ValueError) as e:
+            print(f"No se pudo guardar la versión de ClinVar {assembly} en el almacén: {e}")
+
+def write_assembly_files(summary_file, part_files):
+    """
+    Escribe las filas de cada ensamblaje en su archivo temporal.
+    """
+    with ExitStack() as stack:
+        header_fields = summary_file.readline().strip().split("\t")
+        get_relevant_fields = itemgetter(*[header_fields.index(col) for col in CLINVAR_COLUMNS])
+        assembly_column_index = header_fields.index("Assembly")
+        
+        # Un archivo y un búfer de líneas por ensamblaje
+        outputs = {}
+        buffers = {}
+        for assembly, part_file in part_files.items():
+            outputs[assembly] = stack.enter_context(open(part_file, "w", buffering=1024 * 1024))
+            csv.writer(outputs[assembly], delimiter="\t").writerow(CLINVAR_COLUMNS)
+            buffers[assembly] = []
+        
+        # Las filas sin comillas se escriben directamente; el resto, con csv.writer,
+        # para que el formato de salida (comillas y fin de línea) sea el de siempre
+        quoted_line = io.StringIO()
+        quoted_writer = csv.writer(quoted_line, delimiter="\t")
+        for line in summary_file:
+            line = line.strip()
+            row = line.split("\t")
+            buffer = buffers.get(row[assembly_column_index])  # Filtro por ensamblaje (GRCh37 o GRCh38)
+            if buffer is None:
+                continue
+            if '"' in line:
+                quoted_line.seek(0)
+                quoted_line.truncate()
+                quoted_writer.writerow(get_relevant_fields(row))
+                buffer.append(quoted_line.getvalue())
+            else:
+                buffer.append("\t".join(get_relevant_fields(row)) + "\r\n")
+            if len(buffer) >= WRITE_BATCH_ROWS:
+                outputs[row[assembly_column_index]].write("".join(buffer))
+                buffer.clear()
+        
+        for assembly, buffer in buffers.items():
+            outputs[assembly].write("".join(buffer))
+
+def split_clinvar_data(release_date, clinvar_path, assemblies=CLINVAR_ASSEMBLIES, threads=True, clinvar_sqlite=False):
+    """
+    Procesa el archivo variant_summary.txt.gz de CLINVAR en una sola lectura, escribiendo las columnas de
+    interés de cada fila en el archivo del ensamblaje que le corresponde.
+    
+    Args:
+        release_date (datetime.datetime): La fecha de lanzamiento de los datos de CLINVAR.
+        clinvar_path: Ruta al directorio clinvar.
+        assemblies (list): Ensamblajes para los que se generan archivos (por ejemplo, 'GRCh37' y 'GRCh38').
+        threads (bool): Descomprimir con pigz (varios hilos) si está instalado.
+        clinvar_sqlite (bool): Generar también la base de datos SQLite de cada ensamblaje.
+    
+    Returns:
+        dict: El nombre del archivo de salida de cada ensamblaje.
+    """
+    output_files = get_output_files(release_date, clinvar_path, assemblies)
+    with open_clinvar_summary(f"{clinvar_path}variant_summary.txt.gz", threads) as gz_file:
+        write_clinvar_data(gz_file, output_files, clinvar_sqlite)
+    return(output_files)
+
 def process_clinvar_data(assembly, release_date, clinvar_path):
     """
-    Descarga y procesa los datos de CLINVAR para una versión de ensamblaje específica.
+    Procesa los datos de CLINVAR para una versión de ensamblaje específica.
     
     Args:
         assembly (str): La versión de ensamblaje para la cual se desean los datos (por ejemplo, 'GRCh37' o 'GRCh38').
@@ -22,90 +185,213 @@ def process_clinvar_data(assembly, release_date, clinvar_path):
     
     Returns:
         str: El nombre del archivo de salida que contiene los datos procesados.
-    
-    Raises:
-        Exception: Si ocurre un error durante el procesamiento de los datos.
+    """
+    return(split_clinvar_data(release_date, clinvar_path, [assembly])[assembly])
 
+def get_latest_clinvar(clinvar_path):
     """
-    # Nombres de las columnas de interés
-    columns_of_interest_names = ["Type", "Name", "GeneSymbol",
-                                 "ClinicalSignificance", "ClinSigSimple", "RS# (dbSNP)", "RCVaccession",
-                                 "PhenotypeIDS", "PhenotypeList", "Assembly", 
-                                 "Chromosome", "Start", "Stop", "ReviewStatus", 
-                                 "SubmitterCategories", "PositionVCF", 
-                                 "ReferenceAlleleVCF", "AlternateAlleleVCF"]
+    Busca el archivo de base de datos ClinVar más reciente en el directorio clinvar.
     
-    # Nombre del archivo de salida
-    output_file = f"{clinvar_path}clinvar_database_{assembly}_{release_date.strftime('%Y%m%d')}.txt"
-    
-    # Procesar el archivo CLINVAR
-    with gzip.open(f"{clinvar_path}variant_summary.txt.gz", "rt") as gz_file, open(output_file, "w") as output:
-        csv_writer = csv.writer(output, delimiter="\t")
-        header_line = gz_file.readline().strip()
-        header_fields = header_line.split("\t")
-        columns_of_interest_positions = [header_fields.index(col) for col in columns_of_interest_names]
-        
-        # Find the index of the "Assembly" column
-        for idx, field in enumerate(header_fields):
-            if field == "Assembly":
-                assembly_column_index = idx
-                break
-    
-        # Agregar las columnas de interés al archivo de salida
-        csv_writer.writerow(columns_of_interest_names)
+    Args:
+        clinvar_path: Ruta al directorio clinvar.
     
-        for line in gz_file:
-            row = line.strip().split("\t")
-            if row[assembly_column_index] == assembly:  # Filtro por ensamblaje (GRCh37 o GRCh38)
-                relevant_fields = [row[pos] for pos in columns_of_interest_positions]
-                csv_writer.writerow(relevant_fields)
+    Returns:
+        str: Ruta al archivo ClinVar más reciente, o None si no hay ninguno.
+    """
+    clinvar_files = [file for file in os.listdir(clinvar_path) if file.startswith("clinvar_database_") and file.endswith(".txt")]
+    if not clinvar_files:
+        return None
+    clinvar_files.sort(reverse=True)
+    return(f"{clinvar_path}{clinvar_files[0]}")
+
+class ClinvarChangedError(Exception):
+    """
+    El archivo ClinVar ha cambiado en el servidor durante la descarga, así que no se puede reanudar.
+    """
+
+class ClinvarDownload(io.RawIOBase):
+    """
+    Flujo con el contenido descomprimido de variant_summary.txt.gz mientras se descarga, sin guardar el
+    archivo comprimido en disco.
     
-    return output_file
+    Si la conexión se corta, la descarga continúa con una petición Range desde el último byte recibido
+    (condicionada con If-Range a que el archivo no haya cambiado), y el descompresor sigue donde estaba.
+    """
+    def __init__(self, response, clinvar_url, retries=DOWNLOAD_RETRIES):
+        self.response = response
+        self.clinvar_url = clinvar_url
+        self.retries = retries
+        self.validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        self.decompressor = zlib.decompressobj(wbits=31)
+        self.received = 0
+        self.data = b""
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def _resume(self):
+        headers = {"Range": f"bytes={self.received}-"}
+        if self.validator:
+            headers["If-Range"] = self.validator
+        response = urllib.request.urlopen(urllib.request.Request(self.clinvar_url, headers=headers), timeout=DOWNLOAD_TIMEOUT)
+        if response.status == 206 and response.headers.get("Content-Range", "").startswith(f"bytes {self.received}-"):
+            return(response)
+        
+        # Servidor sin peticiones Range: si el archivo es el mismo, descartar los bytes ya recibidos
+        if response.status == 200 and self.validator in [response.headers.get("ETag"), response.headers.get("Last-Modified")]:
+            skipped = 0
+            while skipped < self.received:
+                chunk = response.read(min(DOWNLOAD_CHUNK, self.received - skipped))
+                if not chunk:
+                    raise ConnectionError("conexión cerrada antes de llegar al byte de reanudación")
+                skipped += len(chunk)
+            return(response)
+        response.close()
+        raise ClinvarChangedError("El archivo ClinVar ha cambiado en el servidor durante la descarga.")
+
+    def _read_chunk(self):
+        """
+        Lee el siguiente bloque comprimido, reanudando la descarga si la conexión se ha cortado.
+        """
+        attempt = 0
+        while True:
+            try:
+                if self.response is None:
+                    self.response = self._resume()
+                chunk = self.response.read(DOWNLOAD_CHUNK)
+                # Un bloque vacío antes del final del flujo gzip indica una conexión cortada
+                if chunk or self.decompressor.eof:
+                    self.received += len(chunk)
+                    return(chunk)
+                error = "conexión cerrada antes del final del archivo"
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+            attempt += 1
+            if attempt > self.retries:
+                raise ConnectionError(f"No se pudo completar la descarga de ClinVar: {error}")
+            print(f"Descarga de ClinVar interrumpida ({error}); reanudando desde el byte {self.received} (intento {attempt} de {self.retries})...")
+            if self.response is not None:
+                self.response.close()
+                self.response = None
+            time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+
+    def _decompress(self, chunk):
+        data = self.decompressor.decompress(chunk)
+        # Archivos gzip con varios miembros: seguir con un descompresor nuevo
+        while self.decompressor.eof and self.decompressor.unused_data:
+            unused_data = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(wbits=31)
+            data += self.decompressor.decompress(unused_data)
+        return(data)
+
+    def readinto(self, buffer):
+        while self.offset >= len(self.data):
+            chunk = self._read_chunk()
+            if not chunk:
+                return 0
+            self.data = self._decompress(chunk)
+            self.offset = 0
+        size = min(len(buffer), len(self.data) - self.offset)
+        buffer[:size] = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return(size)
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+        super().close()
 
-def get_clinvar(clinvar_path):
+def read_release_state(clinvar_path):
+    """
+    Lee el estado de la última descarga de ClinVar (URL, Last-Modified, ETag y versión).
+    """
+    try:
+        with open(f"{clinvar_path}{RELEASE_STATE}", "r") as state_file:
+            return(json.load(state_file))
+    except (OSError, ValueError):
+        return({})
+
+def write_release_state(clinvar_path, state):
+    with open(f"{clinvar_path}{RELEASE_STATE}", "w") as state_file:
+        json.dump(state, state_file, indent=2)
+
+def get_conditional_headers(clinvar_path, clinvar_url):
+    """
+    Cabeceras de la petición condicional: solo se envían si la última descarga es de la misma URL y sus
+    archivos siguen en el directorio clinvar.
+    """
+    state = read_release_state(clinvar_path)
+    last_clinvar = get_latest_clinvar(clinvar_path)
+    if last_clinvar is None or state.get("url") != clinvar_url or not last_clinvar.endswith(f"_{state.get('version')}.txt"):
+        return({})
+    headers = {}
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    return(headers)
+
+def get_clinvar(clinvar_path, clinvar_url=CLINVAR_URL, clinvar_sqlite=False):
     """
     Descarga y procesa los datos de la base de datos CLINVAR.
     
+    La petición es condicional (If-Modified-Since / If-None-Match): si la versión del servidor es la
+    misma que la última descargada, no se descarga nada. Si no, el archivo se descomprime y se separa
+    por ensamblaje a medida que llega, y las interrupciones se reanudan desde el último byte recibido.
+    
     Args:
         clinvar_path: Ruta al directorio clinvar.
+        clinvar_url (str): URL del archivo variant_summary.txt.gz.
+        clinvar_sqlite (bool): Generar también las bases de datos SQLite (backend 'sqlite').
+    
+    Returns:
+        str: Ruta al archivo ClinVar GRCh37 (o al más reciente, si no ha cambiado).
     """
-    try:        
-        # URL del archivo CLINVAR
-        clinvar_url = "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/tab_delimited/variant_summary.txt.gz"
-        
-        # Abrir la URL
-        response = urllib.request.urlopen(clinvar_url)
-
-        # Verificar si la respuesta fue exitosa (código de estado HTTP 200)
-        if response.status != 200:
-            print(f"Error al descargar el archivo CLINVAR. Código de estado HTTP: {response.status}")
-            return
-        
-        # Open a local file for writing in binary mode
-        out_rawfile = f"{clinvar_path}variant_summary.txt.gz"
-        with open(out_rawfile, 'wb') as output_file:
-            # Copy the response content to the local file
-            shutil.copyfileobj(response, output_file)
-        print(f"File downloaded to {out_rawfile}")
-        
-        # Obtener la fecha de release del archivo CLINVAR desde la URL
-        last_modified = response.headers['Last-Modified']
-        if last_modified is None:
-            print("No se pudo obtener la fecha de release del archivo CLINVAR.")
+    try:
+        headers = get_conditional_headers(clinvar_path, clinvar_url)
+        for attempt in range(DOWNLOAD_RETRIES):
+            # Abrir la URL
+            try:
+                response = urllib.request.urlopen(urllib.request.Request(clinvar_url, headers=headers), timeout=DOWNLOAD_TIMEOUT)
+            except urllib.error.HTTPError as e:
+                if e.code != 304:
+                    raise
+                print("El archivo ClinVar del servidor no ha cambiado desde la última descarga.")
+                return(get_latest_clinvar(clinvar_path))
+            
+            # Verificar si la respuesta fue exitosa (código de estado HTTP 200)
+            if response.status != 200:
+                print(f"Error al descargar el archivo CLINVAR. Código de estado HTTP: {response.status}")
+                return
+            
+            # Obtener la fecha de release del archivo CLINVAR
+            last_modified = response.headers['Last-Modified']
+            if last_modified is None:
+                print("No se pudo obtener la fecha de release del archivo CLINVAR.")
+                return
+            release_date = datetime.strptime(last_modified, '%a, %d %b %Y %H:%M:%S %Z')
+            
+            # Procesar el archivo CLINVAR para GRCh37 y GRCh38 mientras se descarga
+            output_files = get_output_files(release_date, clinvar_path)
+            try:
+                with io.TextIOWrapper(io.BufferedReader(ClinvarDownload(response, clinvar_url), DOWNLOAD_CHUNK)) as summary_file:
+                    write_clinvar_data(summary_file, output_files, clinvar_sqlite)
+                break
+            except ClinvarChangedError as e:
+                # Empezar de nuevo con la versión nueva
+                print(f"{e} Reiniciando la descarga...")
+                headers = {}
+        else:
+            print("No se pudo descargar el archivo CLINVAR: ha cambiado en el servidor en cada intento.")
             return
         
-        release_date = datetime.strptime(last_modified, '%a, %d %b %Y %H:%M:%S %Z')
-        
-        # Procesar el archivo CLINVAR para GRCh37
-        grch37_output_file = process_clinvar_data("GRCh37", release_date, clinvar_path)
-        print(f"Archivo CLINVAR GRCh37 descargado y procesado. Versión: {release_date.strftime('%Y%m%d')}")
-        
-        # Procesar el archivo CLINVAR para GRCh38
-        grch38_output_file = process_clinvar_data("GRCh38", release_date, clinvar_path)
-        print(f"Archivo CLINVAR GRCh38 descargado y procesado. Versión: {release_date.strftime('%Y%m%d')}")
-        
-        # Eliminar el archivo descargado en formato gz
-        os.remove(f"{clinvar_path}variant_summary.txt.gz")
+        write_release_state(clinvar_path, {"url": clinvar_url, "last_modified": last_modified,
+                                           "etag": response.headers.get("ETag"), "version": release_date.strftime('%Y%m%d')})
+        grch37_output_file = output_files["GRCh37"]
+        grch38_output_file = output_files["GRCh38"]
+        print(f"Archivos CLINVAR GRCh37 y GRCh38 descargados y procesados. Versión: {release_date.strftime('%Y%m%d')}")
         
         # # Eliminar versiones anteriores si existen
         # for filename in os.listdir(clinvar_path):
@@ -114,4 +400,4 @@ def get_clinvar(clinvar_path):
         return(grch37_output_file) #si al final eintervar tamb funciona con genoma 38, cambiar esto en función del assembly
     
     except Exception as e:
-        print(f"Ocurrió un error: {str(e)}")
\ No newline at end of file
+        print(f"Ocurrió un error: {str(e)}")
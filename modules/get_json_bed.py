@@ -9,8 +9,6 @@ import os
 import csv
 import json
 #from pybedtools import BedTool #DEBERÍA MIRARLO PARA ORDENAR LOS CROMOSOMAS en vez de usar natsorted
-from biomart import BiomartServer
-from natsort import natsorted
 
 def read_csv(in_csv, category):
     """
@@ -63,6 +61,8 @@ def get_gene_pos(gene_symbol, assembly):
     Returns:
         dict: Información de posición del gen.
     """
+    # biomart solo se necesita al generar los catálogos, así que se importa aquí
+    from biomart import BiomartServer
     if assembly == "37":
         server = BiomartServer("http://grch37.ensembl.org/biomart")
     elif assembly == "38":
@@ -117,6 +117,7 @@ def write_bed_file(assembly, genes_lst, category, categories_path):
             gene_pos['Chromosome'] = '6'
         
         gene_coords.append((gene_pos['Chromosome'], int(gene_pos['Start']), int(gene_pos['End']), gene))
+    from natsort import natsorted
     sorted_coords = natsorted(gene_coords)
     
     filename = f"{categories_path}{category.upper()}/{category}_genes_grch{assembly}.bed"
@@ -11,7 +11,6 @@ import os
 import csv
 import json
 #from pybedtools import BedTool #DEBERÍA MIRARLO PARA ORDENAR LOS CROMOSOMAS
-from natsort import natsorted
 
 
 def generate_json_from_fg_csv(csv_file, assembly, categories_path):
@@ -103,6 +102,7 @@ def generate_bed_from_fg_csv(csv_file, assembly, categories_path):
                     bed_data.append(bed_entry)
         
         # Sort bed_data by chromosome, start position, end position, and allele
+        from natsort import natsorted
         sorted_bed_data = natsorted(bed_data)
         
         bed_filename = f"{categories_path}FG/fg_variants_grch{assembly}.bed"
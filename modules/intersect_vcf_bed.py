@@ -4,54 +4,154 @@ Created on Sat Aug 26 23:13:23 2023
 
 @author: kindi
 """
+import os
+import gzip
+from bisect import bisect_left
 
-from pybedtools import BedTool
+from modules.checkpoint import get_manifest_path, get_stage_manifest, stage_is_current, write_stage_manifest
 
-def intersect_vcf_with_bed(norm_path, category, assembly, categories_path):
+def get_category_bed(category, assembly, categories_path):
     """
-    Intersecta un archivo VCF con un archivo BED y guarda las variantes intersectadas en un nuevo archivo VCF.
+    Archivo BED del catálogo de una categoría (genes PR y RR, variantes FG), o None si la categoría no es válida.
+    """
+    category_to_bed = {
+        "pr": f"{categories_path}PR/pr_genes_grch{assembly}.bed",
+        "rr": f"{categories_path}RR/rr_genes_grch{assembly}.bed",
+        "fg": f"{categories_path}FG/fg_variants_grch{assembly}.bed"
+    }
+    return(category_to_bed.get(category))
+
+def read_bed_intervals(bed_path):
+    """
+    Lee los intervalos de un archivo BED por cromosoma, ordenados por inicio, con el gen de cada uno (cuarta
+    columna) y la longitud del intervalo más largo, para buscar solapamientos con bisect.
+
+    Returns:
+        dict: Por cromosoma, (inicios, finales, genes, longitud máxima), en coordenadas BED (base 0, final excluido).
+    """
+    intervals = {}
+    with open(bed_path, "r") as bed:
+        for line in bed:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 3 or line.startswith(("#", "track", "browser")):
+                continue
+            intervals.setdefault(fields[0], []).append((int(fields[1]), int(fields[2]), fields[3] if len(fields) > 3 else "."))
+    indexed = {}
+    for chrom, chrom_intervals in intervals.items():
+        chrom_intervals.sort()
+        indexed[chrom] = ([start for start, _, _ in chrom_intervals], [end for _, end, _ in chrom_intervals],
+                          [gene for _, _, gene in chrom_intervals], max(end - start for start, end, _ in chrom_intervals))
+    return(indexed)
+
+def find_overlaps(intervals, chrom, start, end):
+    """
+    Genes de los intervalos que solapan [start, end) (base 0), en el orden del BED y sin repetir.
+    """
+    if chrom not in intervals:
+        return []
+    starts, ends, genes, max_length = intervals[chrom]
+    hits = []
+    # Solo pueden solapar los intervalos que empiezan antes del final y no más de max_length antes del inicio
+    i = bisect_left(starts, end) - 1
+    while i >= 0 and starts[i] >= start - max_length:
+        if ends[i] > start and genes[i] not in hits:
+            hits.append(genes[i])
+        i -= 1
+    return(hits[::-1])
+
+def intersect_vcf_with_beds(workspace, categories, assembly, categories_path, force=False, vcf_path=None):
+    """
+    Intersecta el VCF normalizado con los archivos BED de todas las categorías elegidas en una sola lectura
+    y guarda, para cada categoría, las variantes que solapan alguna de sus regiones en un nuevo archivo VCF
+    (como bedtools intersect -u: las líneas del VCF, sin cabecera). La tabla de coincidencias
+    (intersection_hits.tsv) etiqueta cada variante con las categorías y los genes que toca.
+    
+    Una variante ocupa las bases de su REF (de POS-1 a POS-1+len(REF), en base 0) y solapa un intervalo BED si
+    comparten al menos una base, igual que con bedtools.
+    
+    Si las intersecciones y la tabla ya existen y se generaron con el mismo VCF y los mismos BED, se omite.
     
     Args:
-        vcf_path (str): Ruta al archivo VCF que se va a intersectar.
-        category (str): Categoría de genes o variantes a utilizar para la intersección (pr, rr o fg).
+        workspace (Workspace): Directorio de trabajo de la ejecución, con el VCF normalizado que se va a intersectar.
+        categories (list): Categorías de genes o variantes a utilizar para la intersección (pr, rr o fg).
         assembly (str): Versión del ensamblaje genómico a utilizar (por ejemplo, "38").
+        categories_path (str): Ruta al directorio categories.
+        force (bool): Intersectar aunque existan salidas con las mismas entradas.
+        vcf_path (str, optional): VCF que se intersecta (el que devuelve normalize_vcf); por defecto, el VCF
+                                  normalizado del directorio de trabajo.
     
     Returns:
-        None
+        list: Categorías intersectadas (las que tienen archivo BED).
     
     Raises:
-        Exception: Si ocurre un error durante la intersección o si la categoría no es válida.
+        ValueError: Si alguna categoría no es válida o el VCF normalizado tiene un registro mal formado.
+        OSError: Si no se puede leer el VCF normalizado o escribir las salidas. El error se propaga para que
+                 la etapa falle en lugar de continuar como si la intersección no tuviera variantes.
     """
-    try:
-        # Definir un diccionario de categorías a rutas de archivos BED
-        category_to_bed = {
-            "pr": f"{categories_path}PR/pr_genes_grch{assembly}.bed",
-            "rr": f"{categories_path}RR/rr_genes_grch{assembly}.bed",
-            "fg": f"{categories_path}FG/fg_variants_grch{assembly}.bed"
-        }
-
-        # Verifica si la categoría es válida
-        if category not in category_to_bed:
+    # Obtener la ruta del archivo BED de cada categoría y verificar si la categoría es válida
+    bed_paths = {}
+    for category in categories:
+        bed_paths[category] = get_category_bed(category, assembly, categories_path)
+        if bed_paths[category] is None:
             raise ValueError(f"{category} no es una categoría válida (PR, RR o FG)")
-            return
-        
-        # Obtener la ruta del archivo BED correspondiente y del archivo de salida
-        bed_path = category_to_bed[category]
-        output_vcf_path = f"{norm_path.split('normalized')[0]}{category}_intersection.vcf"
-            
-        # Cargar el archivo VCF y el archivo BED utilizando pybedtools
-        vcf = BedTool(norm_path)
-        bed = BedTool(bed_path)
-        
-        # Realizar la intersección utilizando pybedtools
-        intersected_variants = vcf.intersect(bed, u=True)
-        
-        # Guardar las variantes intersectadas en un nuevo archivo VCF
-        intersected_variants.saveas(output_vcf_path)
-        
-        print(f"Intersección completada. Variantes intersectadas guardadas en {output_vcf_path}")
-    except Exception as e:
-        print(f"Error durante la intersección: {e}")
-
-
-# faltaría el header, pero realmente no sé si hace falta
+    
+    # Una categoría sin BED (por ejemplo, si falló la generación de su catálogo) no impide intersectar las demás;
+    # su intersección anterior se borra para que su módulo no lea resultados de otra ejecución
+    for category in [category for category in categories if not os.path.exists(bed_paths[category])]:
+        print(f"Error durante la intersección: no existe el archivo BED {bed_paths[category]}")
+        for path in [workspace.intersection_vcf(category), get_manifest_path(workspace.intersection_vcf(category))]:
+            if os.path.exists(path):
+                os.remove(path)
+    categories = [category for category in categories if os.path.exists(bed_paths[category])]
+    if not categories:
+        return(categories)
+    
+    # Rutas de los archivos de salida
+    norm_path = vcf_path if vcf_path is not None else workspace.normalized_vcf
+    output_vcf_paths = {category: workspace.intersection_vcf(category) for category in categories}
+    hits_path = workspace.intersection_hits
+    
+    # Omitir la etapa si sus entradas no han cambiado
+    manifests = {category: get_stage_manifest("intersect", {"vcf": norm_path, "bed": bed_paths[category]}, {"category": category, "args": ["-u"]})
+                 for category in categories}
+    hits_manifest = get_stage_manifest("intersect", dict({"vcf": norm_path}, **{f"bed_{category}": bed_paths[category] for category in categories}),
+                                       {"categories": list(categories)})
+    if all(stage_is_current(manifests[category], output_vcf_paths[category], force) for category in categories) and \
+            stage_is_current(hits_manifest, hits_path, force):
+        print(f"Intersección omitida: {', '.join(output_vcf_paths.values())} ya están actualizados.")
+        return(categories)
+    
+    # Intervalos de todas las categorías
+    intervals = {category: read_bed_intervals(bed_paths[category]) for category in categories}
+    
+    # Una sola lectura del VCF normalizado: cada variante se escribe en las categorías que solapa
+    with open(norm_path, "rb") as file:
+        is_gzip = file.read(2) == b"\x1f\x8b"
+    output_files = {category: open(f"{output_vcf_paths[category]}.tmp", "w") for category in categories}
+    try:
+        with (gzip.open(norm_path, "rt") if is_gzip else open(norm_path, "r")) as vcf, open(f"{hits_path}.tmp", "w") as hits_file:
+            hits_file.write("#CHROM\tPOS\tREF\tALT\tCATEGORY\tGENES\n")
+            for line in vcf:
+                if line.startswith("#"):
+                    continue
+                fields = line.split("\t", 5)
+                start = int(fields[1]) - 1
+                end = start + len(fields[3])
+                for category in categories:
+                    genes = find_overlaps(intervals[category], fields[0], start, end)
+                    if genes:
+                        output_files[category].write(line)
+                        hits_file.write(f"{fields[0]}\t{fields[1]}\t{fields[3]}\t{fields[4]}\t{category}\t{','.join(genes)}\n")
+    finally:
+        for output_file in output_files.values():
+            output_file.close()
+    
+    # Guardar las intersecciones y la tabla de coincidencias
+    for category in categories:
+        os.replace(f"{output_vcf_paths[category]}.tmp", output_vcf_paths[category])
+        write_stage_manifest(manifests[category], output_vcf_paths[category])
+    os.replace(f"{hits_path}.tmp", hits_path)
+    write_stage_manifest(hits_manifest, hits_path)
+    
+    print(f"Intersección completada. Variantes intersectadas guardadas en {', '.join(output_vcf_paths.values())}")
+    return(categories)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 01:12:48 2026
+
+@author: kindi
+"""
+import os
+import gzip
+import threading
+from bisect import bisect_right
+
+from modules.checkpoint import get_stage_manifest, stage_is_current, write_stage_manifest
+
+# Genomas de referencia abiertos en el proceso (por archivo, tamaño y fecha de modificación), compartidos por
+# las muestras de un lote o del servidor; cada hilo usa su propio pysam.FastaFile
+_fasta_cache = {}
+_fasta_lock = threading.Lock()
+
+def get_fasta(reference):
+    """
+    Devuelve el genoma de referencia indexado (.fai) abierto con pysam para el hilo actual. Se abre una sola
+    vez por hilo y se vuelve a abrir si el archivo cambia.
+    """
+    stat = os.stat(reference)
+    key = (os.path.abspath(reference), stat.st_size, stat.st_mtime_ns)
+    with _fasta_lock:
+        local = _fasta_cache.get(key)
+        if local is None:
+            # Las versiones anteriores del archivo se descartan
+            for old_key in [old_key for old_key in _fasta_cache if old_key[0] == key[0]]:
+                del _fasta_cache[old_key]
+            local = _fasta_cache[key] = threading.local()
+    fasta = getattr(local, "fasta", None)
+    if fasta is None:
+        # pysam se importa aquí para no retrasar el arranque
+        import pysam
+        fasta = local.fasta = pysam.FastaFile(reference)
+    return fasta
+
+def clear_fasta_cache():
+    """
+    Vacía la caché de genomas de referencia del proceso.
+    """
+    with _fasta_lock:
+        _fasta_cache.clear()
+
+def read_regions(regions_bed):
+    """
+    Regiones de un BED sin solapamientos (write_regions_bed) por cromosoma: inicios (base 0) y finales.
+    """
+    regions = {}
+    with open(regions_bed, "r") as bed:
+        for line in bed:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 3:
+                regions.setdefault(fields[0], []).append((int(fields[1]), int(fields[2])))
+    return({chrom: ([start for start, _ in sorted(values)], [end for _, end in sorted(values)]) for chrom, values in regions.items()})
+
+def in_regions(regions, chrom, start, end):
+    """
+    Indica si el intervalo [start, end] (base 1) solapa alguna región.
+    """
+    if chrom not in regions:
+        return False
+    starts, ends = regions[chrom]
+    i = bisect_right(starts, end - 1) - 1
+    return i >= 0 and start <= ends[i]
+
+def read_header_numbers(header_lines):
+    """
+    Valor 'Number' de los campos INFO y FORMAT de la cabecera, para separar los valores por alelo.
+    """
+    numbers = {"INFO": {}, "FORMAT": {}}
+    for line in header_lines:
+        for section in numbers:
+            if line.startswith(f"##{section}=<"):
+                fields = dict(field.split("=", 1) for field in line[len(section) + 4:].rstrip(">\n").split(",") if "=" in field)
+                if "ID" in fields:
+                    numbers[section][fields["ID"]] = fields.get("Number", ".")
+    return(numbers)
+
+def split_values(value, number, allele, n_alts, ploidy=2):
+    """
+    Valores de un campo para el alelo alternativo 'allele' (base 1) de un sitio multialélico: por alelo
+    alternativo (A), por alelo (R) o por genotipo (G), como bcftools norm -m -any.
+    """
+    values = value.split(",")
+    if number == "A" and len(values) == n_alts:
+        return values[allele - 1]
+    if number == "R" and len(values) == n_alts + 1:
+        return f"{values[0]},{values[allele]}"
+    if number == "G":
+        if ploidy == 1 and len(values) == n_alts + 1:
+            return f"{values[0]},{values[allele]}"
+        if len(values) == (n_alts + 1) * (n_alts + 2) // 2:
+            # Genotipos (0,0), (0,alelo) y (alelo,alelo) en el orden de VCF: índice de (j,k) = k(k+1)/2 + j
+            return ",".join(values[k * (k + 1) // 2 + j] for j, k in [(0, 0), (0, allele), (allele, allele)])
+    return value
+
+def split_genotype(gt, allele):
+    """
+    Genotipo de un sitio multialélico para el alelo 'allele': ese alelo pasa a ser 1 y el resto de alelos
+    alternativos, la referencia (0), conservando la fase y los alelos desconocidos.
+    """
+    result, current = [], ""
+    for char in gt:
+        if char in "/|":
+            result.append(current)
+            result.append(char)
+            current = ""
+        else:
+            current += char
+    result.append(current)
+    return "".join(part if part in "/|." else ("1" if part == str(allele) else "0") for part in result)
+
+def split_multiallelic(fields, numbers):
+    """
+    Separa un registro multialélico en un registro por alelo alternativo (bcftools norm -m -any).
+    """
+    alts = fields[4].split(",")
+    if len(alts) == 1:
+        return [fields]
+    format_keys = fields[8].split(":") if len(fields) > 8 else []
+    records = []
+    for allele, alt in enumerate(alts, start=1):
+        record = list(fields)
+        record[4] = alt
+        if fields[7] != ".":
+            info = []
+            for entry in fields[7].split(";"):
+                key, _, value = entry.partition("=")
+                info.append(f"{key}={split_values(value, numbers['INFO'].get(key, '.'), allele, len(alts))}" if value else key)
+            record[7] = ";".join(info)
+        for sample in range(9, len(record)):
+            values = record[sample].split(":")
+            ploidy = len(values[0].replace("|", "/").split("/")) if format_keys and format_keys[0] == "GT" else 2
+            for i, key in enumerate(format_keys[:len(values)]):
+                if key == "GT":
+                    values[i] = split_genotype(values[i], allele)
+                else:
+                    values[i] = split_values(values[i], numbers["FORMAT"].get(key, "."), allele, len(alts), ploidy)
+            record[sample] = ":".join(values)
+        records.append(record)
+    return(records)
+
+def realign_left(fasta, contigs, fields):
+    """
+    Alinea a la izquierda y recorta un registro bialélico contra la referencia, como bcftools norm: se quita
+    la última base común de REF y ALT (ampliando el alelo hacia la izquierda con la base de referencia
+    anterior cuando uno se queda con una sola base) y después las primeras bases comunes. Los alelos
+    simbólicos, los registros cuyo REF no coincide con la referencia (--check-ref w) y los cromosomas que
+    no están en la referencia se dejan igual.
+
+    Returns:
+        bool: False si REF no coincide con la referencia.
+    """
+    chrom, pos, ref, alt = fields[0], int(fields[1]), fields[3].upper(), fields[4].upper()
+    if alt in ["*", "."] or alt.startswith("<") or "[" in alt or "]" in alt or ref == alt:
+        return True
+    if chrom not in contigs:
+        return True
+    if fasta.fetch(chrom, pos - 1, pos - 1 + len(ref)).upper() != ref:
+        return False
+    while ref[-1] == alt[-1]:
+        if len(ref) == 1 or len(alt) == 1:
+            if pos == 1:
+                break
+            base = fasta.fetch(chrom, pos - 2, pos - 1).upper()
+            ref, alt, pos = base + ref, base + alt, pos - 1
+        ref, alt = ref[:-1], alt[:-1]
+    while len(ref) > 1 and len(alt) > 1 and ref[0] == alt[0]:
+        ref, alt, pos = ref[1:], alt[1:], pos + 1
+    if (pos, ref, alt) != (int(fields[1]), fields[3].upper(), fields[4].upper()):
+        fields[1], fields[3], fields[4] = str(pos), ref, alt
+    return True
+
+def normalize_records(vcf_path, fasta, regions=None, overlap=True):
+    """
+    Lee un VCF (comprimido o no) y devuelve su cabecera y sus registros normalizados: separados por alelo,
+    alineados a la izquierda, ordenados por posición dentro de cada cromosoma y sin duplicados (misma
+    posición, REF y ALT, como bcftools norm --rm-dup none).
+
+    Args:
+        vcf_path (str): Ruta al VCF de entrada.
+        fasta (pysam.FastaFile): Genoma de referencia.
+        regions (dict, optional): Regiones (read_regions); solo se normalizan sus registros.
+        overlap (bool): Con regiones, incluir los registros cuyo REF solapa una región (como -R) o solo los
+                        que empiezan en ella (como -T).
+
+    Returns:
+        tuple: Líneas de la cabecera, registros (listas de campos) y número de avisos de referencia.
+    """
+    with open(vcf_path, "rb") as file:
+        is_gzip = file.read(2) == b"\x1f\x8b"
+    header, records, chrom_order, ref_mismatches = [], [], {}, 0
+    contigs = set(fasta.references)
+    numbers = None
+    with (gzip.open(vcf_path, "rt") if is_gzip else open(vcf_path, "r")) as vcf_in:
+        for line in vcf_in:
+            if line.startswith("#"):
+                header.append(line)
+                continue
+            if numbers is None:
+                numbers = read_header_numbers(header)
+            fields = line.rstrip("\n").split("\t")
+            pos = int(fields[1])
+            if regions is not None and not in_regions(regions, fields[0], pos, pos + len(fields[3]) - 1 if overlap else pos):
+                continue
+            chrom_order.setdefault(fields[0], len(chrom_order))
+            for record in split_multiallelic(fields, numbers):
+                if not realign_left(fasta, contigs, record):
+                    ref_mismatches += 1
+                records.append(record)
+    # El alineamiento a la izquierda puede desordenar los registros (la ordenación es estable)
+    records.sort(key=lambda record: (chrom_order[record[0]], int(record[1])))
+    unique, seen, current_pos = [], set(), None
+    for record in records:
+        if (record[0], record[1]) != current_pos:
+            current_pos, seen = (record[0], record[1]), set()
+        if (record[3], record[4]) in seen:
+            continue
+        seen.add((record[3], record[4]))
+        unique.append(record)
+    return(header, unique, ref_mismatches)
+
+def normalize_vcf_native(input_vcf_path, workspace, reference, force=False, regions_bed=None, indexed=False):
+    """
+    Normaliza un VCF de entrada en el propio proceso, con pysam y el genoma de referencia indexado, sin
+    ejecutar bcftools: para paneles pequeños, en los que arrancar los procesos de bcftools y abrir la
+    referencia cuesta más que la propia normalización. Produce los mismos registros que la tubería de
+    bcftools (separación de los sitios multialélicos, alineamiento a la izquierda y eliminación de
+    duplicados), comprimidos con bgzip e indexados con tabix.
+
+    Args:
+        input_vcf_path (str): La ruta al archivo VCF de entrada que se va a normalizar.
+        workspace (Workspace): Directorio de trabajo de la ejecución.
+        reference (str): Genoma de referencia (FASTA indexado con samtools faidx).
+        force (bool): Normalizar aunque exista una salida con las mismas entradas.
+        regions_bed (str, optional): BED de las regiones que se normalizan (write_regions_bed).
+        indexed (bool): El VCF de entrada está indexado: con regiones, se incluyen los registros que las
+                        solapan, como bcftools con -R; si no, los que empiezan en ellas, como con -T.
+
+    Returns:
+        str: La ruta del archivo VCF normalizado.
+    """
+    import pysam
+    output_vcf_path = workspace.normalized_vcf
+    input_files = {"vcf": input_vcf_path, "reference": reference}
+    if regions_bed is not None:
+        input_files["regions"] = regions_bed
+    manifest = get_stage_manifest("normalize", input_files, {"pysam": pysam.__version__, "args": ["native", "-R" if indexed else "-T"]})
+    if stage_is_current(manifest, output_vcf_path, force) and os.path.exists(f"{output_vcf_path}.tbi"):
+        print(f"Normalización omitida: {output_vcf_path} ya está actualizado.")
+        return(output_vcf_path)
+
+    regions = read_regions(regions_bed) if regions_bed is not None else None
+    header, records, ref_mismatches = normalize_records(input_vcf_path, get_fasta(reference), regions, indexed)
+    if ref_mismatches:
+        print(f"Aviso: {ref_mismatches} registros con un REF que no coincide con la referencia no se han alineado.")
+
+    # VCF sin comprimir temporal, comprimido con bgzip e indexado con tabix
+    plain_vcf_path = f"{output_vcf_path}.tmp.vcf"
+    with open(plain_vcf_path, "w") as vcf_out:
+        vcf_out.writelines(header)
+        for record in records:
+            vcf_out.write("\t".join(record) + "\n")
+    # La salida anterior solo se sustituye cuando la nueva está comprimida e indexada
+    tmp_vcf_path = f"{output_vcf_path}.tmp"
+    pysam.tabix_compress(plain_vcf_path, tmp_vcf_path, force=True)
+    os.remove(plain_vcf_path)
+    pysam.tabix_index(tmp_vcf_path, preset="vcf", force=True)
+    os.replace(tmp_vcf_path, output_vcf_path)
+    os.replace(f"{tmp_vcf_path}.tbi", f"{output_vcf_path}.tbi")
+    write_stage_manifest(manifest, output_vcf_path)
+
+    print("Normalización con pysam completada.")
+    return(output_vcf_path)
@@ -5,51 +5,171 @@ Created on Sat Aug 26 22:15:15 2023
 @author: kindi
 """
 import os
-import gzip
 import subprocess
 
-def normalize_vcf(input_vcf_path, temp_path, assembly):
+from modules.checkpoint import get_stage_manifest, get_tool_version, stage_is_current, write_stage_manifest
+from modules.clinvar_shard import read_bed_regions
+from modules.intersect_vcf_bed import get_category_bed
+
+# Opciones de bcftools norm: separar los sitios multialélicos y avisar (sin parar) si la referencia no coincide
+NORM_ARGS = ["-m", "-any", "--check-ref", "w"]
+
+def get_reference(assembly):
+    """
+    Genoma de referencia de un ensamblaje, con el que se normalizan las muestras y el VCF de ClinVar.
+    """
+    if assembly == '37':
+        return("./references_hs37d5_hs37d5.fa")
+    elif assembly == '38':
+        return("./Homo_sapiens.GRCh38.dna.primary_assembly.fa")
+
+def index_input_vcf(vcf_path):
+    """
+    Indexa un VCF de entrada comprimido con bgzip si todavía no tiene índice (.csi o .tbi).
+
+    Returns:
+        bool: True si el VCF está comprimido e indexado, False si es un VCF sin comprimir.
+    """
+    if not vcf_path.endswith(".gz"):
+        return False
+    if not (os.path.exists(vcf_path + ".csi") or os.path.exists(vcf_path + ".tbi")):
+        subprocess.run(["bcftools", "index", vcf_path], check=True)
+    return True
+
+def use_native_engine(input_vcf_path, engine, native_max_bytes):
+    """
+    Indica si se normaliza en el propio proceso con pysam (normalize_native) en lugar de con bcftools:
+    con el motor 'pysam', o con 'auto' si el VCF de entrada no supera native_max_bytes. Si pysam no está
+    instalado, se usa bcftools.
+    """
+    if engine == "bcftools" or (engine == "auto" and os.path.getsize(input_vcf_path) > native_max_bytes):
+        return False
+    try:
+        import pysam
+    except ImportError:
+        print("pysam no está instalado: se normaliza con bcftools.")
+        return False
+    return True
+
+def write_regions_bed(workspace, categories, assembly, categories_path, padding):
+    """
+    Escribe en el directorio de trabajo la unión de las regiones de los catálogos de las categorías
+    elegidas, ampliadas con un margen (para que las indels se puedan alinear a la izquierda) y sin
+    solapamientos.
+
+    Args:
+        workspace (Workspace): Directorio de trabajo de la ejecución.
+        categories (list): Categorías analizadas.
+        assembly (str): Ensamblaje genómico a utilizar.
+        categories_path (str): Ruta al directorio categories.
+        padding (int): Margen en pares de bases a cada lado de cada región.
+
+    Returns:
+        str: Ruta al BED de las regiones, o None si falta el BED de alguna categoría.
+    """
+    bed_files = [get_category_bed(category, assembly, categories_path) for category in categories]
+    if not bed_files or not all(bed_file and os.path.exists(bed_file) for bed_file in bed_files):
+        return None
+    regions = read_bed_regions(bed_files, padding, strip_chr=False)
+    regions_bed = workspace.regions_bed
+    with open(f"{regions_bed}.tmp", "w") as bed:
+        for chrom in sorted(regions):
+            for start, end in zip(*regions[chrom]):
+                bed.write(f"{chrom}\t{start - 1}\t{end}\n")
+    os.replace(f"{regions_bed}.tmp", regions_bed)
+    return(regions_bed)
+
+def normalize_vcf(input_vcf_path, workspace, assembly, force=False, threads=0, compression_level=6, regions_bed=None, engine="bcftools", native_max_bytes=1000000):
     """
     Normaliza un archivo VCF de entrada utilizando bcftools.
     
+    La normalización (separación de los sitios multialélicos y alineamiento a la izquierda) y la eliminación
+    de duplicados se encadenan con una tubería: el primer bcftools pasa el resultado al segundo en BCF sin
+    comprimir, sin escribir ningún VCF intermedio en disco. La salida se comprime con bgzip y se indexa con
+    tabix, para que las etapas siguientes puedan leer regiones sin recorrer el archivo.
+    
+    Con regions_bed solo se normalizan los registros de esas regiones (las de los catálogos): si el VCF
+    de entrada está indexado, bcftools lee solo esas regiones con el índice (-R); si no, las filtra
+    recorriendo el archivo (-T).
+    
+    Con el motor 'pysam' (o 'auto' y un VCF de entrada pequeño, como el de un panel), se normaliza en el
+    propio proceso (normalize_vcf_native), con los mismos registros de salida y sin ejecutar bcftools.
+    
+    Si el VCF normalizado ya existe y se generó con el mismo VCF de entrada, la misma referencia y la misma
+    versión de bcftools, la normalización se omite.
+    
     Args:
         input_vcf_path (str): La ruta al archivo VCF de entrada que se va a normalizar.
-        temp_path (str): La ruta al directorio temporal donde se guardarán los archivos intermedios.
+        workspace (Workspace): Directorio de trabajo de la ejecución, donde se guardarán los archivos intermedios.
+        force (bool): Normalizar aunque exista una salida con las mismas entradas.
+        threads (int): Hilos adicionales de compresión y descompresión de cada bcftools (--threads).
+        compression_level (int): Nivel de compresión BGZF de la salida (0-9).
+        regions_bed (str, optional): BED de las regiones que se normalizan (write_regions_bed).
+        engine (str): 'bcftools', 'pysam' o 'auto' (pysam si el VCF de entrada no supera native_max_bytes).
+        native_max_bytes (int): Tamaño máximo del VCF de entrada que se normaliza con pysam en modo 'auto'.
     
     Returns:
-        str: La ruta del archivo VCF normalizado. Este archivo se encuentra en el directorio temporal.
+        str: La ruta del archivo VCF normalizado. Este archivo se encuentra en el directorio de trabajo.
+    
+    Raises:
+        subprocess.CalledProcessError: Si falla bcftools.
+        OSError: Si no se puede leer la entrada o escribir la salida. Los errores se propagan para que la
+                 etapa falle en lugar de continuar con el VCF normalizado de una ejecución anterior.
     """
     # split multiallelic (-m -) y left-alignment.
-    try:
-        # Ruta del archivo de salida
-        output_vcf_path = f"{temp_path}{input_vcf_path.split('/')[-1].split('.vcf')[0]}_normalized_int.vcf"
-        output2_vcf_path = f"{temp_path}{input_vcf_path.split('/')[-1].split('.vcf')[0]}_normalized.vcf" 
-        
-        # Verificar si el archivo VCF está comprimido
-        if input_vcf_path.endswith(".gz"):
-            # Verificar si el archivo VCF necesita ser indexado
-            if not (os.path.exists(input_vcf_path + ".csi") or os.path.exists(input_vcf_path + ".tbi")):
-                # Indexar el archivo VCF si no está indexado
-                index_command = ["bcftools", "index", input_vcf_path]
-                subprocess.run(index_command, check=True)
-        
-        # Comando para normalizar con bcftools
-        if assembly == '37':
-            bcftools_command = ["bcftools", "norm", "-O", "v", "-m", "-any", "--check-ref", "w", "-f", "./references_hs37d5_hs37d5.fa", "-o", output_vcf_path, input_vcf_path]
-        elif assembly == '38':
-            bcftools_command = ["bcftools", "norm", "-O", "v", "-m", "-any", "--check-ref", "w", "-f", "./Homo_sapiens.GRCh38.dna.primary_assembly.fa", "-o", output_vcf_path, input_vcf_path]
-
-        # Ejecutar el comando utilizando subprocess
-        subprocess.run(bcftools_command, check=True)
-        
-        # Eliminar duplicados con bcftools
-        rm_dup_command = ["bcftools", "norm", "--rm-dup", "none", "-Oz", "-o", output2_vcf_path, output_vcf_path]
-        subprocess.run(rm_dup_command, check=True)
-        
-        print("Normalización con bcftools completada.")
-        
-        return(output2_vcf_path)
-
-    except Exception as e:
-        print(f"Error durante la normalización con bcftools: {e}")
-
+    # Ruta del archivo de salida
+    output_vcf_path = workspace.normalized_vcf
+    
+    # Genoma de referencia
+    reference = get_reference(assembly)
+    
+    # Paneles pequeños: normalización en el propio proceso (un VCF indexado se trataría con su índice, -R)
+    if use_native_engine(input_vcf_path, engine, native_max_bytes):
+        from modules.normalize_native import normalize_vcf_native
+        return(normalize_vcf_native(input_vcf_path, workspace, reference, force, regions_bed, index_input_vcf(input_vcf_path)))
+    
+    # Omitir la etapa si sus entradas no han cambiado
+    input_files = {"vcf": input_vcf_path, "reference": reference}
+    if regions_bed is not None:
+        input_files["regions"] = regions_bed
+    manifest = get_stage_manifest("normalize", input_files,
+                                  {"bcftools": get_tool_version(["bcftools", "--version"]), "args": NORM_ARGS + ["--rm-dup", "none"]})
+    if stage_is_current(manifest, output_vcf_path, force) and os.path.exists(f"{output_vcf_path}.tbi"):
+        print(f"Normalización omitida: {output_vcf_path} ya está actualizado.")
+        return(output_vcf_path)
+    
+    # Indexar el VCF de entrada si está comprimido y no tiene índice
+    indexed = index_input_vcf(input_vcf_path)
+    
+    # Regiones de los catálogos: con el índice (-R) si el VCF está comprimido e indexado, si no filtrando (-T)
+    region_args = []
+    if regions_bed is not None:
+        region_args = ["-R" if indexed else "-T", regions_bed]
+    
+    # Normalizar con bcftools (salida BCF sin comprimir, -Ou, por la tubería)
+    threads_args = ["--threads", str(threads)]
+    bcftools_command = ["bcftools", "norm", "-Ou"] + NORM_ARGS + ["-f", reference] + region_args + threads_args + [input_vcf_path]
+    
+    # Eliminar duplicados leyendo de la tubería y escribir la salida comprimida con bgzip, en un archivo temporal
+    # que solo sustituye a la salida anterior si los dos bcftools terminan bien
+    tmp_vcf_path = f"{output_vcf_path}.tmp"
+    rm_dup_command = ["bcftools", "norm", "--rm-dup", "none", f"-Oz{compression_level}"] + threads_args + ["-o", tmp_vcf_path, "-"]
+    
+    with subprocess.Popen(bcftools_command, stdout=subprocess.PIPE) as norm_process:
+        try:
+            subprocess.run(rm_dup_command, stdin=norm_process.stdout, check=True)
+        finally:
+            # Si el segundo bcftools falla, el primero termina al no poder escribir en la tubería
+            norm_process.stdout.close()
+    if norm_process.returncode != 0:
+        raise subprocess.CalledProcessError(norm_process.returncode, bcftools_command)
+    
+    # Índice tabix de la salida
+    subprocess.run(["bcftools", "index", "--force", "--tbi"] + threads_args + [tmp_vcf_path], check=True)
+    os.replace(tmp_vcf_path, output_vcf_path)
+    os.replace(f"{tmp_vcf_path}.tbi", f"{output_vcf_path}.tbi")
+    write_stage_manifest(manifest, output_vcf_path)
+    
+    print("Normalización con bcftools completada.")
+    
+    return(output_vcf_path)
@@ -6,18 +6,35 @@ Created on Sat Oct  7 11:21:45 2023
 """
 import subprocess
 import json
-import pysam
 import csv
 
-def annotate_fg_variants(categories_path, norm_vcf, assembly, temp_path):
+from modules.trace import trace_stage
+
+def load_fg_variants_json(categories_path, assembly):
+    """
+    Carga el archivo JSON con las variantes farmacogenéticas del catálogo.
+    
+    Args:
+        categories_path (str): Ruta al directorio categories.
+        assembly (str): Ensamblaje genómico a utilizar.
+    
+    Returns:
+        dict: El catálogo de variantes farmacogenéticas.
+    """
+    fg_json_path = f'{categories_path}FG/fg_risk_variants_grch{assembly}.json'
+    with open(fg_json_path, 'r') as file:
+        fg_json = json.load(file)
+    return(fg_json)
+
+def annotate_fg_variants(categories_path, workspace, assembly, fg_json=None):
     """
     Anota variantes genéticas utilizando un archivo JSON de variantes farmacogenéticas.
     
     Args:
         categories_path (str): Ruta al directorio que contiene archivos relacionados con las categorías.
-        norm_vcf (str): Ruta al archivo VCF normalizado.
+        workspace (Workspace): Directorio de trabajo de la ejecución.
         assembly (str): Ensamblaje genómico a utilizar.
-        temp_path (str): Ruta al directorio que contiene archivos intermedios.
+        fg_json (dict, optional): Catálogo de variantes farmacogenéticas ya cargado.
     
     Returns:
         list: Una lista de diccionarios que contienen los resultados de la anotación.
@@ -27,15 +44,14 @@ def annotate_fg_variants(categories_path, norm_vcf, assembly, temp_path):
     """
 
     try:
-        # Cargar archivo fg_json con variantes farmacogenéticas
-        fg_json_path = f'{categories_path}FG/fg_risk_variants_grch{assembly}.json'
-        with open(fg_json_path, 'r') as file:
-            fg_json = json.load(file)
+        # Cargar archivo fg_json con variantes farmacogenéticas si no se ha cargado previamente
+        if fg_json is None:
+            fg_json = load_fg_variants_json(categories_path, assembly)
 
         annotated_variants = []
     
         # Abrir el archivo VCF
-        vcf_int_path = norm_vcf.split('_normalized.vcf')[0] + '_fg_intersection.vcf'
+        vcf_int_path = workspace.intersection_vcf("fg")
         
         with open(vcf_int_path, 'r') as vcf_file:
         #with pysam.VariantFile(vcf_path) as vcf_file:
@@ -63,7 +79,7 @@ def annotate_fg_variants(categories_path, norm_vcf, assembly, temp_path):
                 annotated_variants.append(annotated_variant)
                 
         # Escribir los resultados en un archivo
-        result_file = f'{temp_path}/annotated_variants.txt'
+        result_file = workspace.get_path("fg_annotated_variants.txt")
         with open(result_file, 'w') as fout:
             json.dump(annotated_variants, fout)
                 
@@ -206,6 +222,9 @@ def assign_cyp2c19_diplotype(variants, diplo_pheno_dct, results):
     
     # Comprobar variantes presentes en gen
     found, variants_gene = check_gene_variants(variants, gene)
+    
+    # Diplotipo sin asignar (NA) si las variantes encontradas no corresponden a ningún caso contemplado
+    diplotype = 'NA'
             
     # Si no se encontró ninguna variante, diplotipo *1/*1
     if found == False or (len(variants_gene) == 1 and 'rs3758581' in variants_gene.keys()):
@@ -251,6 +270,9 @@ def assign_cyp2c19_diplotype(variants, diplo_pheno_dct, results):
         data = diplo_pheno_dct[gene][diplotype]
         phenotype = data['Phenotype']
         activity_score = data['Activity_Score']
+    else:
+        phenotype = 'NA'
+        activity_score = 'NA'
 
     # Agregar los resultados a la lista de diccionarios
     results.append({
@@ -279,6 +301,9 @@ def assign_dpyd_diplotype(variants, diplo_pheno_dct, results):
     
     # Comprobar variantes presentes en gen
     found, variants_gene = check_gene_variants(variants, gene)
+    
+    # Diplotipo sin asignar (NA) si las variantes encontradas no corresponden a ningún caso contemplado
+    diplotype = 'NA'
             
     # Si no se encontró ninguna variante, diplotipo *1/*1
     if found == False:
@@ -350,6 +375,9 @@ def assign_dpyd_diplotype(variants, diplo_pheno_dct, results):
         data = diplo_pheno_dct[gene][diplotype]
         phenotype = data['Phenotype']
         activity_score = data['Activity_Score']
+    else:
+        phenotype = 'NA'
+        activity_score = 'NA'
 
     # Agregar los resultados a la lista de diccionarios
     results.append({
@@ -378,6 +406,9 @@ def assign_nudt15_diplotype(variants, diplo_pheno_dct, results):
     
     # Comprobar variantes presentes en gen
     found, variants_gene = check_gene_variants(variants, gene)
+    
+    # Diplotipo sin asignar (NA) si las variantes encontradas no corresponden a ningún caso contemplado
+    diplotype = 'NA'
             
     # Si no se encontró ninguna variante, diplotipo *1/*1
     if found == False:
@@ -412,6 +443,9 @@ def assign_nudt15_diplotype(variants, diplo_pheno_dct, results):
         data = diplo_pheno_dct[gene][diplotype]
         phenotype = data['Phenotype']
         activity_score = data['Activity_Score']
+    else:
+        phenotype = 'NA'
+        activity_score = 'NA'
 
     # Agregar los resultados a la lista de diccionarios
     results.append({
@@ -440,6 +474,9 @@ def assign_tpmt_diplotype(variants, diplo_pheno_dct, results):
     
     # Comprobar variantes presentes en gen
     found, variants_gene = check_gene_variants(variants, gene)
+    
+    # Diplotipo sin asignar (NA) si las variantes encontradas no corresponden a ningún caso contemplado
+    diplotype = 'NA'
             
     # Si no se encontró ninguna variante, diplotipo *1/*1
     if found == False:
@@ -546,6 +583,9 @@ def assign_tpmt_diplotype(variants, diplo_pheno_dct, results):
         data = diplo_pheno_dct[gene][diplotype]
         phenotype = data['Phenotype']
         activity_score = data['Activity_Score']
+    else:
+        phenotype = 'NA'
+        activity_score = 'NA'
 
     # Agregar los resultados a la lista de diccionarios
     results.append({
@@ -595,32 +635,37 @@ def get_diplotype_phenotype_dictionary(categories_path):
     return(diplotype_data)
 
     
-def run_pharmacogenomic_risk_module(categories_path, norm_vcf, assembly, temp_path): #sobra category, este modulo es especifico de rr
+def run_pharmacogenomic_risk_module(categories_path, workspace, assembly, fg_json=None, diplo_pheno_dct=None, trace=None): #sobra category, este modulo es especifico de rr
     """
     Ejecuta el módulo de riesgo farmacogenético.
     
     Args:
         categories_path (str): Ruta al directorio categories.
-        norm_vcf (str): Ruta al archivo VCF dnormalizado.
+        workspace (Workspace): Directorio de trabajo de la ejecución.
         assembly (str): Ensamblaje genómico a utilizar.
-        temp_path (str): Rutal al directorio de archivos intermedios.
+        fg_json (dict, optional): Catálogo de variantes farmacogenéticas ya cargado.
+        diplo_pheno_dct (dict, optional): Asociaciones diplotipo-fenotipo ya cargadas.
+        trace (RunTrace, optional): Traza de la ejecución en la que se registran las etapas.
         
     Returns:
         list: Una lista de diccionarios que contienen los resultados de los genes procesados.
     """
     # Anotar variantes fg presentes en el vcf
-    fg_results = annotate_fg_variants(categories_path, norm_vcf, assembly, temp_path)
+    with trace_stage(trace, "annotate_fg_variants", inputs=[workspace.intersection_vcf("fg")], category="fg") as stage:
+        fg_results = annotate_fg_variants(categories_path, workspace, assembly, fg_json)
+        stage["records_out"] = len(fg_results)
     
-    # Crear diccionario con asociaciones diplotipo-fenotipo
-    diplo_pheno_dct = get_diplotype_phenotype_dictionary(categories_path)
+    # Crear diccionario con asociaciones diplotipo-fenotipo si no se ha cargado previamente
+    if diplo_pheno_dct is None:
+        diplo_pheno_dct = get_diplotype_phenotype_dictionary(categories_path)
     
     # Asignar los diplotipos de cada gen
     results = []
-    results = assign_cyp2c9_diplotype(fg_results, diplo_pheno_dct, results)
-    results = assign_cyp2c19_diplotype(fg_results, diplo_pheno_dct, results)
-    results = assign_dpyd_diplotype(fg_results, diplo_pheno_dct, results)
-    results = assign_nudt15_diplotype(fg_results, diplo_pheno_dct, results)
-    results = assign_tpmt_diplotype(fg_results, diplo_pheno_dct, results)
+    for assign_diplotype in [assign_cyp2c9_diplotype, assign_cyp2c19_diplotype, assign_dpyd_diplotype, assign_nudt15_diplotype, assign_tpmt_diplotype]:
+        with trace_stage(trace, assign_diplotype.__name__, category="fg") as stage:
+            stage["records_in"] = len(fg_results)
+            results = assign_diplotype(fg_results, diplo_pheno_dct, results)
+            stage["records_out"] = len(results)
     
     return(fg_results, results)
     
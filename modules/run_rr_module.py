@@ -7,33 +7,48 @@ Created on Tue Oct  3 18:15:14 2023
 
 import subprocess
 import json
-import pysam
 import csv
+import os
+
+from modules.checkpoint import get_intervar_manifest, stage_is_current, write_stage_manifest
+from modules.trace import trace_stage, count_lines
+from modules.clinvar_index import load_clinvar_index
+from modules.clinvar_provider import get_clinvar_variants, get_clinvar_tiers
+from modules.run_pr_module import is_reported_finding, get_max_evidence_level
 
 # Definir las funciones para cada módulo y opción
-def run_intervar(norm_vcf, category, assembly, intervar_path):
+def run_intervar(workspace, category, assembly, intervar_path, force=False):
     """
     Ejecuta el programa Intervar para anotar variantes genéticas.
     
     Args:
-        norm_vcf (str): Ruta al archivo VCF normalizado.
+        workspace (Workspace): Directorio de trabajo de la ejecución.
         category (str): Categoría de genes para la anotación.
         assembly (str): Ensamblaje genómico a utilizar.
         intervar_path (str): Ruta al directorio de Intervar.
+        force (bool): Ejecutar InterVar aunque exista una salida con las mismas entradas.
     
     Raises:
         subprocess.CalledProcessError: Si hay un error al ejecutar Intervar.
     """
     try:
         # Ruta vcf interseccion y directorio de salida
-        input_vcf = f".{norm_vcf.split('normalized')[0]}{category}_intersection.vcf"
-        output_file = f".{norm_vcf.split('normalized')[0]}{category}"
+        # (rutas absolutas, porque InterVar se ejecuta desde su directorio)
+        input_vcf = workspace.intersection_vcf(category)
+        output_file = workspace.intervar_prefix(category)
         
         if assembly == '37':
             assembly_int = "hg19"
         elif assembly == '38':
             assembly_int = 'hg38'
             
+        # Omitir la etapa si la intersección, la versión de InterVar y sus argumentos no han cambiado
+        intervar_output = workspace.intervar_output(category, assembly)
+        manifest = get_intervar_manifest(input_vcf, assembly, intervar_path)
+        if stage_is_current(manifest, intervar_output, force):
+            print(f"InterVar omitido: {intervar_output} ya está actualizado.")
+            return
+            
         # Construir el comando para ejecutar Intervar
         intervar_file_path = "./Intervar.py"
         cmd = [
@@ -48,25 +63,28 @@ def run_intervar(norm_vcf, category, assembly, intervar_path):
         # Cambiar el directorio de trabajo solo para el comando Intervar
         with subprocess.Popen(cmd, stderr=subprocess.STDOUT, text=True, cwd=intervar_path) as process:
             output, _ = process.communicate()
+        if process.returncode == 0 and os.path.exists(intervar_output):
+            write_stage_manifest(manifest, intervar_output)
 
     except subprocess.CalledProcessError as e:
         print(f"Error al ejecutar InterVar: {e.output}")
         
-def parse_intervar_output(norm_vcf, category, mode):
+def parse_intervar_output(workspace, category, mode, assembly):
     """
     Procesa el archivo de salida de InterVar y extrae los campos necesarios.
 
     Args:
-        norm_vcf (str): Ruta al archivo VCF de entrada.
+        workspace (Workspace): Directorio de trabajo de la ejecución.
         category (str): Categoría de genes para la anotación.
         mode (str)
+        assembly (str): Ensamblaje genómico utilizado en InterVar.
 
     Returns:
         list: Una lista de diccionarios con los campos extraídos.
     """
     
     #intervar_output_file = vcf_path.split("normalized")[0] + category + "_intersection.vcf"
-    intervar_output_file = f"{norm_vcf.split('normalized')[0]}{category}.{assembly_int}_multianno.txt.intervar"
+    intervar_output_file = workspace.intervar_output(category, assembly)
     intervar_results = {}
     
     try:    
@@ -133,7 +151,7 @@ def run_clinvar_filtering(evidence_level, clinvar_db, assembly):
 
     Returns:
         dict: Un diccionario que contiene las variantes filtradas de CLINVAR y su información relacionada,
-              organizadas por variantes.
+              organizadas por variantes (un ClinvarIndex, que se usa igual, si se puede usar el índice binario).
     
     Raises:
         Exception: Si ocurre un error durante el filtrado de variantes de CLINVAR.
@@ -141,6 +159,11 @@ def run_clinvar_filtering(evidence_level, clinvar_db, assembly):
     try:
         clinvar_path = f"{clinvar_db.split('GRCh')[0]}GRCh{assembly}_{clinvar_db.split('_')[-1]}"
 
+        # Usar el índice binario de ClinVar (mmap y búsqueda binaria) en lugar de cargar el archivo completo
+        clinvar_index = load_clinvar_index(clinvar_path, evidence_level)
+        if clinvar_index is not None:
+            return(clinvar_index)
+
         # Leer la base de datos de CLINVAR
         clinvar_dct = {}  # Un diccionario para almacenar la información de CLINVAR
         
@@ -175,15 +198,17 @@ def run_clinvar_filtering(evidence_level, clinvar_db, assembly):
         print(f"Error al filtrar variantes: {e}")
    
         
-def combine_results(vcf_norm, category, intervar_results, clinvar_dct):
+def combine_results(workspace, category, intervar_results, clinvar_dct, clinvar_tiers=None):
     """
     Combina los resultados de Intervar y ClinVar en una sola línea por variante.
 
     Args:
-        vcf_norm (str): Ruta al archivo VCF normalizado.
+        workspace (Workspace): Directorio de trabajo de la ejecución.
         category (str): Categoría de genes para la anotación.
         intervar_results (dict): Resultados de Intervar.
         clinvar_dct (dict): Base de datos de ClinVar.
+        clinvar_tiers (ClinvarIndex, optional): ClinVar en todos los niveles de evidencia. Si se indica, cada
+            resultado incluye 'MaxEvidenceLevel', el nivel de evidencia más alto con el que se seguiría informando.
 
     Returns:
         dict: Un diccionario con los resultados combinados.
@@ -199,7 +224,12 @@ def combine_results(vcf_norm, category, intervar_results, clinvar_dct):
 
 
     # Archivo VCF de intersección
-    vcf_path = f"{vcf_norm.split('normalized')[0]}{category}_intersection.vcf"
+    vcf_path = workspace.intersection_vcf(category)
+    
+    # Con el índice binario o la base de datos SQLite, se buscan solo las variantes de la intersección, todas
+    # juntas y ordenadas por posición, en lugar de recorrer ClinVar; se guardan solo las que están en ClinVar
+    if hasattr(clinvar_dct, "lookup_vcf"):
+        clinvar_dct = clinvar_dct.lookup_vcf(vcf_path)
     
     try:
         # Abrir el archivo VCF de intersección
@@ -243,7 +273,7 @@ def combine_results(vcf_norm, category, intervar_results, clinvar_dct):
     
                     # Combina la información si es "Pathogenic" o "Likely pathogenic" en alguno de los dos
                     #if (intervar_info and intervar_info["Classification"] in ["Pathogenic", "Likely pathogenic"]) or (clinvar_info and clinvar_info["ClinicalSignificance"] in ["Pathogenic", "Likely pathogenic"]):
-                    if (intervar_info and intervar_info["Classification"] in ["Pathogenic", "Likely pathogenic"]) or (clinvar_info and clinvar_info["ClinicalSignificance"] in ["Pathogenic", "Likely pathogenic"]) or ((clinvar_info and clinvar_info["ClinicalSignificance"].split(';')[0] == "Conflicting interpretations of pathogenicity") and (clinvar_info["ClinSigSimple"]=="1")):
+                    if is_reported_finding(intervar_info, clinvar_info):
                         combined_results[variant_key] = {
                             "Gene": clinvar_info["Gene"],
                             "Genotype": intervar_info["GT"],
@@ -260,32 +290,40 @@ def combine_results(vcf_norm, category, intervar_results, clinvar_dct):
                             combined_results[variant_key] = {
                                 "Gene": intervar_info["Gene"],
                                 "Genotype": intervar_info["GT"],
-                                "rs": intervar_info["Rs"] if intervar_info["Rs"] != '.' else clinvar_info["rs"],
+                                "rs": intervar_info["Rs"] if intervar_info["Rs"] != '.' else "NA",
                                 "IntervarClassification": intervar_info["Classification"],
                                 "ClinvarClinicalSignificance": "NA",
                                 "ReviewStatus": "NA",
                                 "ClinvarID": "NA",
                                 "Orpha": intervar_info["Orpha"]
                             }
+
+                # Nivel de evidencia más alto con el que se seguiría informando la variante
+                if clinvar_tiers is not None and variant_key in combined_results:
+                    combined_results[variant_key]["MaxEvidenceLevel"] = get_max_evidence_level(intervar_info, clinvar_tiers.get_levels(variant_key))
+
     except Exception as e:
         raise Exception(f"Error al combinar resultados: {e}")
     
     return(combined_results)
     
-def write_combined_results_to_tsv(combined_results, norm_vcf, category):
+def write_combined_results_to_tsv(combined_results, workspace, category):
     """
     Escribe los resultados combinados en un archivo TSV.
 
     Args:
         combined_results (dict): Diccionario con los resultados combinados.
-        norm_vcf (str): Ruta al archivo VCF normalizado.
+        workspace (Workspace): Directorio de trabajo de la ejecución.
         category (str): Categoría de genes para la anotación.
     """
     try:
         # Abrir el archivo TSV para escritura
-        output_tsv = f"{norm_vcf.split('normalized')[0]}{category}_combinedresults.tsv"
+        output_tsv = workspace.get_path(f"{category}_combinedresults.tsv")
         with open(output_tsv, "w", newline="") as tsv_file:
             fieldnames = ["Variant", "Gene", "Genotype", "rs", "IntervarClassification", "ClinvarClinicalSignificance", "ReviewStatus", "ClinvarID", "Orpha"]
+            # Columna del modo de varios niveles de evidencia
+            if any("MaxEvidenceLevel" in info for info in combined_results.values()):
+                fieldnames.append("MaxEvidenceLevel")
             writer = csv.DictWriter(tsv_file, fieldnames=fieldnames, delimiter="\t")
         
             # Escribir el encabezado del archivo TSV
@@ -305,6 +343,8 @@ def write_combined_results_to_tsv(combined_results, norm_vcf, category):
                     "ClinvarID": info.get("ClinvarID", ""),
                     "Orpha": info.get("Orpha", "")
                 }
+                if "MaxEvidenceLevel" in fieldnames:
+                    row["MaxEvidenceLevel"] = info.get("MaxEvidenceLevel", "")
     
                 # Escribir la fila en el archivo TSV
                 writer.writerow(row)    
@@ -312,32 +352,49 @@ def write_combined_results_to_tsv(combined_results, norm_vcf, category):
     except Exception as e:
         raise Exception(f"Error al escribir resultados en archivo TSV: {e}")
 
-def run_reproductive_risk_module(norm_vcf, assembly, mode, evidence_level, clinvar_db, categories_path, intervar_path):
+def run_reproductive_risk_module(workspace, assembly, mode, evidence_level, clinvar_db, categories_path, intervar_path, clinvar_dct=None, force_intervar=False, trace=None, evidence_tiers=False):
     """
     Ejecuta el módulo de riesgo personal según el modo seleccionado.
     
     Args:
-        vcf_path (str): Ruta al archivo VCF de entrada.
+        workspace (Workspace): Directorio de trabajo de la ejecución.
         assembly (str): Ensamblaje genómico a utilizar.
         mode (str): Modo de ejecución ("basic" o "advanced").
         evidence_level (int): Nivel de evidencia deseado.
         category (str): Categoría de genes para la anotación.
         clinvar_db (str): Ruta al archivo de base de datos de CLINVAR.
+        clinvar_dct (dict, optional): Variantes de ClinVar ya cargadas. Si no se indica, se lee clinvar_db.
+        force_intervar (bool): Ejecutar InterVar aunque exista una salida con las mismas entradas.
+        trace (RunTrace, optional): Traza de la ejecución en la que se registran las etapas.
+        evidence_tiers (bool): Anotar cada resultado con el nivel de evidencia más alto con el que se seguiría informando.
     """
     category = "rr"
+    if mode not in ["basic", "advanced"]:
+        print("Modo no válido. Elija 'basic' o 'advanced'.")
+        return(None)
+    
+    # Ejecutar InterVar y procesar su salida
+    intersection_vcf = workspace.intersection_vcf(category)
+    with trace_stage(trace, "run_intervar", inputs=[intersection_vcf], category=category) as stage:
+        run_intervar(workspace, category, assembly, intervar_path, force_intervar)
+        stage["records_in"] = count_lines(intersection_vcf)
+    with trace_stage(trace, "parse_intervar_output", category=category) as stage:
+        intervar_results = parse_intervar_output(workspace, category, mode, assembly)
+        stage["records_out"] = len(intervar_results)
+    
     if mode == "basic":
-        run_intervar(norm_vcf, category, assembly, intervar_path)
-        intervar_results = parse_intervar_output(norm_vcf, category, mode)
         return(intervar_results)
 
     elif mode == "advanced":
-        run_intervar(norm_vcf, category, assembly, intervar_path)
-        intervar_results = parse_intervar_output(norm_vcf, category, mode)
-        clinvar_dct = run_clinvar_filtering(evidence_level, clinvar_db, assembly)
-        combined_results = combine_results(norm_vcf, category, intervar_results, clinvar_dct)
-        write_combined_results_to_tsv(combined_results, norm_vcf, category)
+        # Si no se ha cargado previamente, ClinVar se obtiene del proveedor del proceso, que lo carga una sola vez
+        if clinvar_dct is None:
+            with trace_stage(trace, "run_clinvar_filtering", category=category) as stage:
+                clinvar_dct = get_clinvar_variants(evidence_level, clinvar_db, assembly)
+                stage["records_out"] = len(clinvar_dct)
+        with trace_stage(trace, "combine_results", inputs=[intersection_vcf], category=category) as stage:
+            clinvar_tiers = get_clinvar_tiers(clinvar_db, assembly) if evidence_tiers else None
+            combined_results = combine_results(workspace, category, intervar_results, clinvar_dct, clinvar_tiers)
+            write_combined_results_to_tsv(combined_results, workspace, category)
+            stage["records_in"] = len(intervar_results)
+            stage["records_out"] = len(combined_results)
         return(combined_results)
-
-    else:
-        print("Modo no válido. Elija 'basic' o 'advanced'.")
-        return None
\ No newline at end of file
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:20:47 2026
+
+@author: kindi
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class Stage:
+    """
+    Etapa del análisis: una función con las entradas que necesita y las salidas que produce.
+
+    Las entradas y salidas son nombres de datos (por ejemplo, 'normalized_vcf' o 'clinvar_dct'). La función
+    se llama con los valores de sus entradas, en el orden declarado, y devuelve el valor de su salida, una
+    tupla con los valores de sus salidas si declara varias, o nada si no declara ninguna.
+    """
+    def __init__(self, name, func, inputs=(), outputs=()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+    def run(self, values):
+        result = self.func(*values)
+        if not self.outputs:
+            return({})
+        if len(self.outputs) == 1:
+            return({self.outputs[0]: result})
+        return(dict(zip(self.outputs, result)))
+
+class StageScheduler:
+    """
+    Ejecuta un grafo de etapas con un número máximo de trabajadores.
+
+    Cada etapa empieza en cuanto están disponibles todas sus entradas, de modo que las etapas independientes
+    se solapan: la lectura de ClinVar con bcftools o InterVar, o el módulo FG con la ejecución de InterVar
+    del módulo PR. Se usan hilos porque las etapas largas esperan a procesos externos o al disco. Con un
+    solo trabajador, las etapas se ejecutan en el orden en que se añadieron.
+    """
+    def __init__(self, workers=1):
+        self.workers = max(1, workers)
+        self.stages = []
+
+    def add(self, name, func, inputs=(), outputs=()):
+        """
+        Añade una etapa al grafo.
+
+        Args:
+            name (str): Nombre de la etapa.
+            func (callable): Función de la etapa.
+            inputs (list): Datos que necesita la etapa.
+            outputs (list): Datos que produce la etapa.
+
+        Returns:
+            Stage: La etapa añadida.
+        """
+        stage = Stage(name, func, inputs, outputs)
+        self.stages.append(stage)
+        return(stage)
+
+    def extend(self, stages):
+        self.stages.extend(stages)
+
+    def validate(self, data):
+        """
+        Comprueba que el grafo se puede ejecutar con los datos iniciales: nombres únicos, cada dato producido
+        por una sola etapa (y no incluido en los datos iniciales), todas las entradas disponibles y sin ciclos.
+
+        Raises:
+            ValueError: Si el grafo no es válido.
+        """
+        names = set()
+        producers = {}
+        for stage in self.stages:
+            if stage.name in names:
+                raise ValueError(f"Etapa duplicada: {stage.name}")
+            names.add(stage.name)
+            for output in stage.outputs:
+                if output in data or output in producers:
+                    raise ValueError(f"El dato '{output}' de la etapa {stage.name} ya lo produce {producers.get(output, 'los datos iniciales')}")
+                producers[output] = stage.name
+
+        # Recorrer el grafo en orden topológico para detectar entradas que nunca estarán disponibles
+        available = set(data)
+        pending = list(self.stages)
+        while pending:
+            ready = [stage for stage in pending if all(key in available for key in stage.inputs)]
+            if not ready:
+                missing = {stage.name: [key for key in stage.inputs if key not in available] for stage in pending}
+                raise ValueError(f"Etapas con entradas que no se pueden obtener (entradas ausentes o ciclo): {missing}")
+            for stage in ready:
+                available.update(stage.outputs)
+                pending.remove(stage)
+
+    def run(self, data=None):
+        """
+        Ejecuta todas las etapas del grafo.
+
+        Args:
+            data (dict, optional): Datos iniciales, disponibles para las etapas desde el principio.
+
+        Returns:
+            dict: Los datos iniciales y las salidas de todas las etapas.
+
+        Raises:
+            Exception: El primer error de una etapa. Tras un error no se empiezan etapas nuevas, pero se
+                espera a que terminen las que ya están en marcha.
+        """
+        data = dict(data or {})
+        self.validate(data)
+        pending = list(self.stages)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                # Lanzar las etapas cuyas entradas ya están disponibles, hasta llenar los trabajadores
+                if error is None:
+                    for stage in list(pending):
+                        if len(running) >= self.workers:
+                            break
+                        if all(key in data for key in stage.inputs):
+                            pending.remove(stage)
+                            values = [data[key] for key in stage.inputs]
+                            running[executor.submit(stage.run, values)] = stage
+                if not running:
+                    break
+
+                # Esperar a que termine alguna etapa y publicar sus salidas
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        data.update(future.result())
+                    except Exception as e:
+                        if error is None:
+                            print(f"Error en la etapa {stage.name}: {e}")
+                            error = e
+        if error is not None:
+            raise error
+        return(data)
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:05:31 2026
+
+@author: kindi
+"""
+import os
+import json
+import time
+import uuid
+import socketserver
+import threading
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from modules.get_clinvar import get_latest_clinvar
+from modules.clinvar_shard import restrict_clinvar_db
+from modules.intersect_vcf_bed import get_category_bed
+from modules.shared_resources import load_shared_resources
+from modules.clinvar_provider import clear_clinvar_cache, get_clinvar_file
+from modules.clinvar_sqlite import load_clinvar_sqlite, PATHOGENIC_SIGNIFICANCES
+from modules.findings_store import query_findings
+
+class ResourceRegistry:
+    """
+    Mantiene en memoria los recursos compartidos (ClinVar, catálogos, diplotipos y asociaciones gen-HPO)
+    para cada combinación de ensamblaje y nivel de evidencia, y los recarga cuando cambian sus archivos.
+
+    La recarga construye un diccionario nuevo y lo sustituye de una vez, de modo que los trabajos en curso
+    siguen usando la versión anterior completa y los nuevos reciben la nueva.
+    """
+    def __init__(self, config_data, generate_catalogs):
+        self.config_data = config_data
+        self.generate_catalogs = generate_catalogs
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.load_locks = {}
+
+    def _source_files(self, assembly, clinvar_db):
+        """
+        Devuelve los archivos de los que dependen los recursos de un ensamblaje.
+        """
+        categories_path = self.config_data["categories_path"]
+        files = [
+            f"{categories_path}PR/pr_risk_genes.json",
+            f"{categories_path}RR/rr_risk_genes.json",
+            f"{categories_path}FG/fg_risk_variants_grch{assembly}.json",
+            f"{categories_path}FG/diplotipo_fenotipo.csv",
+            f"{categories_path}genes_to_phenotype.txt"
+        ]
+        # Los BED de los catálogos PR y RR delimitan el fragmento de ClinVar (clinvar_catalog_shard)
+        files += [get_category_bed(category, assembly, categories_path) for category in ["pr", "rr"]]
+        if clinvar_db is not None:
+            files.append(f"{clinvar_db.split('GRCh')[0]}GRCh{assembly}_{clinvar_db.split('_')[-1]}")
+        return files
+
+    def _signature(self, assembly, clinvar_db):
+        """
+        Firma de los archivos de origen: ruta y fecha de modificación de cada uno.
+        """
+        signature = []
+        for file in self._source_files(assembly, clinvar_db):
+            mtime = os.path.getmtime(file) if os.path.exists(file) else None
+            signature.append((file, mtime))
+        return tuple(signature)
+
+    def get(self, assembly, mode, evidence, force=False):
+        """
+        Devuelve los recursos de un ensamblaje y nivel de evidencia, cargándolos o recargándolos si es necesario.
+
+        Args:
+            assembly (str): Ensamblaje genómico ('37' o '38').
+            mode (str): Modo de análisis ("basic" o "advanced").
+            evidence (int): Nivel de evidencia de ClinVar.
+            force (bool): Recargar aunque los archivos no hayan cambiado.
+
+        Returns:
+            tuple: Los recursos cargados y la ruta a la base de datos ClinVar (None en modo básico).
+        """
+        clinvar_db = get_latest_clinvar(self.config_data["clinvar_path"]) if mode == "advanced" else None
+        if mode == "advanced" and clinvar_db is None:
+            raise FileNotFoundError("No hay ninguna base de datos ClinVar descargada en el directorio clinvar.")
+        key = (assembly, evidence if mode == "advanced" else None)
+
+        with self.lock:
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+
+        # Un solo hilo carga cada combinación; el resto espera y reutiliza el resultado. La firma se calcula
+        # sobre la base de datos ClinVar completa y los catálogos, así que los trabajos con los recursos ya
+        # cargados no generan los catálogos ni vuelven a leer sus BED para el fragmento de ClinVar
+        with load_lock:
+            signature = self._signature(assembly, clinvar_db)
+            entry = self.entries.get(key)
+            if force or entry is None or entry["signature"] != signature:
+                print(f"Cargando recursos compartidos (GRCh{assembly}, modo {mode}, evidencia {evidence})...")
+                self.generate_catalogs(assembly, self.config_data["categories_path"])
+                # La generación de los catálogos puede crear o cambiar sus archivos
+                signature = self._signature(assembly, clinvar_db)
+                clinvar_db = restrict_clinvar_db(clinvar_db, assembly, self.config_data)
+                # Una recarga forzada no reutiliza la base de datos ClinVar del proveedor del proceso
+                if force:
+                    clear_clinvar_cache()
+                resources = load_shared_resources(["pr", "rr", "fg"], mode, evidence, assembly, clinvar_db, self.config_data["categories_path"],
+                                                  self.config_data.get("clinvar_backend", "index"))
+                entry = {"signature": signature, "resources": resources, "clinvar_db": clinvar_db, "loaded": time.time()}
+                with self.lock:
+                    self.entries[key] = entry
+        return entry["resources"], entry["clinvar_db"]
+
+    def reload(self):
+        """
+        Recarga todas las combinaciones cargadas hasta ahora.
+        """
+        with self.lock:
+            keys = list(self.entries.keys())
+        for assembly, evidence in keys:
+            self.get(assembly, "advanced" if evidence is not None else "basic", evidence, force=True)
+
+class AnalysisServer:
+    """
+    Servidor residente que recibe trabajos de análisis y los ejecuta en un pool de hilos acotado.
+    """
+    def __init__(self, config_data, analyze_sample, generate_catalogs, workers=2, max_queue=100):
+        self.config_data = config_data
+        self.analyze_sample = analyze_sample
+        self.registry = ResourceRegistry(config_data, generate_catalogs)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_queue = max_queue
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def validate_job(self, params):
+        """
+        Comprueba y completa los parámetros de un trabajo.
+
+        Args:
+            params (dict): Parámetros recibidos: vcf_file, categories, mode, evidence, assembly y hpos o hpos_txt.
+
+        Returns:
+            dict: Parámetros validados.
+
+        Raises:
+            ValueError: Si algún parámetro no es válido.
+        """
+        vcf_file = params.get("vcf_file")
+        if not vcf_file or not os.path.exists(vcf_file):
+            raise ValueError(f"El archivo VCF no existe: {vcf_file}")
+        categories = params.get("categories", ["pr", "rr", "fg"])
+        if isinstance(categories, str):
+            categories = categories.split(",")
+        categories = [category.strip().lower() for category in categories if category.strip()]
+        if not categories or any(category not in ["pr", "rr", "fg"] for category in categories):
+            raise ValueError(f"Categorías no válidas: {categories}")
+        mode = params.get("mode", "basic")
+        if mode not in ["basic", "advanced"]:
+            raise ValueError(f"Modo no válido: {mode}")
+        evidence = int(params.get("evidence", 1))
+        if evidence not in range(1, 5):
+            raise ValueError(f"Nivel de evidencia no válido: {evidence}")
+        assembly = str(params.get("assembly", "37"))
+        if assembly not in ["37", "38"]:
+            raise ValueError(f"Ensamblaje no válido: {assembly}")
+        hpos = params.get("hpos", [])
+        if not isinstance(hpos, list):
+            raise ValueError("'hpos' debe ser una lista de términos HPO.")
+        return {
+            "vcf_file": vcf_file,
+            "categories": categories,
+            "mode": mode,
+            "evidence": evidence,
+            "assembly": assembly,
+            "hpos": hpos,
+            "hpos_txt": params.get("hpos_txt")
+        }
+
+    def submit(self, params):
+        """
+        Valida y encola un trabajo.
+
+        Returns:
+            dict: El registro del trabajo.
+
+        Raises:
+            ValueError: Si los parámetros no son válidos.
+            RuntimeError: Si la cola está llena.
+        """
+        job_params = self.validate_job(params)
+        with self.lock:
+            pending = len([job for job in self.jobs.values() if job["status"] in ["queued", "running"]])
+            if pending >= self.max_queue:
+                raise RuntimeError("La cola de trabajos está llena.")
+            job_id = uuid.uuid4().hex[:12]
+            job = {"id": job_id, "status": "queued", "params": job_params, "submitted": time.time(),
+                   "started": None, "finished": None, "report": None, "error": None}
+            self.jobs[job_id] = job
+        self.executor.submit(self.run_job, job)
+        return job
+
+    def run_job(self, job):
+        """
+        Ejecuta un trabajo con los recursos precargados.
+        """
+        job["status"] = "running"
+        job["started"] = time.time()
+        params = job["params"]
+        job_hpos_txt = None
+        try:
+            resources, clinvar_db = self.registry.get(params["assembly"], params["mode"], params["evidence"])
+
+            # Los HPOs recibidos como lista se escriben en un archivo para write_report, que se borra al terminar
+            hpos_txt = params["hpos_txt"]
+            if params["hpos"]:
+                hpos_txt = job_hpos_txt = f"{self.config_data['temp_path']}job_{job['id']}_hpos.txt"
+                with open(hpos_txt, "w") as hpos_file:
+                    hpos_file.write("\n".join(params["hpos"]) + "\n")
+
+            job["report"] = self.analyze_sample(params["vcf_file"], hpos_txt, params["categories"], params["mode"], params["evidence"],
+                                                params["assembly"], clinvar_db, self.config_data, resources,
+                                                retention=self.config_data.get("workspace_retention", "keep"))
+            job["status"] = "done" if job["report"] else "error"
+        except Exception as e:
+            job["status"] = "error"
+            job["error"] = str(e)
+            print(f"Error en el trabajo {job['id']}: {e}")
+        finally:
+            if job_hpos_txt is not None and os.path.exists(job_hpos_txt):
+                os.remove(job_hpos_txt)
+        job["finished"] = time.time()
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def status(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        with self.registry.lock:
+            loaded = [f"GRCh{assembly}/evidence={evidence}" for assembly, evidence in self.registry.entries]
+        return {"jobs": counts, "resources": loaded}
+
+    def query_clinvar(self, params):
+        """
+        Consulta de los curadores sobre la base de datos SQLite de ClinVar más reciente: por gen, región o RCV,
+        con un número mínimo de estrellas y, opcionalmente, solo las variantes patogénicas o probablemente
+        patogénicas.
+        """
+        clinvar_db = get_latest_clinvar(self.config_data["clinvar_path"])
+        if clinvar_db is None:
+            raise FileNotFoundError("No hay ninguna base de datos ClinVar descargada en el directorio clinvar.")
+        assembly = params.get("assembly", "38")
+        if assembly not in ["37", "38"]:
+            raise ValueError("El ensamblaje debe ser 37 o 38.")
+        clinvar_sqlite = load_clinvar_sqlite(get_clinvar_file(clinvar_db, assembly), 0)
+        if clinvar_sqlite is None:
+            raise FileNotFoundError("No se pudo abrir la base de datos SQLite de ClinVar.")
+        min_stars = int(params.get("min_stars", 0))
+        significances = PATHOGENIC_SIGNIFICANCES if params.get("pathogenic") in ["1", "true"] else None
+        if "gene" in params:
+            return(clinvar_sqlite.query_gene(params["gene"], min_stars, significances))
+        if "rcv" in params:
+            return(clinvar_sqlite.query_rcv(params["rcv"]))
+        if all(param in params for param in ["chrom", "start", "end"]):
+            return(clinvar_sqlite.query_region(params["chrom"], int(params["start"]), int(params["end"]), min_stars, significances))
+        raise ValueError("Hay que indicar gene, rcv o chrom, start y end.")
+
+    def query_findings(self, params):
+        """
+        Hallazgos guardados en la base de datos de hallazgos ('findings_db' en config.json).
+        """
+        if not self.config_data.get("findings_db"):
+            raise FileNotFoundError("No hay ninguna base de datos de hallazgos configurada (findings_db).")
+        return(query_findings(self.config_data["findings_db"], params.get("gene"), params.get("sample"), params.get("chrom"),
+                              params.get("start"), params.get("end")))
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    """
+    API HTTP del servidor:
+        POST /jobs         Encola un trabajo (JSON con vcf_file, categories, mode, evidence, assembly, hpos).
+        GET  /jobs/<id>    Estado y resultado de un trabajo.
+        GET  /status       Estado del servidor.
+        GET  /clinvar      Registros de ClinVar (parámetros assembly, gene, rcv, chrom, start, end, min_stars, pathogenic).
+        GET  /findings     Hallazgos guardados (parámetros gene, sample, chrom, start, end).
+        POST /reload       Recarga los recursos compartidos.
+    """
+    def _send_json(self, code, data):
+        body = json.dumps(data, indent=4).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        analysis_server = self.server.analysis_server
+        if self.path == "/status":
+            self._send_json(200, analysis_server.status())
+        elif self.path.startswith("/jobs/"):
+            job = analysis_server.get_job(self.path.split("/")[-1])
+            if job is None:
+                self._send_json(404, {"error": "Trabajo no encontrado."})
+            else:
+                self._send_json(200, job)
+        elif self.path.startswith(("/clinvar?", "/findings?")) or self.path in ["/clinvar", "/findings"]:
+            url = urlsplit(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            query = analysis_server.query_clinvar if url.path == "/clinvar" else analysis_server.query_findings
+            try:
+                self._send_json(200, query(params))
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+            except FileNotFoundError as e:
+                self._send_json(404, {"error": str(e)})
+        else:
+            self._send_json(404, {"error": "Ruta no encontrada."})
+
+    def do_POST(self):
+        analysis_server = self.server.analysis_server
+        if self.path == "/jobs":
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                params = json.loads(self.rfile.read(length) or b"{}")
+                job = analysis_server.submit(params)
+                self._send_json(202, {"id": job["id"], "status": job["status"]})
+            except (ValueError, json.JSONDecodeError) as e:
+                self._send_json(400, {"error": str(e)})
+            except RuntimeError as e:
+                self._send_json(503, {"error": str(e)})
+        elif self.path == "/reload":
+            analysis_server.registry.reload()
+            self._send_json(200, analysis_server.status())
+        else:
+            self._send_json(404, {"error": "Ruta no encontrada."})
+
+    def log_message(self, format, *args):
+        print(f"[serve] {format % args}")
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Servidor HTTP sobre un socket Unix.
+    """
+    daemon_threads = True
+
+def run_server(config_data, analyze_sample, generate_catalogs, host="127.0.0.1", port=8765, socket_path=None, workers=2, max_queue=100, preload=None):
+    """
+    Arranca el servidor residente de análisis.
+
+    Args:
+        config_data (dict): Valores del archivo de configuración.
+        analyze_sample (function): Función que analiza una muestra.
+        generate_catalogs (function): Función que genera los catálogos JSON y BED si no existen.
+        host (str): Dirección en la que escuchar (solo localhost).
+        port (int): Puerto TCP.
+        socket_path (str): Ruta a un socket Unix; si se indica, se usa en lugar de TCP.
+        workers (int): Número máximo de trabajos ejecutados a la vez.
+        max_queue (int): Número máximo de trabajos pendientes.
+        preload (list): Combinaciones (assembly, mode, evidence) a cargar al arrancar.
+    """
+    analysis_server = AnalysisServer(config_data, analyze_sample, generate_catalogs, workers, max_queue)
+
+    # Precargar los recursos para que el primer trabajo no pague la carga
+    for assembly, mode, evidence in preload or []:
+        analysis_server.registry.get(assembly, mode, evidence)
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        httpd = UnixHTTPServer(socket_path, AnalysisRequestHandler)
+        print(f"Servidor de análisis escuchando en el socket {socket_path}")
+    else:
+        httpd = ThreadingHTTPServer((host, port), AnalysisRequestHandler)
+        print(f"Servidor de análisis escuchando en http://{host}:{port}")
+    httpd.analysis_server = analysis_server
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("Deteniendo el servidor...")
+    finally:
+        httpd.server_close()
+        analysis_server.executor.shutdown(wait=True)
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
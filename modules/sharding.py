@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 00:35:10 2026
+
+@author: kindi
+"""
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from modules.checkpoint import (get_intervar_manifest, get_stage_manifest, stage_is_current, write_stage_manifest,
+                               get_file_hashes, preload_file_hashes)
+from modules.normalize_vcf import normalize_vcf, index_input_vcf, write_regions_bed, get_reference
+from modules.intersect_vcf_bed import intersect_vcf_with_beds
+from modules.trace import count_lines
+from modules.run_pr_module import run_intervar as run_intervar_pr
+from modules.run_rr_module import run_intervar as run_intervar_rr
+
+# Longitud de un cromosoma cuyo tamaño no está en el índice (la posición máxima de un índice tabix)
+MAX_CHROM_LENGTH = 2 ** 29
+
+# Categorías que se anotan con InterVar en cada fragmento
+INTERVAR_CATEGORIES = {"pr": run_intervar_pr, "rr": run_intervar_rr}
+
+def get_index_stats(vcf_path):
+    """
+    Estadísticas del índice de un VCF (bcftools index -s), sin leer sus registros.
+
+    Returns:
+        list: (cromosoma, longitud o None, número de registros) de cada cromosoma, en el orden del índice.
+    """
+    output = subprocess.run(["bcftools", "index", "-s", vcf_path], capture_output=True, text=True, check=True).stdout
+    stats = []
+    for line in output.splitlines():
+        fields = line.split("\t")
+        if len(fields) >= 3 and fields[2].isdigit():
+            stats.append((fields[0], int(fields[1]) if fields[1].isdigit() else None, int(fields[2])))
+    return(stats)
+
+def plan_shards(stats, n_shards):
+    """
+    Reparte los cromosomas con registros en hasta n_shards fragmentos equilibrados por número de registros:
+    de mayor a menor, cada cromosoma va al fragmento que menos registros tiene.
+
+    Returns:
+        list: Los cromosomas (cromosoma, longitud) de cada fragmento, en el orden del índice.
+    """
+    order = {chrom: i for i, (chrom, _, _) in enumerate(stats)}
+    chroms = sorted([stat for stat in stats if stat[2] > 0], key=lambda stat: (-stat[2], order[stat[0]]))
+    shards = [[] for _ in range(min(n_shards, len(chroms)))]
+    loads = [0] * len(shards)
+    for chrom, length, records in chroms:
+        i = loads.index(min(loads))
+        shards[i].append((chrom, length))
+        loads[i] += records
+    shards = [sorted(shard, key=lambda chrom: order[chrom[0]]) for shard in shards]
+    return(sorted(shards, key=lambda shard: order[shard[0][0]]))
+
+def write_shard_regions(shard_workspace, chroms, regions_bed=None):
+    """
+    Escribe el BED de las regiones de un fragmento: las de regions_bed (las de los catálogos) en sus
+    cromosomas o, sin regions_bed, sus cromosomas completos.
+
+    Returns:
+        str: Ruta al BED del fragmento.
+    """
+    names = {chrom for chrom, _ in chroms}
+    shard_bed = shard_workspace.regions_bed
+    with open(f"{shard_bed}.tmp", "w") as bed:
+        if regions_bed is not None:
+            with open(regions_bed, "r") as catalog_bed:
+                for line in catalog_bed:
+                    if line.split("\t", 1)[0] in names:
+                        bed.write(line)
+        else:
+            for chrom, length in chroms:
+                bed.write(f"{chrom}\t0\t{length or MAX_CHROM_LENGTH}\n")
+    os.replace(f"{shard_bed}.tmp", shard_bed)
+    return(shard_bed)
+
+def write_empty_intervar_output(shard_workspace, category, assembly, intervar_path):
+    """
+    Salida de InterVar de una intersección vacía: un archivo vacío, con su manifiesto, que sustituye a la
+    salida de una ejecución anterior del fragmento.
+    """
+    intervar_output = shard_workspace.intervar_output(category, assembly)
+    with open(f"{intervar_output}.tmp", "w"):
+        pass
+    os.replace(f"{intervar_output}.tmp", intervar_output)
+    write_stage_manifest(get_intervar_manifest(shard_workspace.intersection_vcf(category), assembly, intervar_path), intervar_output)
+
+def run_shard(input_vcf, shard_workspace, chroms, categories, assembly, config_data, regions_bed, force_stages):
+    """
+    Normaliza, intersecta y anota con InterVar los cromosomas de un fragmento, en su propio directorio de
+    trabajo (se ejecuta en un proceso del pool). Cada etapa conserva su checkpoint.
+
+    Raises:
+        RuntimeError: Si falla la intersección o InterVar en el fragmento, para que el error llegue a run_sharded
+                      en lugar de perder los cromosomas del fragmento al unir los resultados. Los errores de la
+                      normalización (subprocess.CalledProcessError u OSError) llegan de la misma forma.
+    """
+    shard_regions = write_shard_regions(shard_workspace, chroms, regions_bed)
+    chrom_names = ", ".join(chrom for chrom, _ in chroms)
+    norm_vcf = normalize_vcf(input_vcf, shard_workspace, assembly, "normalize" in force_stages, config_data.get("normalize_threads", 0),
+                             config_data.get("normalize_compression_level", 6), shard_regions,
+                             config_data.get("normalize_engine", "bcftools"), config_data.get("normalize_native_max_bytes", 1000000))
+    intersected = intersect_vcf_with_beds(shard_workspace, categories, assembly, config_data["categories_path"], "intersect" in force_stages, norm_vcf)
+    if set(intersected) != set(categories):
+        raise RuntimeError(f"La intersección del fragmento {shard_workspace.path} ({chrom_names}) ha fallado para "
+                           f"{', '.join(category for category in categories if category not in intersected)}")
+    for category in categories:
+        if category not in INTERVAR_CATEGORIES:
+            continue
+        # InterVar no se ejecuta sobre una intersección vacía, pero su salida se sustituye por una vacía
+        if count_lines(shard_workspace.intersection_vcf(category)) == 0:
+            write_empty_intervar_output(shard_workspace, category, assembly, config_data["intervar_path"])
+            continue
+        INTERVAR_CATEGORIES[category](shard_workspace, category, assembly, config_data["intervar_path"], "intervar" in force_stages)
+        # run_intervar solo guarda el manifiesto si InterVar termina bien y escribe su salida
+        manifest = get_intervar_manifest(shard_workspace.intersection_vcf(category), assembly, config_data["intervar_path"])
+        if not stage_is_current(manifest, shard_workspace.intervar_output(category, assembly)):
+            raise RuntimeError(f"InterVar ha fallado en el fragmento {shard_workspace.path} ({chrom_names}) para {category}")
+
+def merge_shard_files(shard_files, output_file, chrom_order):
+    """
+    Une los archivos de los fragmentos (intersecciones, tablas de coincidencias o salidas de InterVar): la cabecera del primero y
+    los registros por cromosoma en el orden del índice, conservando dentro de cada cromosoma el orden de su
+    fragmento. El resultado no depende del reparto de los cromosomas ni del orden en que terminan los procesos.
+
+    Raises:
+        FileNotFoundError: Si falta el archivo de algún fragmento (sus cromosomas se perderían).
+    """
+    strip = lambda chrom: chrom[3:] if chrom.startswith("chr") else chrom
+    missing = [shard_file for shard_file in shard_files if not os.path.exists(shard_file)]
+    if missing:
+        raise FileNotFoundError(f"Faltan archivos de fragmentos para unir {output_file}: {', '.join(missing)}")
+    header, records = None, {}
+    for shard_file in shard_files:
+        file_header = []
+        with open(shard_file, "r") as file:
+            for line in file:
+                if line.startswith("#"):
+                    file_header.append(line)
+                else:
+                    records.setdefault(strip(line.split("\t", 1)[0]), []).append(line)
+        if not header:
+            header = file_header
+    order = [strip(chrom) for chrom in chrom_order]
+    order += sorted(chrom for chrom in records if chrom not in set(order))
+    with open(f"{output_file}.tmp", "w") as out_file:
+        out_file.writelines(header or [])
+        for chrom in order:
+            out_file.writelines(records.get(chrom, []))
+    os.replace(f"{output_file}.tmp", output_file)
+
+def run_sharded(input_vcf, workspace, categories, assembly, config_data, n_shards, force_stages=None):
+    """
+    Normalización, intersección e InterVar por fragmentos: los cromosomas del VCF de entrada se reparten en
+    fragmentos equilibrados según las estadísticas de su índice, cada fragmento se procesa en un proceso
+    de un pool y sus intersecciones, tablas de coincidencias y salidas de InterVar se unen en el directorio de trabajo de la muestra.
+    Los módulos PR y RR encuentran la salida de InterVar ya actualizada y no vuelven a ejecutarlo.
+
+    Args:
+        input_vcf (str): Ruta al VCF de entrada.
+        workspace (Workspace): Directorio de trabajo de la muestra.
+        categories (list): Categorías analizadas.
+        assembly (str): Ensamblaje genómico a utilizar.
+        config_data (dict): Valores del archivo de configuración.
+        n_shards (int): Número máximo de fragmentos (y de procesos).
+        force_stages (list, optional): Etapas que se repiten aunque sus entradas no hayan cambiado.
+
+    Returns:
+        bool: True si se ha procesado por fragmentos; False si el VCF no se puede fragmentar (sin comprimir
+              con bgzip o sin estadísticas en el índice) o tiene un solo fragmento.
+    """
+    if force_stages is None:
+        force_stages = []
+    try:
+        if not index_input_vcf(input_vcf):
+            return False
+        stats = get_index_stats(input_vcf)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"No se pueden leer las estadísticas del índice de {input_vcf}: {e}")
+        return False
+
+    # Con las regiones de los catálogos, solo los cromosomas que las tienen
+    regions_bed = None
+    if config_data.get("normalize_catalog_regions", False):
+        regions_bed = write_regions_bed(workspace, categories, assembly, config_data["categories_path"], config_data.get("normalize_padding", 200))
+    if regions_bed is not None:
+        with open(regions_bed, "r") as bed:
+            catalog_chroms = {line.split("\t", 1)[0] for line in bed}
+        stats = [stat for stat in stats if stat[0] in catalog_chroms]
+
+    shards = plan_shards(stats, n_shards)
+    if len(shards) < 2:
+        return False
+    print(f"Procesando {input_vcf} en {len(shards)} fragmentos...")
+    shard_workspaces = [workspace.child(workspace.name, f"shards/{i}") for i in range(len(shards))]
+    # Los hashes del VCF de entrada y de la referencia (entradas de la normalización de todos los fragmentos) se
+    # calculan una sola vez aquí y se pasan a los procesos, en lugar de leer los archivos en cada fragmento
+    input_hashes = get_file_hashes([input_vcf, get_reference(assembly)])
+    with ProcessPoolExecutor(max_workers=min(len(shards), os.cpu_count() or 1), initializer=preload_file_hashes, initargs=(input_hashes,)) as executor:
+        futures = [executor.submit(run_shard, input_vcf, shard_workspace, chroms, categories, assembly, config_data, regions_bed, force_stages)
+                   for shard_workspace, chroms in zip(shard_workspaces, shards)]
+        for future in futures:
+            future.result()
+
+    chrom_order = [chrom for chrom, _, _ in stats]
+    merge_shard_files([shard_workspace.intersection_hits for shard_workspace in shard_workspaces], workspace.intersection_hits, chrom_order)
+    for category in categories:
+        merge_shard_files([shard_workspace.intersection_vcf(category) for shard_workspace in shard_workspaces],
+                          workspace.intersection_vcf(category), chrom_order)
+        if category in INTERVAR_CATEGORIES:
+            intervar_output = workspace.intervar_output(category, assembly)
+            shard_outputs = [shard_workspace.intervar_output(category, assembly) for shard_workspace in shard_workspaces]
+            merge_shard_files(shard_outputs, intervar_output, chrom_order)
+            # Todos los fragmentos han terminado bien (si no, future.result() habría lanzado su error): el manifiesto
+            # recoge la intersección unida y las salidas de los fragmentos con las que se ha construido
+            manifest = get_intervar_manifest(workspace.intersection_vcf(category), assembly, config_data["intervar_path"])
+            manifest["shards"] = get_stage_manifest("intervar", {f"shard_{i}": shard_output for i, shard_output in enumerate(shard_outputs)}, {})["inputs"]
+            write_stage_manifest(manifest, intervar_output)
+    return True
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 18:40:12 2026
+
+@author: kindi
+"""
+import os
+
+from modules.clinvar_provider import get_clinvar_variants
+from modules.run_fg_module import load_fg_variants_json, get_diplotype_phenotype_dictionary
+from modules.write_report import load_genes_catalog, get_gene_hpo_dictionary
+
+def load_shared_resources(categories, mode, evidence, assembly, clinvar_db, categories_path, clinvar_backend="index"):
+    """
+    Carga una sola vez los recursos que comparten todas las muestras de un análisis: la base de datos
+    ClinVar filtrada, los catálogos JSON, la tabla de diplotipos y las asociaciones gen-HPO.
+
+    Args:
+        categories (list): Categorías a analizar (pr, rr, fg).
+        mode (str): Modo de análisis ("basic" o "advanced").
+        evidence (int): Nivel de evidencia de ClinVar.
+        assembly (str): Ensamblaje genómico a utilizar.
+        clinvar_db (str): Ruta al archivo de base de datos de ClinVar (None en modo básico).
+        categories_path (str): Ruta al directorio categories.
+        clinvar_backend (str): 'index' (índice binario) o 'sqlite' (base de datos SQLite).
+
+    Returns:
+        dict: Un diccionario con los recursos cargados.
+    """
+    resources = {
+        "clinvar_dct": None,
+        "genes_cat": {},
+        "fg_json": None,
+        "diplo_pheno_dct": None,
+        "gene_hpo_dict": None
+    }
+
+    # ClinVar solo se utiliza en modo avanzado para las categorías PR y RR
+    if mode == "advanced" and ("pr" in categories or "rr" in categories):
+        print("Cargando la base de datos ClinVar...")
+        resources["clinvar_dct"] = get_clinvar_variants(evidence, clinvar_db, assembly, clinvar_backend)
+
+    # Catálogos de genes de riesgo personal y reproductivo
+    for category in ["pr", "rr"]:
+        if category in categories:
+            resources["genes_cat"][category] = load_genes_catalog(category, categories_path)
+
+    # Catálogo de variantes farmacogenéticas y tabla de diplotipos
+    if "fg" in categories:
+        resources["fg_json"] = load_fg_variants_json(categories_path, assembly)
+        resources["diplo_pheno_dct"] = get_diplotype_phenotype_dictionary(categories_path)
+
+    # Asociaciones gen-HPO (si el archivo no existe, se mantiene el comportamiento de check_diagnosis)
+    if ("pr" in categories or "rr" in categories) and os.path.exists(f"{categories_path}genes_to_phenotype.txt"):
+        resources["gene_hpo_dict"] = get_gene_hpo_dictionary(categories_path)
+
+    return(resources)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:34:09 2026
+
+@author: kindi
+"""
+import os
+import gzip
+import json
+import time
+import cProfile
+import resource
+import subprocess
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+# Etapas registradas en la traza, que pueden perfilarse con --profile
+TRACE_STAGES = ["run_shards", "normalize_vcf", "intersect_vcf_with_bed", "run_intervar", "parse_intervar_output", "run_clinvar_filtering",
+                "combine_results", "annotate_fg_variants", "assign_cyp2c9_diplotype", "assign_cyp2c19_diplotype",
+                "assign_dpyd_diplotype", "assign_nudt15_diplotype", "assign_tpmt_diplotype", "write_report"]
+
+_profile_lock = threading.Lock()
+
+def read_proc_io():
+    """
+    Lee los bytes leídos y escritos por el proceso desde /proc/self/io (solo Linux).
+
+    Returns:
+        dict: 'rchar' y 'wchar', o ceros si /proc/self/io no está disponible.
+    """
+    counters = {"rchar": 0, "wchar": 0}
+    try:
+        with open("/proc/self/io", "r") as proc_io:
+            for line in proc_io:
+                key, value = line.split(":")
+                if key in counters:
+                    counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters
+
+def get_file_size(path):
+    return os.path.getsize(path) if path is not None and os.path.exists(path) else 0
+
+class RunTrace:
+    """
+    Traza de una ejecución: tiempo, CPU, memoria, registros y E/S de cada etapa.
+    """
+    def __init__(self, vcf_file, profile_stage=None, profile_mode="cprofile", profile_path=None):
+        self.vcf_file = vcf_file
+        self.profile_stage = profile_stage
+        self.profile_mode = profile_mode
+        self.profile_path = profile_path
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.start = time.perf_counter()
+        self.stages = []
+        self.lock = threading.Lock()
+
+    def add_stage(self, stage):
+        with self.lock:
+            self.stages.append(stage)
+
+    def write(self, trace_file):
+        """
+        Guarda la traza en un archivo JSON.
+
+        Args:
+            trace_file (str): Ruta al archivo JSON de la traza.
+
+        Returns:
+            str: Ruta al archivo de la traza.
+        """
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with self.lock:
+            data = {
+                "vcf_file": self.vcf_file,
+                "started": self.started,
+                "wall_seconds": round(time.perf_counter() - self.start, 3),
+                "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+                "children_cpu_seconds": round(children.ru_utime + children.ru_stime, 3),
+                "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+                "children_peak_rss_mb": round(children.ru_maxrss / 1024, 1),
+                "stages": list(self.stages)
+            }
+        with open(trace_file, "w") as fout:
+            json.dump(data, fout, indent=4)
+        return(trace_file)
+
+def _profile_name(trace, name, info):
+    suffix = "_".join(str(value) for value in info.values())
+    return f"{trace.profile_path}{name}{'_' + suffix if suffix else ''}"
+
+@contextmanager
+def trace_stage(trace, name, inputs=None, outputs=None, **info):
+    """
+    Registra el tiempo real y de CPU, la memoria máxima, los registros y los bytes de E/S de una etapa.
+
+    El bloque puede completar el diccionario que se devuelve con 'records_in', 'records_out' y 'outputs'.
+    Si la etapa es la indicada en --profile, se ejecuta además con cProfile o tracemalloc.
+
+    Args:
+        trace (RunTrace): Traza de la ejecución (si es None, la etapa no se registra).
+        name (str): Nombre de la etapa.
+        inputs (list, optional): Archivos de entrada, para medir los bytes leídos.
+        outputs (list, optional): Archivos de salida, para medir los bytes escritos.
+        **info: Información adicional de la etapa (por ejemplo, la categoría).
+
+    Yields:
+        dict: El registro de la etapa.
+    """
+    stage = {"stage": name}
+    stage.update(info)
+    stage["records_in"] = None
+    stage["records_out"] = None
+    if trace is None:
+        yield stage
+        return
+
+    # Perfilado opcional de la etapa (solo una a la vez: PR y RR ejecutan las mismas etapas en paralelo)
+    profiler = None
+    profiling = trace.profile_stage == name and _profile_lock.acquire(blocking=False)
+    if profiling:
+        if trace.profile_mode == "tracemalloc":
+            tracemalloc.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+    proc_io = read_proc_io()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield stage
+        stage["status"] = "ok"
+    except Exception:
+        stage["status"] = "error"
+        raise
+    finally:
+        stage["wall_seconds"] = round(time.perf_counter() - wall, 3)
+        stage["cpu_seconds"] = round(time.thread_time() - cpu, 3)
+        children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+        stage["children_cpu_seconds"] = round((children_end.ru_utime + children_end.ru_stime) - (children.ru_utime + children.ru_stime), 3)
+        stage["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        stage["children_peak_rss_mb"] = round(children_end.ru_maxrss / 1024, 1)
+        proc_io_end = read_proc_io()
+        stage["process_bytes_read"] = proc_io_end["rchar"] - proc_io["rchar"]
+        stage["process_bytes_written"] = proc_io_end["wchar"] - proc_io["wchar"]
+        # Las salidas que solo se conocen al terminar la etapa se pueden añadir en stage["outputs"]
+        outputs = list(outputs or []) + stage.pop("outputs", [])
+        stage["input_bytes"] = sum(get_file_size(path) for path in inputs or [])
+        stage["output_bytes"] = sum(get_file_size(path) for path in outputs)
+
+        if profiler is not None:
+            profiler.disable()
+            profile_file = f"{_profile_name(trace, name, info)}.prof"
+            profiler.dump_stats(profile_file)
+            stage["profile"] = profile_file
+        elif profiling:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            profile_file = f"{_profile_name(trace, name, info)}_tracemalloc.txt"
+            with open(profile_file, "w") as fout:
+                fout.write(f"Memoria actual: {current / 1024 / 1024:.1f} MB, pico: {peak / 1024 / 1024:.1f} MB\n")
+                for statistic in snapshot.statistics("lineno")[:25]:
+                    fout.write(f"{statistic}\n")
+            stage["profile"] = profile_file
+        if profiling:
+            _profile_lock.release()
+        trace.add_stage(stage)
+
+def count_lines(path):
+    """
+    Cuenta las líneas de datos (sin cabecera) de un archivo de texto, comprimido o no con gzip.
+    """
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path, "rb") as file:
+        is_gzip = file.read(2) == b"\x1f\x8b"
+    with (gzip.open(path, "rb") if is_gzip else open(path, "rb")) as file:
+        return sum(1 for line in file if not line.startswith(b"#"))
+
+def count_indexed_records(vcf_path):
+    """
+    Número de registros de un VCF comprimido según su índice (bcftools index -n), sin leer el archivo: para
+    la traza de los VCF grandes (la entrada y el VCF normalizado). None si el VCF no tiene índice.
+    """
+    if vcf_path is None or not (os.path.exists(f"{vcf_path}.tbi") or os.path.exists(f"{vcf_path}.csi")):
+        return None
+    try:
+        output = subprocess.run(["bcftools", "index", "-n", vcf_path], capture_output=True, text=True, check=True).stdout
+        return int(output.strip())
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
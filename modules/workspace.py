@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:05:52 2026
+
+@author: kindi
+"""
+import os
+import time
+import fcntl
+import shutil
+import hashlib
+
+# Políticas de retención del directorio de trabajo al terminar la ejecución
+RETENTION_POLICIES = ["keep", "delete", "on_success"]
+
+LOCK_NAME = ".lock"
+
+class Workspace:
+    """
+    Directorio de trabajo aislado de una ejecución, que define las rutas de todos sus archivos intermedios.
+
+    Cada VCF de entrada tiene su propio directorio dentro de temp_path, identificado por su nombre y por
+    un hash de su ruta absoluta, de modo que dos muestras con el mismo nombre no comparten archivos. Las
+    ejecuciones concurrentes sobre el mismo VCF se serializan con un bloqueo del directorio, y la siguiente
+    reutiliza las etapas ya calculadas (checkpoint). Los archivos se nombran como '<nombre>_<sufijo>'.
+    """
+    def __init__(self, path, name, retention="keep"):
+        if retention not in RETENTION_POLICIES:
+            raise ValueError(f"Política de retención no válida: {retention} (opciones: {', '.join(RETENTION_POLICIES)})")
+        self.path = os.path.join(os.path.abspath(path), "")
+        self.name = name
+        self.retention = retention
+        self.lock_file = None
+        os.makedirs(self.path, exist_ok=True)
+
+    @classmethod
+    def for_input(cls, temp_path, vcf_file, retention="keep"):
+        """
+        Crea el directorio de trabajo de un VCF de entrada.
+
+        Args:
+            temp_path (str): Ruta al directorio de archivos intermedios.
+            vcf_file (str): Ruta al VCF de entrada.
+            retention (str): Política de retención ('keep', 'delete' u 'on_success').
+
+        Returns:
+            Workspace: El directorio de trabajo (debe usarse con 'with' para bloquearlo).
+        """
+        name = os.path.basename(vcf_file).split('.vcf')[0]
+        return cls(os.path.join(temp_path, cls.input_key(vcf_file)), name, retention)
+
+    @staticmethod
+    def input_key(vcf_file):
+        """
+        Identificador de un VCF de entrada: su nombre y un hash de su ruta absoluta. Nombra su directorio de
+        trabajo y sus archivos de resultados, que así tampoco se pisan entre muestras con el mismo nombre.
+        """
+        name = os.path.basename(vcf_file).split('.vcf')[0]
+        input_hash = hashlib.sha1(os.path.abspath(vcf_file).encode()).hexdigest()[:10]
+        return(f"{name}_{input_hash}")
+
+    def child(self, name, subdir=""):
+        """
+        Crea un directorio de trabajo dentro de este (por ejemplo, para cada muestra de una cohorte).
+        Su ciclo de vida depende del directorio padre.
+        """
+        return Workspace(os.path.join(self.path, subdir), name)
+
+    # Rutas de los archivos intermedios
+    def get_path(self, suffix):
+        return f"{self.path}{self.name}_{suffix}"
+
+    @property
+    def normalized_vcf(self):
+        return self.get_path("normalized.vcf.gz")
+
+    @property
+    def regions_bed(self):
+        return self.get_path("regions.bed")
+
+    def intersection_vcf(self, category):
+        return self.get_path(f"{category}_intersection.vcf")
+
+    @property
+    def intersection_hits(self):
+        return self.get_path("intersection_hits.tsv")
+
+    def intervar_prefix(self, category):
+        return self.get_path(category)
+
+    def intervar_output(self, category, assembly):
+        assembly_int = "hg19" if assembly == '37' else 'hg38'
+        return f"{self.intervar_prefix(category)}.{assembly_int}_multianno.txt.intervar"
+
+    # Bloqueo y retención
+    def lock(self):
+        """
+        Bloquea el directorio de trabajo; si otra ejecución lo está usando, espera a que termine.
+        """
+        lock_path = f"{self.path}{LOCK_NAME}"
+        while True:
+            os.makedirs(self.path, exist_ok=True)
+            lock_file = open(lock_path, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print(f"Esperando a otra ejecución que usa {self.path}...")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # La otra ejecución puede haber borrado el directorio al terminar (política de retención)
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+        # La fecha del bloqueo indica el último uso del directorio
+        os.utime(lock_path)
+        self.lock_file = lock_file
+
+    def unlock(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def cleanup(self, success):
+        """
+        Aplica la política de retención: 'keep' conserva los archivos, 'delete' los borra siempre y
+        'on_success' solo si la ejecución ha terminado sin errores.
+        """
+        if self.retention == "delete" or (self.retention == "on_success" and success):
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        self.lock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.cleanup(exc_type is None)
+        finally:
+            self.unlock()
+        return False
+
+def cleanup_workspaces(temp_path, max_age_days):
+    """
+    Borra los directorios de trabajo que no se han usado en los últimos días y que ninguna ejecución está usando.
+
+    Args:
+        temp_path (str): Ruta al directorio de archivos intermedios.
+        max_age_days (float): Antigüedad máxima en días (0 para no borrar nada).
+
+    Returns:
+        list: Directorios borrados.
+    """
+    removed = []
+    if not max_age_days or not os.path.isdir(temp_path):
+        return(removed)
+    cutoff = time.time() - max_age_days * 86400
+    for entry in os.listdir(temp_path):
+        lock_path = os.path.join(temp_path, entry, LOCK_NAME)
+        if not os.path.exists(lock_path) or os.path.getmtime(lock_path) > cutoff:
+            continue
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            shutil.rmtree(os.path.join(temp_path, entry), ignore_errors=True)
+            removed.append(entry)
+    return(removed)
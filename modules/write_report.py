@@ -6,7 +6,6 @@ Created on Mon Sep 25 23:26:14 2023
 """
 
 import json
-import pandas as pd
 
 def combine_variant_and_gene_info(variant_info, gene_info):
     """
@@ -35,9 +34,28 @@ def combine_variant_and_gene_info(variant_info, gene_info):
         "variants_to_report": gene_info.get("variants_to_report", ""),  # Usar get para manejar la falta de 'variants_to_report'
         "related_HPOs": 'NA'
     }
+    # Modo de varios niveles de evidencia (--evidence_tiers)
+    if "MaxEvidenceLevel" in variant_info:
+        combined_info["MaxEvidenceLevel"] = variant_info["MaxEvidenceLevel"]
     return combined_info
 
-def check_inheritance(results, category, categories_path):
+def load_genes_catalog(category, categories_path):
+    """
+    Carga el archivo JSON del catálogo de genes de una categoría.
+
+    Args:
+        category (str): Categoría de genes (pr o rr).
+        categories_path (str): Ruta al directorio categories.
+
+    Returns:
+        dict: El catálogo de genes de la categoría.
+    """
+    genes_cat_path = f"{categories_path}{category.upper()}/{category}_risk_genes.json"
+    with open(genes_cat_path, "r") as genes_cat_file:
+        genes_cat = json.load(genes_cat_file)
+    return(genes_cat)
+
+def check_inheritance(results, category, categories_path, genes_cat=None):
     """
     Comprueba la herencia de las variantes en función de la categoría de genes y genera un diccionario de variantes
     a informar según las reglas de herencia definidas en el archivo JSON de genes.
@@ -45,17 +63,17 @@ def check_inheritance(results, category, categories_path):
     Args:
         results (dict): Un diccionario de resultados de variantes.
         category (str): Categoría de genes para la anotación.
+        categories_path (str): Ruta al directorio categories.
+        genes_cat (dict, optional): Catálogo de genes ya cargado. Si no se indica, se lee el archivo JSON.
 
     Returns:
         dict: Un diccionario de variantes a informar siguiendo las reglas de herencia definidas.
     """    
 
     try:
-        # Cargar el archivo JSON de categoría de genes    
-        genes_cat_path = f"{categories_path}{category.upper()}/{category}_risk_genes.json"
-        genes_cat = None
-        with open(genes_cat_path, "r") as genes_cat_file:
-            genes_cat = json.load(genes_cat_file)
+        # Cargar el archivo JSON de categoría de genes si no se ha cargado previamente
+        if genes_cat is None:
+            genes_cat = load_genes_catalog(category, categories_path)
         
         # Crear diccionario de variantes a informar 
         reported_variants = {}
@@ -140,17 +158,15 @@ def check_inheritance(results, category, categories_path):
                
 #     return(hpo_data)
 
-def check_diagnosis(reported_results, hpos_user, categories_path):
+def get_gene_hpo_dictionary(categories_path):
     """
-    Comprueba si los HPOs del usuario coinciden con los resultados reportados.
+    Lee el archivo genes_to_phenotype.txt y asocia cada gen con sus HPOs.
 
-    Args:        
-        reported_results (dict): Resultados de diagnóstico reportados.
-        user_hpos (list): Lista de HPOs proporcionada por el usuario.
+    Args:
         categories_path (str): Ruta al directorio categories.
 
     Returns:
-        list: Lista de resultados coincidentes.
+        dict: Un diccionario con el símbolo del gen como clave y la lista de HPOs como valor.
     """
     # Inicializar un diccionario vacío para almacenar los datos
     gene_hpo_dict = {}
@@ -173,6 +189,25 @@ def check_diagnosis(reported_results, hpos_user, categories_path):
             # Si el gene_symbol no está en el diccionario, crea una nueva entrada con una lista que contiene el hpo_id
             else:
                 gene_hpo_dict[gene_symbol] = [hpo_id]
+    
+    return(gene_hpo_dict)
+
+def check_diagnosis(reported_results, hpos_user, categories_path, gene_hpo_dict=None):
+    """
+    Comprueba si los HPOs del usuario coinciden con los resultados reportados.
+
+    Args:        
+        reported_results (dict): Resultados de diagnóstico reportados.
+        user_hpos (list): Lista de HPOs proporcionada por el usuario.
+        categories_path (str): Ruta al directorio categories.
+        gene_hpo_dict (dict, optional): Asociaciones gen-HPO ya cargadas. Si no se indica, se lee genes_to_phenotype.txt.
+
+    Returns:
+        list: Lista de resultados coincidentes.
+    """
+    # Cargar las asociaciones gen-HPO si no se han cargado previamente
+    if gene_hpo_dict is None:
+        gene_hpo_dict = get_gene_hpo_dictionary(categories_path)
 
     for result in reported_results:
         # Comprueba si los hpos asociados al gen coinciden con los hpos del usuario
@@ -213,7 +248,7 @@ def get_hpos_from_txt(hpos_file):
         print(f"El archivo {hpos_file} no se encontró.")
         return []
 
-def write_report(pr_results, rr_results, fg_results, haplot_results, categories_path, out_path, categories, vcf_file, hpos_txt):
+def write_report(pr_results, rr_results, fg_results, haplot_results, categories_path, out_path, categories, vcf_file, hpos_txt, resources=None, report_name=None):
     """
     Escribe los resultados de las categorías PR, RR y FG en un archivo Excel.
 
@@ -222,23 +257,37 @@ def write_report(pr_results, rr_results, fg_results, haplot_results, categories_
         rr_results (dict): Resultados de la categoría RR.
         fg_results (dict): Resultados de la categoría FG.
         out_path (str): Ruta al archivo de salida.
+        resources (dict, optional): Recursos compartidos ya cargados (catálogos y asociaciones gen-HPO).
+        report_name (str, optional): Nombre con el que se guarda el informe; por defecto, el del VCF.
+    
+    Returns:
+        str: Ruta al archivo Excel generado.
     """
+    if resources is None:
+        resources = {}
+    genes_cats = resources.get("genes_cat", {})
+    gene_hpo_dict = resources.get("gene_hpo_dict")
+    
     try:
         # Obtener lista de HPOs
         hpos_user = get_hpos_from_txt(hpos_txt)
-        outfile = f"{out_path}{vcf_file.split('/')[-1].split('.vcf')[0]}_final_results.xlsx"
+        if report_name is None:
+            report_name = vcf_file.split('/')[-1].split('.vcf')[0]
+        outfile = f"{out_path}{report_name}_final_results.xlsx"
+        # pandas se importa aquí para no retrasar el arranque de la herramienta
+        import pandas as pd
         # Crear un objeto ExcelWriter para el archivo Excel
         with pd.ExcelWriter(outfile) as writer:
             for category in categories:
                 if category == 'pr':
-                    reported_results = check_inheritance(pr_results, category, categories_path)
-                    pr_final = check_diagnosis(reported_results, hpos_user, categories_path)  # pendiente de desarrollar, warning si los términos orpha se corresponden con los hpo del paciente
+                    reported_results = check_inheritance(pr_results, category, categories_path, genes_cats.get(category))
+                    pr_final = check_diagnosis(reported_results, hpos_user, categories_path, gene_hpo_dict)  # pendiente de desarrollar, warning si los términos orpha se corresponden con los hpo del paciente
                     results_df =  pd.DataFrame.from_dict(pr_final, orient='index')
                     results_df.to_excel(writer, sheet_name= category.upper() + ' results', index=True)
                     
                 elif category == 'rr':
-                    reported_results = check_inheritance(rr_results, category, categories_path)
-                    rr_final = check_diagnosis(reported_results, hpos_user, categories_path)  # pendiente de desarrollar, warning si los términos orpha se corresponden con los hpo del paciente
+                    reported_results = check_inheritance(rr_results, category, categories_path, genes_cats.get(category))
+                    rr_final = check_diagnosis(reported_results, hpos_user, categories_path, gene_hpo_dict)  # pendiente de desarrollar, warning si los términos orpha se corresponden con los hpo del paciente
                     results_df =  pd.DataFrame.from_dict(rr_final, orient='index')
                     results_df.to_excel(writer, sheet_name= category.upper() + ' results', index=True)
         
@@ -250,6 +299,7 @@ def write_report(pr_results, rr_results, fg_results, haplot_results, categories_
                     haplot_df.to_excel(writer, sheet_name='FG Diplotype-Phenotype', index=False)
                 
         print(f"Los resultados se han guardado en '{outfile}'.")
+        return(outfile)
         
     except Exception as e:
         print(f"Error en write_report: {str(e)}")
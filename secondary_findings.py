@@ -7,8 +7,12 @@ Esta herramienta permite a los usuarios analizar archivos VCF para el manejo aut
 
 @Dependencies InterVar and AnnoVar 
 @Usage python3 secondary_findings.py input_file.vcf --mode <Option: 'basic' or 'advanced'> --evidence <integer> --assembly <Option: '37' or '38'> 
+       python3 secondary_findings.py --manifest samples.tsv --categories pr,rr,fg --clinvar_update no
+       python3 secondary_findings.py cohort.vcf.gz --cohort --jobs 16
+       python3 secondary_findings.py serve --port 8765 --workers 4
 @Arguments:
     -vcf (str): Ruta al archivo VCF de entrada.
+    -manifest (str): Manifiesto TSV con varios VCF para el modo por lotes.
     -outpath (str): Ruta al directorio donde se guardarán los resultados.
     -mode (str): Modo de análisis (básico o avanzado).
     -evidence (int): Nivel de evidencia de ClinVar para el modo avanzado (1-4).#comprobar que lo he puesto de memoria
@@ -20,169 +24,619 @@ Esta herramienta permite a los usuarios analizar archivos VCF para el manejo aut
 @github github.com/edurlaf
 """
 
-#import sys
+import sys
 import os
 import json
+import time
+from functools import partial
 
-from modules.arguments import arguments
+from modules.arguments import arguments, serve_arguments
 from modules.get_json_bed import read_csv, get_gene_pos, write_bed_file, get_json_bed
 from modules.get_json_bed_fg import generate_json_from_fg_csv, generate_bed_from_fg_csv, get_json_bed_fg
-from modules.get_clinvar import process_clinvar_data, get_clinvar
-from modules.normalize_vcf import normalize_vcf
-from modules.intersect_vcf_bed import intersect_vcf_with_bed
+from modules.get_clinvar import process_clinvar_data, get_clinvar, get_latest_clinvar, CLINVAR_URL
+from modules.normalize_vcf import normalize_vcf, write_regions_bed
+from modules.intersect_vcf_bed import intersect_vcf_with_beds
 from modules.run_pr_module import run_intervar, parse_intervar_output, map_review_status, run_clinvar_filtering, combine_results, write_combined_results_to_tsv, run_personal_risk_module
 from modules.run_rr_module import run_reproductive_risk_module, run_intervar
 from modules.run_fg_module import annotate_fg_variants, check_gene_variants, assign_cyp2c9_diplotype, assign_cyp2c19_diplotype, assign_dpyd_diplotype, assign_nudt15_diplotype, assign_tpmt_diplotype, get_diplotype_phenotype_dictionary, run_pharmacogenomic_risk_module
 from modules.write_report import combine_variant_and_gene_info, check_inheritance, check_diagnosis, get_hpos_from_txt, write_report
+from modules.shared_resources import load_shared_resources
+from modules.batch import read_manifest, write_batch_summary
+from modules.cohort import run_cohort
+from modules.server import run_server
+from modules.trace import RunTrace, trace_stage, count_lines, count_indexed_records
+from modules.workspace import Workspace, cleanup_workspaces
+from modules.scheduler import Stage, StageScheduler
+from modules.clinvar_shard import restrict_clinvar_db
+from modules.clinvar_store import materialize_release
+from modules.clinvar_provider import get_clinvar_variants
+from modules.findings_store import write_findings
+from modules.clinvar_vcf import get_clinvar_vcf, CLINVAR_VCF_URL
+from modules.sharding import run_sharded
 
-def main():
-    
+def read_config():
     """
-    Read config file
+    Lee el archivo de configuración config.json.
+    
+    Returns:
+        dict: Los valores del archivo de configuración.
     """
-    # Leer el archivo de configuración config.json
     with open("./config.json", "r") as config_file:
         config_data = json.load(config_file)
-    
-    # Obtener los valores del archivo de configuración
-    dir_path = config_data["dir_path"]
-    categories_path = config_data["categories_path"]
-    clinvar_path = config_data["clinvar_path"]
-    temp_path = config_data["temp_path"]
-    out_path = config_data["out_path"]
-    intervar_path = config_data["intervar_path"]
+    return(config_data)
 
-    """ 
-    Create clinvar, temp and final_output directories
-    """    
-    # Comprobar si los directorios 'clinvar', 'temp' y 'final_output' existen y crearlos si no
-    for folder in [clinvar_path, temp_path, out_path]:
-        if not os.path.exists(folder):
-            os.mkdir(folder)       
-    
-    """
-    Get the arguments
+def get_categories(categories_arg, config_data, interactive):
     """
-    args = arguments()
+    Obtiene las categorías a analizar a partir del argumento, de config.json o, en modo interactivo, del usuario.
     
-    # Argumentos del usuario
-    vcf_file = args.vcf_file
-    mode = args.mode
-    evidence = args.evidence
-    assembly = str(args.assembly)
-    hpos_txt = args.hpos_txt
-    
-    # Obtener la preferencia del usuario para las categorías a analizar (PR, RR, FG)
-    categories_usr = input("Elija las categorías a analizar (PR, RR, FG separados por comas): ") ####cambiar al config
-    categories = [category.strip().lower() for category in categories_usr.split(",")]
+    Args:
+        categories_arg (str): Categorías indicadas en la línea de comandos (o None).
+        config_data (dict): Valores del archivo de configuración.
+        interactive (bool): Si se puede preguntar al usuario.
     
+    Returns:
+        list: Lista de categorías en minúsculas.
     
+    Raises:
+        ValueError: Si no se han indicado categorías y no se puede preguntar al usuario.
+    """
+    categories_usr = categories_arg or config_data.get("categories", "")
+    if not categories_usr:
+        if not interactive:
+            raise ValueError("En modo por lotes las categorías deben indicarse con --categories o en config.json.")
+        categories_usr = input("Elija las categorías a analizar (PR, RR, FG separados por comas): ")
+    categories = [category.strip().lower() for category in categories_usr.split(",") if category.strip()]
+    return(categories)
+
+def generate_catalog(category, assembly, categories_path):
     """
-    Generate JSON and BED files 
+    Genera los archivos JSON y BED del catálogo de una categoría si no existen.
+    
+    Args:
+        category (str): Categoría del catálogo (pr, rr o fg).
+        assembly (str): Ensamblaje genómico a utilizar.
+        categories_path (str): Ruta al directorio categories.
     """
     # Comprobar si los archivos JSON existen
     # Catálogo de riesgo personal
-    if not os.path.exists(f"{categories_path}/PR/pr_risk_genes.json"):
+    if category == "pr" and not os.path.exists(f"{categories_path}/PR/pr_risk_genes.json"):
         print("Generando archivos JSON y BED para riesgo personal.") # mejor dentro de la función get_json
         get_json_bed("pr", assembly, categories_path)
         
     # Catálogo de riesgo reproductivo
-    if not os.path.exists(f"{categories_path}/RR/rr_risk_genes.json"):
+    elif category == "rr" and not os.path.exists(f"{categories_path}/RR/rr_risk_genes.json"):
         print("Generando archivos JSON y BED para riesgo reproductivo.") # mejor dentro de la función get_json
         get_json_bed("rr", assembly, categories_path)
         
     # Catálogo de riesgo farmacogenético
-    if not os.path.exists(f"{categories_path}/FG/fg_risk_variants_grch{assembly}.json"):
+    elif category == "fg" and not os.path.exists(f"{categories_path}/FG/fg_risk_variants_grch{assembly}.json"):
         print("Generando archivos JSON y BED para riesgo farmacogenético.") # mejor dentro de la función get_json
         get_json_bed_fg(assembly, categories_path)
-        
+
+def generate_catalogs(assembly, categories_path):
+    """
+    Genera los archivos JSON y BED de todos los catálogos si no existen.
     
+    Args:
+        assembly (str): Ensamblaje genómico a utilizar.
+        categories_path (str): Ruta al directorio categories.
     """
-    Get ClinVar database
+    for category in ["pr", "rr", "fg"]:
+        generate_catalog(category, assembly, categories_path)
+
+def get_clinvar_db(clinvar_path, clinvar_update, clinvar_url=CLINVAR_URL, clinvar_sqlite=False):
     """
-    # Si el modo es avanzado, comprobar si se ha descargado la BD ClinVar
-    if mode == 'advanced':
-        clinvar_files = [file for file in os.listdir(clinvar_path) if file.startswith("clinvar_database_")]
-        
-        # Si hay archivos clinvar, seleccionar el más reciente
-        if clinvar_files:
-            clinvar_files.sort(reverse=True)
-            last_clinvar = clinvar_files[0]
-
-            # Obtener la versión del nombre del archivo
-            last_version = last_clinvar.split('_')[3].split('.')[0]      
-            #print(f"El archivo ClinVar más reciente encontrado es {archivo_mas_reciente}.")
-            print(f"La versión actual del archivo ClinVar es {last_version}.")
-        
-            # Preguntar al usuario si desea actualizar el archivo
-            answr = input("¿Deseas actualizarlo? (S/N): ")       
-            if answr.lower() == "s":
-                # Descargar el archivo actualizado
-                clinvar_db = get_clinvar(clinvar_path)
-            else:
-                print("No se actualizará el archivo ClinVar.")
-                clinvar_db = f"{clinvar_path}{last_clinvar}"
-        # Si no se encuentran archivos ClinVar, descargarlo y guardarlo
+    Obtiene la base de datos ClinVar más reciente y la actualiza según la política indicada.
+    
+    Args:
+        clinvar_path (str): Ruta al directorio clinvar.
+        clinvar_update (str): Política de actualización: 'ask' (preguntar), 'yes' (actualizar) o 'no'.
+        clinvar_url (str): URL del archivo variant_summary.txt.gz.
+        clinvar_sqlite (bool): Generar también las bases de datos SQLite al descargar ClinVar (backend 'sqlite').
+    
+    Returns:
+        str: Ruta al archivo de base de datos ClinVar.
+    """
+    # Si hay archivos clinvar, seleccionar el más reciente
+    last_clinvar = get_latest_clinvar(clinvar_path)
+    if last_clinvar is not None:
+
+        # Obtener la versión del nombre del archivo
+        last_version = last_clinvar.split('_')[-1].split('.')[0]      
+        #print(f"El archivo ClinVar más reciente encontrado es {archivo_mas_reciente}.")
+        print(f"La versión actual del archivo ClinVar es {last_version}.")
+    
+        # Preguntar al usuario si desea actualizar el archivo
+        if clinvar_update == "ask":
+            answr = input("¿Deseas actualizarlo? (S/N): ")
+            clinvar_update = "yes" if answr.lower() == "s" else "no"
+        if clinvar_update == "yes":
+            # Descargar el archivo actualizado
+            clinvar_db = get_clinvar(clinvar_path, clinvar_url, clinvar_sqlite)
         else:
-            print("No se encontraron archivos ClinVar en el directorio.")
-            print("El archivo ClinVar se descargará.")
-            clinvar_db = get_clinvar(clinvar_path)
+            print("No se actualizará el archivo ClinVar.")
+            clinvar_db = last_clinvar
+    # Si no se encuentran archivos ClinVar, descargarlo y guardarlo
     else:
-        clinvar_db = None
+        print("No se encontraron archivos ClinVar en el directorio.")
+        print("El archivo ClinVar se descargará.")
+        clinvar_db = get_clinvar(clinvar_path, clinvar_url, clinvar_sqlite)
+    
+    return(clinvar_db)
 
+def get_clinvar_release(clinvar_path, assembly, clinvar_release):
     """
-    Comprobar dependencias
+    Obtiene una versión concreta de ClinVar del almacén de versiones, reconstruyéndola si hace falta.
+    
+    Args:
+        clinvar_path (str): Ruta al directorio clinvar.
+        assembly (str): Ensamblaje genómico a utilizar.
+        clinvar_release (str): Versión de ClinVar (AAAAMMDD).
+    
+    Returns:
+        str: Ruta al archivo de base de datos ClinVar de esa versión.
     """
-    # Comprobar si InterVar está en el path
-    if not os.path.exists(intervar_path):
-        print("InterVar no está instalado. Por favor, instálalo para continuar.")
+    print(f"Se utilizará la versión {clinvar_release} de ClinVar.")
+    return(materialize_release(clinvar_path, f"GRCh{assembly}", clinvar_release))
+
+def ask_clinvar_update(clinvar_path):
+    """
+    Pregunta al usuario si desea actualizar ClinVar, antes de empezar el análisis, para que la
+    descarga se pueda ejecutar como una etapa más sin esperar la respuesta.
+    
+    Args:
+        clinvar_path (str): Ruta al directorio clinvar.
+    
+    Returns:
+        str: 'yes' si hay que actualizarlo (o no hay ningún archivo ClinVar) y 'no' en caso contrario.
+    """
+    last_clinvar = get_latest_clinvar(clinvar_path)
+    if last_clinvar is None:
+        return("yes")
+    last_version = last_clinvar.split('_')[-1].split('.')[0]
+    answr = input(f"La versión actual del archivo ClinVar es {last_version}. ¿Deseas actualizarlo? (S/N): ")
+    return("yes" if answr.lower() == "s" else "no")
+
+def get_setup_stages(mode, assembly, config_data, clinvar_update, clinvar_release=None):
+    """
+    Etapas de preparación comunes a todas las muestras: la generación de los catálogos y la obtención de
+    la base de datos ClinVar (modo avanzado). Son independientes entre sí y del VCF de entrada.
+    
+    Args:
+        mode (str): Modo de análisis ("basic" o "advanced").
+        assembly (str): Ensamblaje genómico a utilizar.
+        config_data (dict): Valores del archivo de configuración.
+        clinvar_update (str): Política de actualización de ClinVar ('yes' o 'no').
+        clinvar_release (str, optional): Versión de ClinVar del almacén a utilizar (por defecto, la más reciente).
+    
+    Returns:
+        list: Etapas que producen 'catalog_pr', 'catalog_rr', 'catalog_fg' y, en modo avanzado, 'clinvar_db'.
+    """
+    stages = [Stage(f"generate_catalog_{category}", partial(generate_catalog, category, assembly, config_data["categories_path"]),
+                    outputs=[f"catalog_{category}"]) for category in ["pr", "rr", "fg"]]
+    if mode == "advanced":
+        if clinvar_release is not None:
+            get_clinvar_stage = Stage("get_clinvar_db", partial(get_clinvar_release, config_data["clinvar_path"], assembly, clinvar_release),
+                                      outputs=["clinvar_db"])
+        else:
+            get_clinvar_stage = Stage("get_clinvar_db", partial(get_clinvar_db, config_data["clinvar_path"], clinvar_update,
+                                                                config_data.get("clinvar_url", CLINVAR_URL),
+                                                                config_data.get("clinvar_backend", "index") == "sqlite"), outputs=["clinvar_db"])
+        stages.append(get_clinvar_stage)
+        # Fragmento de ClinVar con las regiones de los catálogos: espera a ClinVar y a los catálogos PR y RR
+        if config_data.get("clinvar_catalog_shard", False):
+            get_clinvar_stage.outputs = ["clinvar_release"]
+            get_clinvar_stage = Stage("restrict_clinvar_db", partial(restrict_clinvar_stage, assembly, config_data),
+                                      inputs=["clinvar_release", "catalog_pr", "catalog_rr"], outputs=["clinvar_db"])
+            stages.append(get_clinvar_stage)
+        # VCF de ClinVar normalizado (backend 'vcf'): la base de datos no está lista hasta que lo esté el VCF
+        if config_data.get("clinvar_backend", "index") == "vcf":
+            get_clinvar_stage.outputs = ["clinvar_source"]
+            stages.append(Stage("get_clinvar_vcf", partial(get_clinvar_vcf_stage, assembly, config_data, clinvar_update),
+                                inputs=["clinvar_source"], outputs=["clinvar_db"]))
+    return(stages)
+
+def restrict_clinvar_stage(assembly, config_data, clinvar_db, catalog_pr, catalog_rr):
+    """
+    Etapa que sustituye la base de datos ClinVar por su fragmento de los catálogos PR y RR.
+    """
+    return(restrict_clinvar_db(clinvar_db, assembly, config_data))
+
+def get_clinvar_vcf_stage(assembly, config_data, clinvar_update, clinvar_db):
+    """
+    Etapa que descarga (si hace falta) y normaliza el VCF de ClinVar del backend 'vcf'.
+    """
+    get_clinvar_vcf(config_data["clinvar_path"], assembly, clinvar_update, config_data.get("clinvar_vcf_url", CLINVAR_VCF_URL))
+    return(clinvar_db)
+
+def run_setup(mode, assembly, config_data, clinvar_update, jobs=1, clinvar_release=None):
+    """
+    Ejecuta las etapas de preparación (catálogos y ClinVar) con hasta 'jobs' trabajadores.
+    
+    Returns:
+        str: Ruta al archivo de base de datos ClinVar (None en modo básico).
+    """
+    scheduler = StageScheduler(jobs)
+    scheduler.extend(get_setup_stages(mode, assembly, config_data, clinvar_update, clinvar_release))
+    return(scheduler.run().get("clinvar_db"))
+
+def normalize_sample(vcf_file, workspace, assembly, categories, config_data, force, trace, *catalogs):
+    """
+    Etapa de normalización del VCF de entrada. Con 'normalize_catalog_regions' en config.json, solo se
+    normalizan las regiones de los catálogos de las categorías elegidas, así que espera a los catálogos.
+    
+    Returns:
+        tuple: Ruta al VCF normalizado y número de registros.
+    """
+    with trace_stage(trace, "normalize_vcf", inputs=[vcf_file]) as stage:
+        regions_bed = None
+        if config_data.get("normalize_catalog_regions", False):
+            regions_bed = write_regions_bed(workspace, categories, assembly, config_data["categories_path"],
+                                            config_data.get("normalize_padding", 200))
+        norm_vcf = normalize_vcf(vcf_file, workspace, assembly, force, config_data.get("normalize_threads", 0),
+                                 config_data.get("normalize_compression_level", 6), regions_bed,
+                                 config_data.get("normalize_engine", "bcftools"), config_data.get("normalize_native_max_bytes", 1000000))
+        # Recuentos del índice: contar las líneas obligaría a descomprimir la entrada y la salida completas
+        stage["records_in"] = count_indexed_records(vcf_file)
+        stage["records_out"] = count_indexed_records(norm_vcf)
+        stage["outputs"] = [norm_vcf]
+    return(norm_vcf, stage["records_out"])
 
+def intersect_sample(workspace, categories, assembly, categories_path, force, trace, norm_vcf, norm_records, *catalogs):
+    """
+    Etapa de intersección del VCF normalizado con los archivos BED de todas las categorías, en una sola
+    lectura del VCF.
     
+    Returns:
+        tuple: Rutas a los VCF de las intersecciones, en el orden de las categorías.
     """
-    Normalizar VCF de entrada
+    with trace_stage(trace, "intersect_vcf_with_bed", inputs=[norm_vcf], category=",".join(categories)) as stage:
+        intersect_vcf_with_beds(workspace, categories, assembly, categories_path, force, norm_vcf)
+        intersection_vcfs = tuple(workspace.intersection_vcf(category) for category in categories)
+        stage["records_in"] = norm_records
+        stage["records_out"] = sum(count_lines(intersection_vcf) for intersection_vcf in intersection_vcfs)
+        stage["outputs"] = list(intersection_vcfs) + [workspace.intersection_hits]
+    return(intersection_vcfs if len(intersection_vcfs) > 1 else intersection_vcfs[0])
+
+def shard_sample(vcf_file, workspace, assembly, categories, config_data, force_stages, trace, *catalogs):
     """
-    norm_vcf = normalize_vcf(vcf_file, temp_path, assembly)
+    Etapa de normalización, intersección e InterVar por fragmentos de cromosomas, en un pool de procesos
+    ('shards' en config.json o --shards). Si el VCF de entrada no se puede fragmentar, se normaliza y se
+    intersecta como siempre.
     
+    Returns:
+        tuple: Rutas a los VCF de las intersecciones, en el orden de las categorías.
     """
-    Realizar la intersección con los archivos BED
+    with trace_stage(trace, "run_shards", inputs=[vcf_file]) as stage:
+        sharded = run_sharded(vcf_file, workspace, categories, assembly, config_data, config_data["shards"], force_stages)
+        stage["records_in"] = count_indexed_records(vcf_file)
+    if not sharded:
+        norm_vcf, norm_records = normalize_sample(vcf_file, workspace, assembly, categories, config_data, "normalize" in force_stages, trace, *catalogs)
+        intersect_sample(workspace, categories, assembly, config_data["categories_path"], "intersect" in force_stages, trace, norm_vcf, norm_records)
+    intersection_vcfs = tuple(workspace.intersection_vcf(category) for category in categories)
+    return(intersection_vcfs if len(intersection_vcfs) > 1 else intersection_vcfs[0])
+
+def load_clinvar(evidence, assembly, clinvar_backend, trace, clinvar_db):
     """
-    for category in categories:
-        intersect_vcf_with_bed(norm_vcf, category, assembly, categories_path)
+    Etapa de lectura de la base de datos ClinVar, compartida por los módulos PR y RR.
     
+    Returns:
+        dict: Variantes de ClinVar filtradas por nivel de evidencia.
     """
-    Ejecutar los módulos que correspondan:
+    with trace_stage(trace, "run_clinvar_filtering") as stage:
+        clinvar_dct = get_clinvar_variants(evidence, clinvar_db, assembly, clinvar_backend)
+        stage["records_out"] = len(clinvar_dct)
+    return(clinvar_dct)
+
+def run_category_module(category, workspace, assembly, mode, evidence, config_data, resources, force_stages, trace, intersection_vcf, clinvar_db=None, clinvar_dct=None):
     """
-    # Verificar y ejecutar los módulos elegidos por el usuario
-    if "pr" in categories:
+    Etapa del módulo de una categoría (PR, RR o FG), una vez hecha su intersección.
+    
+    Returns:
+        Los resultados del módulo (en FG, los resultados y los diplotipos).
+    """
+    categories_path = config_data["categories_path"]
+    intervar_path = config_data["intervar_path"]
+    if category == "pr":
         # Ejecutar el módulo de riesgo personal (PR)
         print("Ejecutando módulo de riesgo personal...")
-        pr_results = run_personal_risk_module(norm_vcf, assembly, mode, evidence, clinvar_db, categories_path, intervar_path)
-    else:
-        pr_results = None
-        
-    if "rr" in categories:
+        return(run_personal_risk_module(workspace, assembly, mode, evidence, clinvar_db, categories_path, intervar_path, clinvar_dct, "intervar" in force_stages, trace,
+                                        config_data.get("evidence_tiers", False)))
+    elif category == "rr":
         # Ejecutar el módulo de riesgo reproductivo (RR)
         print("Ejecutando módulo de riesgo reproductivo...")
-        rr_results = run_reproductive_risk_module(norm_vcf, assembly, mode, evidence, clinvar_db, categories_path, intervar_path)
-    else:
-        rr_results = None        
-        
-    if "fg" in categories:
+        return(run_reproductive_risk_module(workspace, assembly, mode, evidence, clinvar_db, categories_path, intervar_path, clinvar_dct, "intervar" in force_stages, trace,
+                                            config_data.get("evidence_tiers", False)))
+    elif category == "fg":
         # Ejecutar el módulo farmacogenético (FG)
         print("Ejecutando módulo farmacogenético...")
-        fg_results, haplot_results = run_pharmacogenomic_risk_module(categories_path, norm_vcf, assembly, temp_path)
-    else:
-        fg_results = None    
-        haplot_results = None
+        return(run_pharmacogenomic_risk_module(categories_path, workspace, assembly, resources.get("fg_json"), resources.get("diplo_pheno_dct"), trace))
+
+def write_sample_report(vcf_file, hpos_txt, categories, config_data, resources, trace, sample, pr_results, rr_results, fg_results, haplot_results):
+    """
+    Etapa de escritura del informe, cuando han terminado todos los módulos.
+    
+    Returns:
+        str: Ruta al informe generado.
+    """
     # Informar al usuario que los módulos han sido ejecutados
     print("Módulos de análisis completados.")
+    with trace_stage(trace, "write_report") as stage:
+        out_file = write_report(pr_results, rr_results, fg_results, haplot_results, config_data["categories_path"], config_data["out_path"], categories, vcf_file, hpos_txt, resources, sample)
+        stage["records_in"] = sum(len(results) for results in [pr_results, rr_results, fg_results, haplot_results] if results)
+        stage["outputs"] = [out_file]
+    # Hallazgos PR y RR en la base de datos de hallazgos, para las consultas de los curadores
+    if config_data.get("findings_db") and out_file:
+        write_findings(config_data["findings_db"], sample, {"pr": pr_results, "rr": rr_results}, out_file)
+    return(out_file)
+
+def analyze_sample(vcf_file, hpos_txt, categories, mode, evidence, assembly, clinvar_db, config_data, resources=None, jobs=1, force_stages=None, profile_stage=None, profile_mode="cprofile", retention="keep", setup_stages=None):
+    """
+    Analiza un VCF: normalización, intersección, módulos de cada categoría e informe final.
     
+    Las etapas se ejecutan como un grafo de dependencias: cada una empieza en cuanto están listas sus
+    entradas, con hasta 'jobs' etapas a la vez. Así, la lectura de ClinVar se solapa con la normalización
+    y con InterVar, y el módulo FG no espera a que termine InterVar en los módulos PR y RR.
     
+    Args:
+        vcf_file (str): Ruta al archivo VCF de entrada.
+        hpos_txt (str): Ruta al archivo de HPOs (o None).
+        categories (list): Categorías a analizar.
+        mode (str): Modo de análisis ("basic" o "advanced").
+        evidence (int): Nivel de evidencia de ClinVar.
+        assembly (str): Ensamblaje genómico a utilizar.
+        clinvar_db (str): Ruta al archivo de base de datos ClinVar (None en modo básico, o si la obtiene una etapa de preparación).
+        config_data (dict): Valores del archivo de configuración.
+        resources (dict, optional): Recursos compartidos ya cargados (modo por lotes).
+        jobs (int): Número máximo de etapas ejecutadas en paralelo.
+        force_stages (list, optional): Etapas que se repiten aunque sus entradas no hayan cambiado.
+        profile_stage (str, optional): Etapa que se perfila con cProfile o tracemalloc.
+        profile_mode (str): Perfilador a utilizar ("cprofile" o "tracemalloc").
+        retention (str): Política de retención de los archivos intermedios ('keep', 'delete' u 'on_success').
+        setup_stages (list, optional): Etapas de preparación (catálogos y ClinVar) que se ejecutan junto a
+            las de la muestra. Si no se indican, los catálogos deben existir ya.
+    
+    Returns:
+        str: Ruta al informe generado.
     """
-    Generar el informe de salida
+    categories_path = config_data["categories_path"]
+    temp_path = config_data["temp_path"]
+    out_path = config_data["out_path"]
+    if resources is None:
+        resources = {}
+    if force_stages is None:
+        force_stages = []
+    if setup_stages is None:
+        setup_stages = []
+    
+    # Traza de la ejecución, que se guarda junto al informe; los dos se nombran como el directorio de trabajo
+    sample = Workspace.input_key(vcf_file)
+    trace = RunTrace(vcf_file, profile_stage, profile_mode, f"{out_path}{sample}_")
+    
+    # Datos iniciales del grafo: lo que ya está disponible antes de empezar
+    data = {}
+    setup_outputs = [output for stage in setup_stages for output in stage.outputs]
+    for category in ["pr", "rr", "fg"]:
+        if f"catalog_{category}" not in setup_outputs:
+            data[f"catalog_{category}"] = None
+        # Las categorías no elegidas no tienen resultados
+        if category not in categories:
+            data[f"{category}_results"] = None
+    if "fg" not in categories:
+        data["haplot_results"] = None
+    if clinvar_db is not None:
+        data["clinvar_db"] = clinvar_db
+    if resources.get("clinvar_dct") is not None:
+        data["clinvar_dct"] = resources["clinvar_dct"]
+    
+    # Directorio de trabajo propio de la muestra: los archivos intermedios de otras ejecuciones no se pisan
+    with Workspace.for_input(temp_path, vcf_file, retention) as workspace:
+        scheduler = StageScheduler(jobs)
+        scheduler.extend(setup_stages)
+        
+        """
+        Normalizar VCF de entrada
+        """
+        normalize_inputs = [f"catalog_{category}" for category in categories] if config_data.get("normalize_catalog_regions", False) else []
+        sharded = config_data.get("shards", 0) > 1
+        if sharded:
+            # Normalización, intersección e InterVar por fragmentos de cromosomas, en un pool de procesos
+            scheduler.add("shard_sample", partial(shard_sample, vcf_file, workspace, assembly, categories, config_data, force_stages, trace),
+                          inputs=[f"catalog_{category}" for category in categories], outputs=[f"intersection_{category}" for category in categories])
+        else:
+            scheduler.add("normalize_vcf", partial(normalize_sample, vcf_file, workspace, assembly, categories, config_data, "normalize" in force_stages, trace),
+                          inputs=normalize_inputs, outputs=["normalized_vcf", "normalized_records"])
+        
+        """
+        Cargar ClinVar (modo avanzado), en paralelo con la normalización y con InterVar
+        """
+        clinvar_inputs = []
+        if mode == "advanced" and ("pr" in categories or "rr" in categories):
+            if "clinvar_dct" not in data:
+                scheduler.add("load_clinvar", partial(load_clinvar, evidence, assembly, config_data.get("clinvar_backend", "index"), trace), inputs=["clinvar_db"], outputs=["clinvar_dct"])
+            clinvar_inputs = ["clinvar_db", "clinvar_dct"]
+        
+        """
+        Realizar la intersección con los archivos BED (todas las categorías en una sola lectura del VCF)
+        """
+        if not sharded:
+            scheduler.add("intersect", partial(intersect_sample, workspace, categories, assembly, categories_path, "intersect" in force_stages, trace),
+                          inputs=["normalized_vcf", "normalized_records"] + [f"catalog_{category}" for category in categories],
+                          outputs=[f"intersection_{category}" for category in categories])
+        
+        """
+        Ejecutar los módulos que correspondan:
+        """
+        # Cada módulo empieza cuando termina su intersección; PR y RR esperan además a ClinVar en modo avanzado
+        for category in categories:
+            module = partial(run_category_module, category, workspace, assembly, mode, evidence, config_data, resources, force_stages, trace)
+            if category == "fg":
+                scheduler.add("fg_module", module, inputs=["intersection_fg"], outputs=["fg_results", "haplot_results"])
+            else:
+                scheduler.add(f"{category}_module", module, inputs=[f"intersection_{category}"] + clinvar_inputs, outputs=[f"{category}_results"])
+    
+        """
+        Generar el informe de salida
+        """
+        # El informe espera a todos los módulos elegidos
+        report_inputs = ["pr_results", "rr_results", "fg_results", "haplot_results"]
+        scheduler.add("write_report", partial(write_sample_report, vcf_file, hpos_txt, categories, config_data, resources, trace, sample),
+                      inputs=report_inputs, outputs=["report"])
+        out_file = scheduler.run(data)["report"]
+        print("Informe de resultados generado.\n ---Finalizado---")
+    
+    # Guardar la traza de la ejecución junto al informe
+    trace_file = trace.write(f"{out_path}{sample}_run_trace.json")
+    print(f"Traza de la ejecución guardada en '{trace_file}'.")
+    
+    return(out_file)
+
+def run_batch(manifest, categories, mode, evidence, assembly, clinvar_db, config_data, jobs=1, force_stages=None, profile_stage=None, profile_mode="cprofile", retention="keep"):
+    """
+    Analiza todas las muestras de un manifiesto en un solo proceso, cargando una vez los recursos compartidos.
+    
+    Args:
+        manifest (str): Ruta al manifiesto TSV.
+        categories (list): Categorías a analizar.
+        mode (str): Modo de análisis ("basic" o "advanced").
+        evidence (int): Nivel de evidencia de ClinVar.
+        assembly (str): Ensamblaje genómico a utilizar.
+        clinvar_db (str): Ruta al archivo de base de datos ClinVar (None en modo básico).
+        config_data (dict): Valores del archivo de configuración.
+        jobs (int): Número máximo de módulos de categoría ejecutados en paralelo.
+        force_stages (list, optional): Etapas que se repiten aunque sus entradas no hayan cambiado.
+        profile_stage (str, optional): Etapa que se perfila con cProfile o tracemalloc.
+        profile_mode (str): Perfilador a utilizar ("cprofile" o "tracemalloc").
+        retention (str): Política de retención de los archivos intermedios de cada muestra.
+    """
+    batch_start = time.perf_counter()
+    samples = read_manifest(manifest)
+    print(f"Modo por lotes: {len(samples)} muestras en {manifest}.")
+    
+    # Cargar una sola vez los recursos compartidos por todas las muestras
+    resources = load_shared_resources(categories, mode, evidence, assembly, clinvar_db, config_data["categories_path"], config_data.get("clinvar_backend", "index"))
+    
+    batch_results = []
+    for sample in samples:
+        sample_start = time.perf_counter()
+        print(f"\nAnalizando {sample['vcf_file']}...")
+        try:
+            out_file = analyze_sample(sample["vcf_file"], sample["hpos_txt"], categories, mode, evidence, assembly, clinvar_db, config_data, resources, jobs, force_stages, profile_stage, profile_mode, retention)
+            status = "ok" if out_file else "error"
+        except Exception as e:
+            # Un error en una muestra no detiene el lote
+            print(f"Error al analizar {sample['vcf_file']}: {e}")
+            out_file = None
+            status = "error"
+        batch_results.append({
+            "vcf_file": sample["vcf_file"],
+            "status": status,
+            "seconds": time.perf_counter() - sample_start,
+            "report": out_file
+        })
+    
+    write_batch_summary(batch_results, config_data["out_path"], time.perf_counter() - batch_start)
+
+def main():
+    
+    """
+    Read config file
     """
-    out_file = write_report(pr_results, rr_results, fg_results, haplot_results, categories_path, out_path, categories, vcf_file, hpos_txt)
-    print("Informe de resultados generado.\n ---Finalizado---")
+    # Leer el archivo de configuración config.json
+    config_data = read_config()
+    
+    # Obtener los valores del archivo de configuración
+    dir_path = config_data["dir_path"]
+    categories_path = config_data["categories_path"]
+    clinvar_path = config_data["clinvar_path"]
+    temp_path = config_data["temp_path"]
+    out_path = config_data["out_path"]
+    intervar_path = config_data["intervar_path"]
+
+    """ 
+    Create clinvar, temp and final_output directories
+    """    
+    # Comprobar si los directorios 'clinvar', 'temp' y 'final_output' existen y crearlos si no
+    for folder in [clinvar_path, temp_path, out_path]:
+        if not os.path.exists(folder):
+            os.mkdir(folder)       
+    
+    # Borrar los directorios de trabajo que llevan más tiempo sin usarse del indicado en config.json
+    removed = cleanup_workspaces(temp_path, config_data.get("workspace_max_age_days", 0))
+    if removed:
+        print(f"Directorios de trabajo antiguos borrados: {len(removed)}.")
+    
+    """
+    Server mode
+    """
+    # Modo servidor: carga los recursos una vez y atiende trabajos hasta que se detiene
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve_args = serve_arguments()
+        run_server(config_data, analyze_sample, generate_catalogs, serve_args.host, serve_args.port, serve_args.socket,
+                   serve_args.workers, serve_args.max_queue, serve_args.preload)
+        return
+    
+    """
+    Get the arguments
+    """
+    args = arguments()
+    
+    # Argumentos del usuario
+    vcf_file = args.vcf_file
+    manifest = args.manifest
+    mode = args.mode
+    evidence = args.evidence
+    assembly = str(args.assembly)
+    hpos_txt = args.hpos_txt
+    
+    # En modo por lotes no se pregunta nada al usuario
+    interactive = manifest is None
+    
+    # Obtener la preferencia del usuario para las categorías a analizar (PR, RR, FG)
+    categories = get_categories(args.categories, config_data, interactive)
+    
+    # Política de actualización de ClinVar: argumento, config.json o, por defecto, preguntar (no en modo por lotes)
+    clinvar_update = args.clinvar_update or config_data.get("clinvar_update", "ask")
+    if clinvar_update == "ask" and not interactive:
+        clinvar_update = "no"
+    
+    # Modo de varios niveles de evidencia: argumento o config.json
+    config_data["evidence_tiers"] = args.evidence_tiers or config_data.get("evidence_tiers", False)
+    
+    # Fragmentos de cromosomas procesados en paralelo: argumento o config.json
+    config_data["shards"] = args.shards if args.shards is not None else config_data.get("shards", 0)
+    
+    # Política de retención de los archivos intermedios: argumento o config.json
+    retention = args.retention or config_data.get("workspace_retention", "keep")
+    
+    # La pregunta de actualización de ClinVar se hace antes de empezar, para no detener las etapas paralelas
+    if mode == 'advanced' and clinvar_update == "ask" and args.clinvar_release is None:
+        clinvar_update = ask_clinvar_update(clinvar_path)
+
+    """
+    Comprobar dependencias
+    """
+    # Comprobar si InterVar está en el path
+    if not os.path.exists(intervar_path):
+        print("InterVar no está instalado. Por favor, instálalo para continuar.")
+
+    """
+    Generar los catálogos, obtener ClinVar y analizar la muestra, el lote de muestras o la cohorte
+    """
+    # La generación de los catálogos y la obtención de ClinVar (modo avanzado) son etapas de preparación
+    # independientes. En el análisis de una muestra se ejecutan junto a sus etapas, de modo que la
+    # normalización no espera a ClinVar; en los modos por lotes y cohorte se ejecutan antes, en paralelo.
+    if manifest is not None:
+        clinvar_db = run_setup(mode, assembly, config_data, clinvar_update, args.jobs, args.clinvar_release)
+        run_batch(manifest, categories, mode, evidence, assembly, clinvar_db, config_data, args.jobs, args.force_stage, args.profile, args.profile_mode, retention)
+    elif args.cohort:
+        clinvar_db = run_setup(mode, assembly, config_data, clinvar_update, args.jobs, args.clinvar_release)
+        resources = load_shared_resources(categories, mode, evidence, assembly, clinvar_db, categories_path, config_data.get("clinvar_backend", "index"))
+        run_cohort(vcf_file, hpos_txt, categories, mode, evidence, assembly, clinvar_db, config_data, resources, args.jobs, args.force_stage, retention)
+    else:
+        analyze_sample(vcf_file, hpos_txt, categories, mode, evidence, assembly, None, config_data, jobs=args.jobs, force_stages=args.force_stage,
+                       profile_stage=args.profile, profile_mode=args.profile_mode, retention=retention,
+                       setup_stages=get_setup_stages(mode, assembly, config_data, clinvar_update, args.clinvar_release))
 
     
         